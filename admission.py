@@ -0,0 +1,179 @@
+"""Rate and concurrency limits for the expensive endpoints.
+
+ADMISSION_BUDGETS maps an endpoint to its budget:
+
+    rate         tokens added per second
+    burst        bucket size
+    concurrency  requests allowed in flight at once in one worker
+    methods      methods the budget applies to (default POST)
+
+Each request spends a token from a bucket per client IP and, when logged
+in, one per session account. Requests over budget get a 429 with
+Retry-After straight from before_request, without touching the database,
+so cheap pages keep their latency while expensive ones are saturated.
+
+Buckets live in process memory by default. With ADMISSION_BACKEND=sqlite
+they live in ADMISSION_DATABASE, so all workers on a host share them.
+"""
+import math
+import os
+import sqlite3
+import threading
+import time
+
+from flask import g, jsonify, request, session
+
+BUCKET_MAX_AGE = 3600
+
+
+class MemoryBuckets:
+    max_keys = 10000
+
+    def __init__(self):
+        self._buckets = {}
+        self._lock = threading.Lock()
+
+    def take(self, keys, rate, burst):
+        """Spend a token from each bucket in keys if all of them have one.
+
+        Returns 0 when the tokens were spent, else the seconds until every
+        bucket has one again; nothing is spent then.
+        """
+        now = time.monotonic()
+        with self._lock:
+            if len(self._buckets) >= self.max_keys:
+                for stale in [k for k, (_, updated) in self._buckets.items() if updated < now - BUCKET_MAX_AGE]:
+                    del self._buckets[stale]
+            tokens = {}
+            for key in keys:
+                level, updated = self._buckets.get(key, (burst, now))
+                tokens[key] = min(burst, level + (now - updated) * rate)
+            wait = _wait(tokens.values(), rate)
+            for key, level in tokens.items():
+                self._buckets[key] = (level if wait else level - 1, now)
+            return wait
+
+
+class SQLiteBuckets:
+    SCHEMA = '''
+    CREATE TABLE IF NOT EXISTS buckets (
+        key     TEXT PRIMARY KEY,
+        tokens  REAL NOT NULL,
+        updated REAL NOT NULL
+    ) WITHOUT ROWID;
+    '''
+
+    purge_every = 1000
+
+    def __init__(self, path):
+        self.path = path
+        self._local = threading.local()
+        self._takes = 0
+        # Created on a connection of its own, so a preloading master holds none across fork
+        db = sqlite3.connect(self.path, timeout=1)
+        try:
+            db.executescript(self.SCHEMA)
+        finally:
+            db.close()
+
+    def _connect(self):
+        # One connection per thread, opened in the process that uses it; a forked worker must not use its parent's
+        if getattr(self._local, 'pid', None) != os.getpid():
+            db = sqlite3.connect(self.path, timeout=1, isolation_level=None, check_same_thread=False)
+            db.execute('PRAGMA journal_mode = WAL')
+            # Buckets are throwaway state; losing the last writes on a crash is fine
+            db.execute('PRAGMA synchronous = OFF')
+            self._local.db = db
+            self._local.pid = os.getpid()
+        return self._local.db
+
+    def take(self, keys, rate, burst):
+        db = self._connect()
+        now = time.time()
+        db.execute('BEGIN IMMEDIATE')
+        try:
+            tokens = {}
+            for key in keys:
+                row = db.execute('SELECT tokens, updated FROM buckets WHERE key = ?', (key,)).fetchone()
+                tokens[key] = burst if row is None else min(burst, row[0] + (now - row[1]) * rate)
+            wait = _wait(tokens.values(), rate)
+            if not wait:
+                db.executemany('INSERT INTO buckets (key, tokens, updated) VALUES (?, ?, ?) '
+                               'ON CONFLICT(key) DO UPDATE SET tokens = excluded.tokens, updated = excluded.updated',
+                               [(key, level - 1, now) for key, level in tokens.items()])
+            self._takes += 1
+            if self._takes % self.purge_every == 0:
+                db.execute('DELETE FROM buckets WHERE updated < ?', (now - BUCKET_MAX_AGE,))
+            db.execute('COMMIT')
+        except Exception:
+            db.execute('ROLLBACK')
+            raise
+        return wait
+
+
+def _wait(levels, rate):
+    # Seconds until every bucket holds a whole token
+    return max((1 - level) / rate if level < 1 else 0 for level in levels)
+
+
+class Admission:
+    def __init__(self, config):
+        self.budgets = config['ADMISSION_BUDGETS']
+        if config['ADMISSION_BACKEND'] == 'sqlite':
+            self.buckets = SQLiteBuckets(config['ADMISSION_DATABASE'])
+        else:
+            self.buckets = MemoryBuckets()
+        self.slots = {endpoint: threading.BoundedSemaphore(budget['concurrency'])
+                      for endpoint, budget in self.budgets.items() if budget.get('concurrency')}
+
+    def _client_keys(self, endpoint):
+        keys = [f'{endpoint}:ip:{request.remote_addr}']
+        for role_key in ('user_id', 'shop_id', 'admin_id'):
+            if role_key in session:
+                keys.append(f'{endpoint}:{role_key}:{session[role_key]}')
+        return keys
+
+    def admit(self):
+        endpoint = request.endpoint
+        budget = self.budgets.get(endpoint)
+        if budget is None or request.method not in budget.get('methods', ('POST',)):
+            return None
+
+        # Every bucket is checked before any is spent, so a request turned away by one costs the others nothing
+        try:
+            wait = self.buckets.take(self._client_keys(endpoint), budget['rate'], budget['burst'])
+        except sqlite3.OperationalError:
+            wait = 1  # shared store is locked up; shed load rather than queue
+        if wait:
+            return too_many_requests(wait)
+
+        slots = self.slots.get(endpoint)
+        if slots is not None:
+            if not slots.acquire(blocking=False):
+                return too_many_requests(1)
+            g.admission_slot = slots
+        return None
+
+    @staticmethod
+    def release(exception=None):
+        slots = g.pop('admission_slot', None)
+        if slots is not None:
+            slots.release()
+
+
+def too_many_requests(wait):
+    message = 'Too many requests. Please try again shortly.'
+    if request.is_json or request.accept_mimetypes.best == 'application/json':
+        response = jsonify({'status': 'error', 'message': message})
+    else:
+        response = message
+    return response, 429, {'Retry-After': str(max(1, math.ceil(wait)))}
+
+
+def init_app(app):
+    if not app.config['ADMISSION_ENABLED']:
+        return
+    admission = Admission(app.config)
+    app.extensions['admission'] = admission
+    app.before_request(admission.admit)
+    app.teardown_request(admission.release)
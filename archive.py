@@ -0,0 +1,211 @@
+"""Moves cold rows out of penta_book.db into a separate history database.
+
+Shipped orders older than ARCHIVE_AFTER_DAYS (with their order items,
+payments and shipments), and completed carts as old whose order is gone
+from the live file, are copied to HISTORY_DATABASE and deleted from the
+live file in small batches. Orders that are still initiated or awaiting
+shipment stay live, since payment and shipping look them up there. Open
+carts untouched for OPEN_CART_MAX_AGE_DAYS are purged.
+
+Run with ``python archive.py``. Old data stays reachable through
+attach_history(), which exposes all_* views over both databases.
+"""
+import argparse
+import datetime
+import logging
+import os
+import pathlib
+import sqlite3
+
+import backends
+import queries
+from config import Config
+
+logger = logging.getLogger(__name__)
+
+SCHEMA = '''
+CREATE INDEX IF NOT EXISTS idx_orders_order_date ON orders (order_date);
+CREATE INDEX IF NOT EXISTS idx_orders_cart ON orders (cart_id);
+CREATE INDEX IF NOT EXISTS idx_cart_buyer_status ON cart (buyer_id, status);
+CREATE INDEX IF NOT EXISTS idx_cartitems_cart ON cartitems (cart_id);
+CREATE INDEX IF NOT EXISTS idx_payments_order ON payments (order_id);
+CREATE INDEX IF NOT EXISTS idx_shipment_order ON shipment (order_id);
+'''
+
+# The same indexes, plus the cart timestamp migrate() adds on SQLite
+PG_SCHEMA = SCHEMA + f'''
+ALTER TABLE cart ADD COLUMN IF NOT EXISTS updated_at TEXT;
+UPDATE cart SET updated_at = {queries.NOW['postgresql']} WHERE updated_at IS NULL;
+'''
+
+# Tables that can be archived and the views that union them with history
+ARCHIVED_TABLES = ('cart', 'cartitems', 'orders', 'orderitems', 'payments', 'shipment')
+COMPLETED_CART_STATUSES = ('completed', 'complete')
+# Orders nothing changes any more; 'initiated' and 'paid' orders are still waiting on payment or shipping
+ARCHIVED_ORDER_STATUSES = ('Shipped',)
+
+
+def migrate(db):
+    # cart has no timestamp in the base schema; stale open carts are found by it.
+    # Carts from before the column start their clock now rather than counting as stale at once.
+    columns = [row[1] for row in db.execute('PRAGMA table_info(cart)')]
+    if 'updated_at' not in columns:
+        db.execute('ALTER TABLE cart ADD COLUMN updated_at TEXT')
+    db.execute('UPDATE cart SET updated_at = CURRENT_TIMESTAMP WHERE updated_at IS NULL')
+    db.commit()
+
+
+def _columns(db, schema, table):
+    return [row[1] for row in db.execute(f'PRAGMA {schema}.table_info({table})')]
+
+
+def _sync_history_table(db, table):
+    # History tables mirror the live columns; new live columns are added as they appear
+    live_columns = _columns(db, 'main', table)
+    history_columns = _columns(db, 'history', table)
+    if not history_columns:
+        db.execute(f'CREATE TABLE history.{table} AS SELECT * FROM main.{table} WHERE 0')
+        return live_columns
+    for column in live_columns:
+        if column not in history_columns:
+            db.execute(f'ALTER TABLE history.{table} ADD COLUMN {column}')
+    return live_columns
+
+
+def attach_history(db, history_path, read_only=False):
+    """Attach the history database to db and create temp all_<table> views.
+
+    The views are TEMP because a view stored in main may not refer to an
+    attached database. With read_only the file is opened with mode=ro and
+    nothing is created in it; if it does not exist yet nothing is attached
+    and False is returned. History is a SQLite file, so on PostgreSQL
+    nothing is attached either.
+    """
+    if backends.dialect(db) != 'sqlite':
+        return False
+    attached = [row[1] for row in db.execute('PRAGMA database_list')]
+    if 'history' not in attached:
+        if read_only:
+            if not os.path.exists(history_path):
+                return False
+            uri = pathlib.Path(history_path).resolve().as_uri() + '?mode=ro'
+            db.execute('ATTACH DATABASE ? AS history', (uri,))
+        else:
+            db.execute('ATTACH DATABASE ? AS history', (history_path,))
+    with db:
+        for table in ARCHIVED_TABLES:
+            live_columns = _columns(db, 'main', table) if read_only else _sync_history_table(db, table)
+            history_columns = _columns(db, 'history', table)
+            selects = [f"SELECT {', '.join(live_columns)} FROM main.{table}"]
+            if history_columns:
+                # A read-only history lacks the live columns added since the last archive run; they read as NULL
+                history_select = ', '.join(c if c in history_columns else f'NULL AS {c}' for c in live_columns)
+                selects.append(f'SELECT {history_select} FROM history.{table}')
+            db.execute(f'DROP VIEW IF EXISTS temp.all_{table}')
+            db.execute(f"CREATE TEMP VIEW all_{table} AS {' UNION ALL '.join(selects)}")
+        if not read_only:
+            db.execute('CREATE INDEX IF NOT EXISTS history.idx_history_orders_order ON orders (order_id)')
+            db.execute('CREATE INDEX IF NOT EXISTS history.idx_history_orderitems_order ON orderitems (order_id)')
+    return True
+
+
+def _move(db, table, key, ids):
+    columns = ', '.join(_columns(db, 'main', table))
+    placeholders = ', '.join('?' * len(ids))
+    db.execute(f'INSERT INTO history.{table} ({columns}) SELECT {columns} FROM main.{table} '
+               f'WHERE {key} IN ({placeholders})', ids)
+    db.execute(f'DELETE FROM main.{table} WHERE {key} IN ({placeholders})', ids)
+
+
+def archive_orders(db, cutoff, batch_size):
+    placeholders = ', '.join('?' * len(ARCHIVED_ORDER_STATUSES))
+    moved = 0
+    while True:
+        order_ids = [row[0] for row in db.execute(
+            f'SELECT order_id FROM main.orders WHERE order_date < ? AND status IN ({placeholders}) '
+            'ORDER BY order_id LIMIT ?',
+            (cutoff, *ARCHIVED_ORDER_STATUSES, batch_size))]
+        if not order_ids:
+            return moved
+        with db:
+            for table in ('orderitems', 'payments', 'shipment', 'orders'):
+                _move(db, table, 'order_id', order_ids)
+        moved += len(order_ids)
+
+
+def archive_completed_carts(db, cutoff, batch_size):
+    # A cart follows its order into history; carts of orders still live stay with them
+    placeholders = ', '.join('?' * len(COMPLETED_CART_STATUSES))
+    moved = 0
+    while True:
+        cart_ids = [row[0] for row in db.execute(
+            f'SELECT cart_id FROM main.cart c WHERE status IN ({placeholders}) AND updated_at < ? '
+            'AND NOT EXISTS (SELECT 1 FROM main.orders o WHERE o.cart_id = c.cart_id) '
+            'ORDER BY cart_id LIMIT ?',
+            (*COMPLETED_CART_STATUSES, cutoff, batch_size))]
+        if not cart_ids:
+            return moved
+        with db:
+            _move(db, 'cartitems', 'cart_id', cart_ids)
+            _move(db, 'cart', 'cart_id', cart_ids)
+        moved += len(cart_ids)
+
+
+def purge_stale_carts(db, cutoff, batch_size):
+    # Open carts nobody touched since cutoff
+    purged = 0
+    while True:
+        cart_ids = [row[0] for row in db.execute(
+            "SELECT cart_id FROM main.cart WHERE status = 'open' AND updated_at < ? "
+            'ORDER BY cart_id LIMIT ?', (cutoff, batch_size))]
+        if not cart_ids:
+            return purged
+        placeholders = ', '.join('?' * len(cart_ids))
+        with db:
+            db.execute(f'DELETE FROM main.cartitems WHERE cart_id IN ({placeholders})', cart_ids)
+            db.execute(f'DELETE FROM main.cart WHERE cart_id IN ({placeholders})', cart_ids)
+        purged += len(cart_ids)
+
+
+def _cutoff(days):
+    cutoff = datetime.datetime.now(datetime.timezone.utc) - datetime.timedelta(days=days)
+    # Matches the UTC CURRENT_TIMESTAMP format used for order_date and updated_at
+    return cutoff.strftime('%Y-%m-%d %H:%M:%S')
+
+
+def run_archive(db, history_path, archive_after_days, open_cart_max_age_days, batch_size):
+    migrate(db)
+    db.executescript(SCHEMA)
+    attach_history(db, history_path)
+    cutoff = _cutoff(archive_after_days)
+    result = {
+        'orders': archive_orders(db, cutoff, batch_size),
+        'completed_carts': archive_completed_carts(db, cutoff, batch_size),
+        'stale_carts': purge_stale_carts(db, _cutoff(open_cart_max_age_days), batch_size),
+    }
+    logger.info('Archive run finished: %s', result)
+    return result
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Archive old orders and carts into the history database.')
+    parser.add_argument('--database', default=Config.DATABASE)
+    parser.add_argument('--history-database', default=Config.HISTORY_DATABASE)
+    parser.add_argument('--older-than-days', type=int, default=Config.ARCHIVE_AFTER_DAYS)
+    parser.add_argument('--cart-max-age-days', type=int, default=Config.OPEN_CART_MAX_AGE_DAYS)
+    parser.add_argument('--batch-size', type=int, default=Config.ARCHIVE_BATCH_SIZE)
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO)
+    db = sqlite3.connect(args.database)
+    try:
+        result = run_archive(db, args.history_database, args.older_than_days, args.cart_max_age_days,
+                             args.batch_size)
+    finally:
+        db.close()
+    print(f"Archived {result['orders']} orders and {result['completed_carts']} completed carts, "
+          f"purged {result['stale_carts']} stale carts.")
+
+
+if __name__ == '__main__':
+    main()
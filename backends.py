@@ -0,0 +1,197 @@
+"""Database connections for SQLite and PostgreSQL.
+
+DATABASE_URL picks the backend. When it is empty the app opens the SQLite
+file at DATABASE. A postgresql:// URL makes every process draw connections
+from its own psycopg pool, so several app nodes can share one database and
+write to it in parallel.
+
+Views keep writing sqlite3-style SQL with ? or :name parameters. A
+PostgreSQL connection translates each statement once to psycopg's %s and
+%(name)s style, and its rows support both row[0] and row['column'] like
+sqlite3.Row. Statements whose SQL differs between the two dialects live in
+queries.py, and each module that owns tables keeps a PG_SCHEMA next to its
+SQLite SCHEMA, which init_db runs on PostgreSQL 14 or later.
+"""
+import functools
+import os
+import re
+import sqlite3
+import threading
+
+try:
+    import psycopg
+    DB_ERRORS = (sqlite3.Error, psycopg.Error)
+    INTEGRITY_ERRORS = (sqlite3.IntegrityError, psycopg.IntegrityError)
+except ImportError:
+    psycopg = None
+    DB_ERRORS = (sqlite3.Error,)
+    INTEGRITY_ERRORS = (sqlite3.IntegrityError,)
+
+# Quoted literals and identifiers are copied as they are; placeholders outside them are rewritten
+_TOKENS = re.compile(r"'(?:[^']|'')*'|\"(?:[^\"]|\"\")*\"|::|\?|:(\w+)|%")
+
+
+@functools.lru_cache(maxsize=1024)
+def translate(sql):
+    """sqlite3 paramstyle (? or :name) to psycopg paramstyle (%s or %(name)s)."""
+    def replace(match):
+        token = match.group(0)
+        if token == '?':
+            return '%s'
+        if token == '%':
+            return '%%'
+        if match.group(1):
+            return f'%({match.group(1)})s'
+        return token.replace('%', '%%')
+    return _TOKENS.sub(replace, sql)
+
+
+def dialect(db):
+    return getattr(db, 'dialect', 'sqlite')
+
+
+class Row(tuple):
+    # Index and column-name access, like sqlite3.Row
+    def __new__(cls, values, columns):
+        row = super().__new__(cls, values)
+        row._columns = columns
+        return row
+
+    def __getitem__(self, key):
+        if isinstance(key, str):
+            key = self._columns[key]
+        return super().__getitem__(key)
+
+    def keys(self):
+        return list(self._columns)
+
+
+def _row_factory(cursor):
+    columns = {column.name: index for index, column in enumerate(cursor.description or ())}
+    return lambda values: Row(values, columns)
+
+
+class PostgresCursor:
+    def __init__(self, cursor):
+        self._cursor = cursor
+
+    def execute(self, sql, params=()):
+        self._cursor.execute(translate(sql), params or None)
+        return self
+
+    def executemany(self, sql, seq_of_params):
+        self._cursor.executemany(translate(sql), seq_of_params)
+        return self
+
+    def fetchone(self):
+        return self._cursor.fetchone()
+
+    def fetchall(self):
+        return self._cursor.fetchall()
+
+    def __iter__(self):
+        return iter(self._cursor)
+
+    @property
+    def rowcount(self):
+        return self._cursor.rowcount
+
+    def close(self):
+        self._cursor.close()
+
+
+class PostgresConnection:
+    """A pooled psycopg connection with the parts of the sqlite3.Connection API the app uses."""
+    dialect = 'postgresql'
+
+    def __init__(self, pool, connection):
+        self._pool = pool
+        self._connection = connection
+
+    def cursor(self):
+        return PostgresCursor(self._connection.cursor())
+
+    def execute(self, sql, params=()):
+        return self.cursor().execute(sql, params)
+
+    def executemany(self, sql, seq_of_params):
+        return self.cursor().executemany(sql, seq_of_params)
+
+    def executescript(self, sql):
+        # Run as written, several statements at once; unlike sqlite3 it joins the open transaction
+        self._connection.execute(sql)
+
+    def commit(self):
+        self._connection.commit()
+
+    def rollback(self):
+        self._connection.rollback()
+
+    def close(self):
+        # Uncommitted work is dropped, as when a sqlite3 connection closes
+        if self._connection is not None:
+            self._connection.rollback()
+            self._pool.putconn(self._connection)
+            self._connection = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        if exc_type is None:
+            self.commit()
+        else:
+            self.rollback()
+        return False
+
+
+class SQLiteBackend:
+    dialect = 'sqlite'
+
+    def __init__(self, path):
+        self.path = path
+
+    def connect(self):
+        db = sqlite3.connect(self.path)
+        db.row_factory = sqlite3.Row
+        return db
+
+
+class PostgresBackend:
+    dialect = 'postgresql'
+
+    def __init__(self, url, min_size=1, max_size=10, timeout=10):
+        if psycopg is None:
+            raise RuntimeError('DATABASE_URL points at PostgreSQL but psycopg is not installed')
+        self.url = url
+        self.min_size = min_size
+        self.max_size = max_size
+        self.timeout = timeout
+        self._pool = None
+        self._pool_pid = None
+        self._lock = threading.Lock()
+
+    def pool(self):
+        # Pooled connections must not be shared with a forked worker
+        if self._pool_pid != os.getpid():
+            with self._lock:
+                if self._pool_pid != os.getpid():
+                    from psycopg_pool import ConnectionPool
+
+                    self._pool = ConnectionPool(self.url, min_size=self.min_size, max_size=self.max_size,
+                                                timeout=self.timeout, kwargs={'row_factory': _row_factory},
+                                                name=f'penta-book-{os.getpid()}', open=True)
+                    self._pool_pid = os.getpid()
+        return self._pool
+
+    def connect(self):
+        pool = self.pool()
+        return PostgresConnection(pool, pool.getconn())
+
+
+def make_backend(config):
+    url = config['DATABASE_URL']
+    if url.startswith(('postgresql://', 'postgres://')):
+        return PostgresBackend(url, config['DATABASE_POOL_MIN'], config['DATABASE_POOL_MAX'],
+                               config['DATABASE_POOL_TIMEOUT'])
+    return SQLiteBackend(config['DATABASE'])
@@ -0,0 +1,111 @@
+"""Catalog data as JSON from /api/v1/books against the HTML book pages.
+
+    python benchmarks/api.py [--books 500] [--rounds 5]
+
+Adds --books books to a throwaway copy of penta_book.db and fetches all of
+them through the test client, in four ways:
+
+  html       one /book/<id> page per book
+  api ids    /api/v1/books?ids=... in batches of 100
+  api pages  /api/v1/books?limit=200, following next_cursor
+  api fields the ids batches with fields=book_name,price,stock
+
+Reports bytes transferred and the best time per round. Then times
+serializing one full page of books with orjson and with the json module.
+"""
+import argparse
+import json
+import os
+import shutil
+import sys
+import tempfile
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def best_of(rounds, fetch):
+    timings = []
+    for _ in range(rounds):
+        start = time.perf_counter()
+        size, requests = fetch()
+        timings.append(time.perf_counter() - start)
+    return size, requests, min(timings)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--books', type=int, default=500)
+    parser.add_argument('--rounds', type=int, default=5)
+    args = parser.parse_args()
+
+    tmp_dir = tempfile.mkdtemp()
+    try:
+        os.environ.update(DATABASE=os.path.join(tmp_dir, 'penta_book.db'),
+                          ANALYTICS_DATABASE=os.path.join(tmp_dir, 'analytics.db'),
+                          ANALYTICS_SNAPSHOT_INTERVAL='0', NOTIFY_INTERVAL='0', MAINTENANCE_INTERVAL='0',
+                          LEADERBOARD_REFRESH_INTERVAL='0', STOCK_SWEEP_INTERVAL='0', ADMISSION_ENABLED='false')
+        shutil.copy(os.path.join(ROOT, 'penta_book.db'), os.environ['DATABASE'])
+        sys.path.insert(0, ROOT)
+        os.chdir(ROOT)
+        from app import create_app
+        from database import get_db
+        from views import api
+
+        app = create_app()
+        client = app.test_client()
+        with app.app_context():
+            db = get_db()
+            shop_id, category_id = db.execute('SELECT shop_id, category_id FROM books LIMIT 1').fetchone()
+            db.executemany('''
+                INSERT INTO books (category_id, shop_id, book_name, isbn, author, desc, price, stock)
+                VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+            ''', [(category_id, shop_id, f'Bench book {i}', 9780000000000 + i, f'Author {i % 50}',
+                   'A book added for the benchmark. ' * 8, 50000 + i * 100, i % 20) for i in range(args.books)])
+            db.commit()
+            book_ids = [row[0] for row in db.execute('SELECT book_id FROM books ORDER BY book_id')]
+        batches = [book_ids[i:i + api.MAX_IDS] for i in range(0, len(book_ids), api.MAX_IDS)]
+
+        def html():
+            return sum(len(client.get(f'/book/{book_id}').data) for book_id in book_ids), len(book_ids)
+
+        def by_ids(fields=None):
+            suffix = f'&fields={fields}' if fields else ''
+            return sum(len(client.get(f"/api/v1/books?ids={','.join(map(str, batch))}{suffix}").data)
+                       for batch in batches), len(batches)
+
+        def pages():
+            size, requests, url = 0, 0, f'/api/v1/books?limit={api.MAX_LIMIT}'
+            while url:
+                response = client.get(url)
+                size, requests = size + len(response.data), requests + 1
+                cursor = response.get_json()['next_cursor']
+                url = f'/api/v1/books?limit={api.MAX_LIMIT}&cursor={cursor}' if cursor else None
+            return size, requests
+
+        print(f'{len(book_ids)} books')
+        for mode, fetch in (('html', html), ('api ids', by_ids), ('api pages', pages),
+                            ('api fields', lambda: by_ids('book_name,price,stock'))):
+            size, requests, seconds = best_of(args.rounds, fetch)
+            print(f'{mode:10} {requests:5} requests {size / 1024:9.1f} KiB {seconds * 1000:8.1f} ms')
+
+        etag = client.get('/api/v1/books').headers['ETag']
+        print(f"304 on If-None-Match: {client.get('/api/v1/books', headers={'If-None-Match': etag}).status_code}")
+
+        with app.app_context():
+            payload = {'books': [dict(row) for row in get_db().execute(
+                f"SELECT {', '.join(api.BOOK_FIELDS)} FROM book_cards LIMIT {api.MAX_LIMIT}")]}
+        serializers = [('json', lambda: json.dumps(payload, separators=(',', ':'), ensure_ascii=False).encode())]
+        if api.orjson is not None:
+            serializers.insert(0, ('orjson', lambda: api.orjson.dumps(payload)))
+        for name, serialize in serializers:
+            start = time.perf_counter()
+            for _ in range(1000):
+                serialize()
+            print(f'{name:10} {(time.perf_counter() - start) * 1000:8.3f} us per page of {len(payload["books"])}')
+    finally:
+        shutil.rmtree(tmp_dir)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,102 @@
+"""Stock holds on one hot book under concurrent add-to-cart.
+
+    python benchmarks/holds.py [--threads 8] [--seconds 5] [--stock 1000]
+
+Sets the stock of one book in a throwaway copy of penta_book.db, then has
+every thread hold one copy for a new cart in a loop until the time is up.
+Reports holds attempted and granted per second, the latency percentiles,
+lock errors, and how many copies were held beyond the stock.
+
+  check-then-hold  reads the available stock, then inserts the hold in a
+                   second statement
+  stock_holds      stock_holds.hold(), the check and the insert in one UPSERT
+"""
+import argparse
+import itertools
+import os
+import shutil
+import sqlite3
+import statistics
+import sys
+import tempfile
+import threading
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+import stock_holds  # noqa: E402
+
+TTL = 3600
+
+
+def check_then_hold(db, cart_id, book_id):
+    if stock_holds.available(db, book_id, cart_id) < 1:
+        return False
+    db.execute('INSERT INTO stock_holds (cart_id, book_id, quantity, expires_at) VALUES (?, ?, 1, ?)',
+               (cart_id, book_id, time.time() + TTL))
+    return True
+
+
+def upsert_hold(db, cart_id, book_id):
+    return stock_holds.hold(db, cart_id, book_id, 1, TTL) is not None
+
+
+def run(path, book_id, hold, threads, seconds):
+    carts = itertools.count(1)
+    latencies = []
+    granted = []
+    errors = []
+    deadline = time.monotonic() + seconds
+
+    def worker():
+        db = sqlite3.connect(path, timeout=30, isolation_level=None)
+        while time.monotonic() < deadline:
+            start = time.perf_counter()
+            try:
+                if hold(db, next(carts), book_id):
+                    granted.append(1)
+            except sqlite3.OperationalError:
+                errors.append(1)
+            latencies.append(time.perf_counter() - start)
+        db.close()
+
+    workers = [threading.Thread(target=worker) for _ in range(threads)]
+    for thread in workers:
+        thread.start()
+    for thread in workers:
+        thread.join()
+    return latencies, len(granted), len(errors)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--threads', type=int, default=8)
+    parser.add_argument('--seconds', type=int, default=5)
+    parser.add_argument('--stock', type=int, default=1000)
+    args = parser.parse_args()
+
+    for mode, hold in (('check-then-hold', check_then_hold), ('stock_holds', upsert_hold)):
+        tmp_dir = tempfile.mkdtemp()
+        try:
+            path = os.path.join(tmp_dir, 'penta_book.db')
+            shutil.copy(os.path.join(ROOT, 'penta_book.db'), path)
+            db = sqlite3.connect(path)
+            db.execute('PRAGMA journal_mode = WAL')
+            db.executescript(stock_holds.SCHEMA)
+            book_id = db.execute('SELECT MIN(book_id) FROM books').fetchone()[0]
+            db.execute('UPDATE books SET stock = ? WHERE book_id = ?', (args.stock, book_id))
+            db.commit()
+            db.close()
+
+            latencies, granted, errors = run(path, book_id, hold, args.threads, args.seconds)
+            cuts = statistics.quantiles(latencies, n=100)
+            print(f'{mode:15} {len(latencies) / args.seconds:8.0f} holds/s, {granted} granted, '
+                  f'{max(granted - args.stock, 0)} oversold, {errors} lock errors, '
+                  f'p50 {cuts[49] * 1000:6.2f} ms, p99 {cuts[98] * 1000:6.2f} ms')
+        finally:
+            shutil.rmtree(tmp_dir)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,112 @@
+"""Browse latency while logins are being hashed, with and without the hash pool.
+
+    python benchmarks/logins.py [--seconds 10] [--login-threads 4] [--browse-threads 4]
+
+Runs a threaded development server against a throwaway copy of
+penta_book.db. Login threads post the correct password for a benchmark
+account in a loop; browse threads fetch the home page and record latency.
+
+  inline  HASH_POOL_WORKERS=0, PBKDF2 runs on the request threads
+  pool    HASH_POOL_WORKERS=2, PBKDF2 runs in the process pool
+"""
+import argparse
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+LOAD = '''
+import statistics
+import threading
+import time
+
+import requests
+from werkzeug.serving import make_server
+
+from app import create_app
+from config import Config
+
+
+class BenchConfig(Config):
+    WTF_CSRF_ENABLED = False
+
+
+if __name__ == '__main__':
+    app = create_app(BenchConfig)
+    server = make_server('127.0.0.1', 0, app, threaded=True)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    base = f'http://127.0.0.1:{{server.server_port}}'
+
+    account = dict(username='bench_login', password='bench-password', confirm='bench-password',
+                   email='bench_login@example.com', dob='2000-01-01', phone_number='0000',
+                   buyer_address='Bench street')
+    requests.post(base + '/register', data=account)
+
+    deadline = time.monotonic() + {seconds}
+    logins = []
+    browse = []
+
+    def login_loop():
+        http = requests.Session()
+        while time.monotonic() < deadline:
+            http.post(base + '/login', data=dict(username='bench_login', password='bench-password'),
+                      allow_redirects=False)
+            logins.append(1)
+
+    def browse_loop():
+        http = requests.Session()
+        while time.monotonic() < deadline:
+            start = time.perf_counter()
+            http.get(base + '/')
+            browse.append(time.perf_counter() - start)
+
+    threads = ([threading.Thread(target=login_loop) for _ in range({login_threads})]
+               + [threading.Thread(target=browse_loop) for _ in range({browse_threads})])
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    server.shutdown()
+
+    cuts = statistics.quantiles(browse, n=100)
+    print(len(logins), len(browse), cuts[49], cuts[94])
+'''
+
+
+def run(code, env):
+    result = subprocess.run([sys.executable, '-c', code], cwd=ROOT, env=env, capture_output=True, text=True,
+                            check=True)
+    return result.stdout.split()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--seconds', type=int, default=10)
+    parser.add_argument('--login-threads', type=int, default=4)
+    parser.add_argument('--browse-threads', type=int, default=4)
+    args = parser.parse_args()
+
+    code = LOAD.format(seconds=args.seconds, login_threads=args.login_threads,
+                       browse_threads=args.browse_threads)
+    for mode, workers in (('inline', '0'), ('pool', '2')):
+        tmp_dir = tempfile.mkdtemp()
+        try:
+            env = dict(os.environ,
+                       DATABASE=os.path.join(tmp_dir, 'penta_book.db'),
+                       ANALYTICS_DATABASE=os.path.join(tmp_dir, 'analytics.db'),
+                       ANALYTICS_SNAPSHOT_INTERVAL='0',
+                       HASH_POOL_WORKERS=workers,
+                       LOGIN_IP_LIMIT='1000000')
+            shutil.copy(os.path.join(ROOT, 'penta_book.db'), env['DATABASE'])
+            logins, pages, p50, p95 = run(code, env)
+            print(f'{mode:6} {int(logins) / args.seconds:6.1f} logins/s, {int(pages) / args.seconds:6.1f} pages/s, '
+                  f'browse p50 {float(p50) * 1000:6.1f} ms, p95 {float(p95) * 1000:6.1f} ms')
+        finally:
+            shutil.rmtree(tmp_dir)
+
+
+if __name__ == '__main__':
+    main()
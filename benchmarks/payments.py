@@ -0,0 +1,148 @@
+"""Concurrent in-flight payments one worker sustains, threaded vs gevent.
+
+    python benchmarks/payments.py [--clients 200] [--seconds 10] [--latency 0.2] [--threads 8]
+
+Starts the payment mock in async mode with MOCK_LATENCY and one gunicorn
+worker against a throwaway copy of penta_book.db, then keeps `--clients`
+payments posted at once for `--seconds`. Payments in flight at the gateway
+are throughput times the mock's latency (Little's law).
+
+  threaded  -k gthread --threads N: each gateway wait holds a thread
+  gevent    -k gevent: each gateway wait parks a greenlet
+"""
+import argparse
+import os
+import shutil
+import sqlite3
+import statistics
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+
+import requests
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from config import Config  # noqa: E402
+
+PORT = 5100
+
+
+def session_cookie():
+    from flask import Flask
+    from flask.sessions import SecureCookieSessionInterface
+
+    app = Flask(__name__)
+    app.secret_key = Config.SECRET_KEY
+    return SecureCookieSessionInterface().get_signing_serializer(app).dumps(
+        {'user_id': 1, 'username': 'bench', 'role': 'buyer'})
+
+
+def wait_until_up(url, timeout=30):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        try:
+            requests.get(url, timeout=1)
+            return
+        except requests.RequestException:
+            time.sleep(0.2)
+    raise RuntimeError(f'{url} did not come up')
+
+
+def load(clients, seconds, order_id, method_id):
+    cookie = session_cookie()
+    deadline = time.monotonic() + seconds
+    times = []
+    errors = []
+
+    def client():
+        http = requests.Session()
+        http.cookies.set('session', cookie)
+        while time.monotonic() < deadline:
+            start = time.perf_counter()
+            response = http.post(f'http://127.0.0.1:{PORT}/payment/{order_id}', data={'method': method_id},
+                                 allow_redirects=False)
+            if response.status_code == 302:
+                times.append(time.perf_counter() - start)
+            else:
+                errors.append(response.status_code)
+
+    threads = [threading.Thread(target=client) for _ in range(clients)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return times, errors
+
+
+def count_payments(database):
+    db = sqlite3.connect(database)
+    try:
+        return db.execute('SELECT COUNT(*) FROM payments').fetchone()[0]
+    finally:
+        db.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--clients', type=int, default=200)
+    parser.add_argument('--seconds', type=int, default=10)
+    parser.add_argument('--latency', type=float, default=0.2)
+    parser.add_argument('--threads', type=int, default=8)
+    args = parser.parse_args()
+
+    tmp_dir = tempfile.mkdtemp()
+    processes = []
+    try:
+        database = os.path.join(tmp_dir, 'penta_book.db')
+        shutil.copy(os.path.join(ROOT, 'penta_book.db'), database)
+        db = sqlite3.connect(database)
+        order_id = db.execute('SELECT order_id FROM orders WHERE buyer_id = 1 LIMIT 1').fetchone()[0]
+        method_id = db.execute('SELECT method_id FROM paymentmethods LIMIT 1').fetchone()[0]
+        db.close()
+
+        env = dict(os.environ,
+                   DATABASE=database,
+                   ANALYTICS_DATABASE=os.path.join(tmp_dir, 'analytics.db'),
+                   ANALYTICS_SNAPSHOT_INTERVAL='0',
+                   UPLOAD_FOLDER=os.path.join(tmp_dir, 'uploads'),
+                   JINJA_BYTECODE_CACHE_DIR=os.path.join(tmp_dir, 'bytecode'),
+                   ADMISSION_ENABLED='false',
+                   MOCK_ASYNC='true',
+                   MOCK_LATENCY=str(args.latency))
+        # The mock opens penta_book.db relative to its working directory
+        processes.append(subprocess.Popen([sys.executable, os.path.join(ROOT, 'mock_payment_gateway.py')],
+                                          cwd=tmp_dir, env=env, stderr=subprocess.DEVNULL))
+        wait_until_up('http://127.0.0.1:5001/payment_history')
+
+        for mode, worker_args in (('threaded', ['-k', 'gthread', '--threads', str(args.threads)]),
+                                  ('gevent', ['-k', 'gevent', '--worker-connections', '1000'])):
+            server = subprocess.Popen([sys.executable, '-m', 'gunicorn', '-w', '1', *worker_args,
+                                       '-b', f'127.0.0.1:{PORT}', 'wsgi:app'],
+                                      cwd=ROOT, env=env, stderr=subprocess.DEVNULL)
+            processes.append(server)
+            wait_until_up(f'http://127.0.0.1:{PORT}/')
+
+            before = count_payments(database)
+            start = time.monotonic()
+            times, errors = load(args.clients, args.seconds, order_id, method_id)
+            elapsed = time.monotonic() - start
+            server.terminate()
+            server.wait()
+
+            # A failed payment also redirects, so count the payments actually recorded
+            throughput = (count_payments(database) - before) / elapsed
+            print(f'{mode:8} {throughput:7.1f} payments/s, ~{throughput * args.latency:6.1f} in flight, '
+                  f'p50 {statistics.median(times) * 1000:7.1f} ms, errors {len(errors)}')
+    finally:
+        for process in processes:
+            process.terminate()
+            process.wait()
+        shutil.rmtree(tmp_dir)
+
+
+if __name__ == '__main__':
+    main()
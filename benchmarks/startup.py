@@ -0,0 +1,106 @@
+"""Cold-start time and per-worker memory of the app factory.
+
+    python benchmarks/startup.py [--workers 4]
+
+Runs against a throwaway copy of penta_book.db. For each mode it reports
+the time to build the app in a fresh interpreter and, after forking
+workers that each serve a few pages, every worker's RSS split into shared
+and private memory (from /proc/<pid>/smaps_rollup, Linux only).
+
+  lazy     create_app() only; forms, requests and templates load on first use
+  preload  create_app() + preload() in the master before forking
+"""
+import argparse
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+COLD_START = '''
+import time
+start = time.perf_counter()
+from app import create_app, preload
+app = create_app()
+if {preload}:
+    preload(app)
+print(time.perf_counter() - start)
+'''
+
+WORKERS = '''
+import os, sys
+from app import create_app, preload
+
+def smaps():
+    stats = {{}}
+    with open('/proc/self/smaps_rollup') as f:
+        for line in f:
+            parts = line.split()
+            if len(parts) == 3 and parts[2] == 'kB':
+                stats[parts[0].rstrip(':')] = int(parts[1])
+    return stats
+
+app = create_app()
+if {preload}:
+    preload(app)
+
+pages = ['/', '/login', '/register', '/shop/login', '/shop/register', '/admin/login', '/book/16']
+children = []
+for _ in range({workers}):
+    read_fd, write_fd = os.pipe()
+    pid = os.fork()
+    if pid == 0:
+        os.close(read_fd)
+        client = app.test_client()
+        for page in pages:
+            client.get(page)
+        stats = smaps()
+        private = stats.get('Private_Clean', 0) + stats.get('Private_Dirty', 0)
+        os.write(write_fd, f"{{stats['Rss']}} {{stats['Rss'] - private}} {{private}}".encode())
+        os._exit(0)
+    os.close(write_fd)
+    children.append((pid, read_fd))
+
+for pid, read_fd in children:
+    os.waitpid(pid, 0)
+    print(os.read(read_fd, 100).decode())
+'''
+
+
+def run(code, env):
+    result = subprocess.run([sys.executable, '-c', code], cwd=ROOT, env=env, capture_output=True, text=True,
+                            check=True)
+    return result.stdout.split('\n')
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--workers', type=int, default=4)
+    parser.add_argument('--repeat', type=int, default=5)
+    args = parser.parse_args()
+
+    tmp_dir = tempfile.mkdtemp()
+    try:
+        env = dict(os.environ,
+                   DATABASE=os.path.join(tmp_dir, 'penta_book.db'),
+                   ANALYTICS_DATABASE=os.path.join(tmp_dir, 'analytics.db'),
+                   ANALYTICS_SNAPSHOT_INTERVAL='0')
+        shutil.copy(os.path.join(ROOT, 'penta_book.db'), env['DATABASE'])
+
+        for mode, preload in (('lazy', False), ('preload', True)):
+            times = sorted(float(run(COLD_START.format(preload=preload), env)[0]) for _ in range(args.repeat))
+            print(f'{mode:8} cold start: median {times[len(times) // 2] * 1000:.1f} ms')
+
+            lines = [line for line in run(WORKERS.format(preload=preload, workers=args.workers), env) if line]
+            for i, line in enumerate(lines):
+                rss, shared, private = (int(value) for value in line.split())
+                print(f'{mode:8} worker {i}: rss {rss / 1024:.1f} MiB, shared {shared / 1024:.1f} MiB, '
+                      f'private {private / 1024:.1f} MiB')
+    finally:
+        shutil.rmtree(tmp_dir)
+
+
+if __name__ == '__main__':
+    main()
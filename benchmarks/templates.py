@@ -0,0 +1,84 @@
+"""Render time of buyer_index and manage_books with and without template caching.
+
+    python benchmarks/templates.py [--requests 200]
+
+Runs against a throwaway copy of penta_book.db. Each mode runs in a fresh
+interpreter and reports the first render of each page (what a new worker
+pays) and the mean of the following renders.
+
+  before  no bytecode cache, fragment cache off
+  after   bytecode cache filled by compile_templates(), fragment cache on
+"""
+import argparse
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+RENDER = '''
+import time
+from app import create_app
+
+app = create_app()
+buyer = app.test_client()
+with buyer.session_transaction() as s:
+    s.update(user_id=1, username='bench', role='buyer')
+shop = app.test_client()
+with shop.session_transaction() as s:
+    s.update(shop_id=8, shop_name='bench', role='shop')
+
+for name, client, url in (('buyer_index', buyer, '/buyer_index'), ('manage_books', shop, '/shop/manage_books')):
+    start = time.perf_counter()
+    assert client.get(url).status_code == 200
+    first = time.perf_counter() - start
+    start = time.perf_counter()
+    for _ in range({requests}):
+        client.get(url)
+    mean = (time.perf_counter() - start) / {requests}
+    print(name, first, mean)
+'''
+
+PRECOMPILE = '''
+from app import create_app, compile_templates
+compile_templates(create_app())
+'''
+
+
+def run(code, env):
+    result = subprocess.run([sys.executable, '-c', code], cwd=ROOT, env=env, capture_output=True, text=True,
+                            check=True)
+    return [line.split() for line in result.stdout.splitlines() if line]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--requests', type=int, default=200)
+    args = parser.parse_args()
+
+    tmp_dir = tempfile.mkdtemp()
+    try:
+        base_env = dict(os.environ,
+                        DATABASE=os.path.join(tmp_dir, 'penta_book.db'),
+                        ANALYTICS_DATABASE=os.path.join(tmp_dir, 'analytics.db'),
+                        ANALYTICS_SNAPSHOT_INTERVAL='0')
+        shutil.copy(os.path.join(ROOT, 'penta_book.db'), base_env['DATABASE'])
+
+        before_env = dict(base_env, FRAGMENT_CACHE_ENABLED='false',
+                          JINJA_BYTECODE_CACHE_DIR=os.path.join(tmp_dir, 'empty_bytecode'))
+        after_env = dict(base_env, FRAGMENT_CACHE_ENABLED='true',
+                         JINJA_BYTECODE_CACHE_DIR=os.path.join(tmp_dir, 'bytecode'))
+        run(PRECOMPILE, after_env)
+
+        for mode, env in (('before', before_env), ('after', after_env)):
+            for page, first, mean in run(RENDER.format(requests=args.requests), env):
+                print(f'{mode:6} {page:12} first render {float(first) * 1000:7.2f} ms, '
+                      f'mean {float(mean) * 1000:6.3f} ms')
+    finally:
+        shutil.rmtree(tmp_dir)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,101 @@
+"""Upstream calls to the shipment service under a tracking page load test.
+
+    python benchmarks/tracking.py [--threads 16] [--requests 50]
+
+Starts mock_shipment_api on :5002 against a throwaway copy of
+penta_book.db. Each thread fetches /buyer/track_shipment/<no> for random
+tracking numbers of the existing shipments. Reports the upstream calls
+the mock received and the mean page time, with the tracking cache off and
+on.
+"""
+import argparse
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+LOAD = '''
+import random
+import sys
+import threading
+import time
+
+sys.path.insert(0, {root!r})
+
+from werkzeug.serving import make_server
+
+import mock_shipment_api
+from app import create_app
+from database import get_db
+
+upstream = []
+
+
+def counting(environ, start_response):
+    upstream.append(1)
+    return mock_shipment_api.app.wsgi_app(environ, start_response)
+
+
+if __name__ == '__main__':
+    server = make_server('127.0.0.1', 5002, counting, threaded=True)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+
+    app = create_app()
+    with app.app_context():
+        numbers = [row[0] for row in get_db().execute('SELECT tracking_no FROM shipment')]
+
+    times = []
+
+    def browse():
+        client = app.test_client()
+        with client.session_transaction() as session:
+            session.update(user_id=1, username='bench', role='buyer')
+        for _ in range({requests}):
+            start = time.perf_counter()
+            assert client.get('/buyer/track_shipment/' + random.choice(numbers)).status_code == 200
+            times.append(time.perf_counter() - start)
+
+    threads = [threading.Thread(target=browse) for _ in range({threads})]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    server.shutdown()
+    print(len(numbers), len(times), len(upstream), sum(times) / len(times))
+'''
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--threads', type=int, default=16)
+    parser.add_argument('--requests', type=int, default=50)
+    args = parser.parse_args()
+
+    code = LOAD.format(root=ROOT, threads=args.threads, requests=args.requests)
+    for mode, enabled in (('off', 'false'), ('on', 'true')):
+        tmp_dir = tempfile.mkdtemp()
+        try:
+            # The mock opens penta_book.db relative to its working directory
+            env = dict(os.environ,
+                       DATABASE=os.path.join(tmp_dir, 'penta_book.db'),
+                       ANALYTICS_DATABASE=os.path.join(tmp_dir, 'analytics.db'),
+                       ANALYTICS_SNAPSHOT_INTERVAL='0',
+                       UPLOAD_FOLDER=os.path.join(tmp_dir, 'uploads'),
+                       JINJA_BYTECODE_CACHE_DIR=os.path.join(tmp_dir, 'bytecode'),
+                       ADMISSION_ENABLED='false',
+                       TRACKING_CACHE_ENABLED=enabled)
+            shutil.copy(os.path.join(ROOT, 'penta_book.db'), env['DATABASE'])
+            result = subprocess.run([sys.executable, '-c', code], cwd=tmp_dir, env=env, capture_output=True,
+                                    text=True, check=True)
+            numbers, pages, upstream, mean = result.stdout.split()
+            print(f'cache {mode:3} {pages} pages over {numbers} tracking numbers: {upstream} upstream calls, '
+                  f'mean page {float(mean) * 1000:.2f} ms')
+        finally:
+            shutil.rmtree(tmp_dir)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,99 @@
+"""Bulk price and stock edits from the shop's book list.
+
+manage_books sends only the rows that changed, each with the version of
+the book the page was rendered from. Every UPDATE of books adds one to
+books.version, so a version that no longer matches means the book was
+edited, or sold from, since the page was loaded. Those rows are reported
+back with their current values instead of being overwritten. The rest are
+applied with one executemany in a single transaction, so repricing
+thousands of books costs one commit.
+"""
+import math
+
+import backends
+
+MAX_CHANGES = 10000
+
+# Keeps the IN lists well under SQLite's limit on bound parameters
+READ_CHUNK = 500
+
+# What migrate() does on SQLite
+PG_SCHEMA = '''
+ALTER TABLE books ADD COLUMN IF NOT EXISTS version INTEGER NOT NULL DEFAULT 0;
+'''
+
+
+def migrate(db):
+    # books has no version in the base schema
+    columns = [row[1] for row in db.execute('PRAGMA table_info(books)')]
+    if 'version' not in columns:
+        db.execute('ALTER TABLE books ADD COLUMN version INTEGER NOT NULL DEFAULT 0')
+        db.commit()
+
+
+def parse_changes(payload):
+    """Validate [{book_id, version, price?, stock?}, ...]; raises ValueError."""
+    if not isinstance(payload, list) or not payload:
+        raise ValueError('Send a list of changes.')
+    if len(payload) > MAX_CHANGES:
+        raise ValueError(f'At most {MAX_CHANGES} changes at a time.')
+    changes = {}
+    for item in payload:
+        try:
+            change = {'book_id': int(item['book_id']), 'version': int(item['version']),
+                      'price': None if item.get('price') is None else float(item['price']),
+                      'stock': None if item.get('stock') is None else int(item['stock'])}
+        except (KeyError, TypeError, ValueError, OverflowError):
+            raise ValueError(f'Invalid change: {item!r}') from None
+        if change['price'] is None and change['stock'] is None:
+            raise ValueError(f"Nothing to change for book {change['book_id']}.")
+        if change['price'] is not None and not math.isfinite(change['price']):
+            raise ValueError(f"Price of book {change['book_id']} must be a number.")
+        if (change['price'] or 0) < 0 or (change['stock'] or 0) < 0:
+            raise ValueError(f"Price and stock of book {change['book_id']} cannot be negative.")
+        # Two changes to one book cannot both match its version, so neither is picked over the other
+        if change['book_id'] in changes:
+            raise ValueError(f"Book {change['book_id']} is changed more than once; send one change per book.")
+        changes[change['book_id']] = change
+    return list(changes.values())
+
+
+def apply_changes(db, shop_id, changes):
+    """Apply the changes whose version still matches; the caller commits.
+
+    Returns {'updated': [{book_id, version}], 'conflicts': [current rows],
+    'missing': [book_ids that are not the shop's]}.
+    """
+    sqlite = backends.dialect(db) == 'sqlite'
+    if sqlite and not db.in_transaction:
+        # Hold the write lock from the version check to the update
+        db.execute('BEGIN IMMEDIATE')
+    lock = '' if sqlite else ' FOR UPDATE'
+
+    book_ids = [change['book_id'] for change in changes]
+    current = {}
+    for start in range(0, len(book_ids), READ_CHUNK):
+        chunk = book_ids[start:start + READ_CHUNK]
+        rows = db.execute(f'''
+            SELECT book_id, price, stock, version FROM books
+            WHERE shop_id = ? AND book_id IN ({', '.join('?' * len(chunk))}){lock}
+        ''', [shop_id, *chunk]).fetchall()
+        current.update((row['book_id'], row) for row in rows)
+
+    apply, conflicts, missing = [], [], []
+    for change in changes:
+        row = current.get(change['book_id'])
+        if row is None:
+            missing.append(change['book_id'])
+        elif row['version'] != change['version']:
+            conflicts.append({key: row[key] for key in ('book_id', 'price', 'stock', 'version')})
+        else:
+            apply.append(dict(change, shop_id=shop_id))
+
+    db.executemany('''
+        UPDATE books
+        SET price = COALESCE(:price, price), stock = COALESCE(:stock, stock), version = version + 1
+        WHERE book_id = :book_id AND shop_id = :shop_id AND version = :version
+    ''', apply)
+    return {'updated': [{'book_id': change['book_id'], 'version': change['version'] + 1} for change in apply],
+            'conflicts': conflicts, 'missing': missing}
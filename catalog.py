@@ -0,0 +1,306 @@
+"""Read models for browsing the catalog.
+
+book_cards has one row per book with everything a book card shows.
+Listings read this table alone instead of joining books, categories, shop
+and the rating stats on every request. Triggers keep it in step with the
+source tables inside the writing transaction, and the covering indexes
+match the listing sort orders, so each listing is one index-only scan.
+
+book_facets counts books per (category, price band, in stock), kept up to
+date by triggers on books, so facet counts never scan the catalog.
+
+PG_SCHEMA builds the same tables on PostgreSQL, with the triggers as
+PL/pgSQL functions.
+"""
+
+# (band, label, lowest price, first price above the band); books without a price are in no band
+PRICE_BANDS = (
+    (0, 'Under Rp50.000', 0, 50000),
+    (1, 'Rp50.000 - Rp100.000', 50000, 100000),
+    (2, 'Rp100.000 - Rp200.000', 100000, 200000),
+    (3, 'Rp200.000 - Rp500.000', 200000, 500000),
+    (4, 'Rp500.000 and above', 500000, None),
+)
+NO_BAND = -1
+
+
+def _band_sql(price):
+    cases = ' '.join(f'WHEN {price} < {high} THEN {band}' for band, _, _, high in PRICE_BANDS if high is not None)
+    return f'CASE WHEN {price} IS NULL OR {price} < 0 THEN {NO_BAND} {cases} ELSE {PRICE_BANDS[-1][0]} END'
+
+
+def _facet_key_sql(row):
+    # Written to run on both backends; PostgreSQL has no IFNULL and does not store a comparison as an integer
+    return (f'COALESCE({row}.category_id, 0), {_band_sql(f"{row}.price")}, '
+            f'CASE WHEN COALESCE({row}.stock, 0) > 0 THEN 1 ELSE 0 END')
+
+
+# Columns a card grid or the shop's book table may show
+CARD_COLUMNS = ('book_id, shop_id, category_id, book_name, author, isbn, price, stock, img_url, '
+                'category_name, shop_name, rating_avg, rating_count')
+
+_SELECT_CARD = '''
+    SELECT b.book_id, b.shop_id, b.category_id, b.book_name, b.author, b.isbn, b.price, b.stock, b.img_url,
+           c.category_name, sh.shop_name, COALESCE(r.rating_avg, 0), COALESCE(r.rating_count, 0)
+    FROM books b
+    LEFT JOIN categories c ON c.category_id = b.category_id
+    LEFT JOIN shop sh ON sh.shop_id = b.shop_id
+    LEFT JOIN book_rating_stats r ON r.book_id = b.book_id
+'''
+
+SCHEMA = f'''
+CREATE TABLE IF NOT EXISTS book_cards (
+    book_id       INTEGER PRIMARY KEY,
+    shop_id       INTEGER,
+    category_id   INTEGER,
+    book_name     TEXT,
+    author        TEXT,
+    isbn          INTEGER,
+    price         REAL,
+    stock         INTEGER,
+    img_url       TEXT,
+    category_name TEXT,
+    shop_name     TEXT,
+    rating_avg    REAL NOT NULL DEFAULT 0,
+    rating_count  INTEGER NOT NULL DEFAULT 0
+);
+
+-- Covering indexes, one per listing order (date order is the table itself)
+CREATE INDEX IF NOT EXISTS idx_book_cards_price ON book_cards
+    (price, book_id, book_name, author, img_url, category_name, rating_avg, rating_count, stock);
+CREATE INDEX IF NOT EXISTS idx_book_cards_rating ON book_cards
+    (rating_avg DESC, rating_count DESC, book_id, book_name, author, img_url, category_name, price, stock);
+CREATE INDEX IF NOT EXISTS idx_book_cards_shop ON book_cards
+    (shop_id, book_id, book_name, isbn, author, category_name, price, stock, img_url);
+-- Category and category + price band drill-down
+CREATE INDEX IF NOT EXISTS idx_book_cards_category_price ON book_cards
+    (category_id, price, book_id, book_name, author, img_url, category_name, rating_avg, rating_count, stock);
+
+CREATE TRIGGER IF NOT EXISTS book_cards_book_insert AFTER INSERT ON books BEGIN
+    INSERT OR REPLACE INTO book_cards ({CARD_COLUMNS}) {_SELECT_CARD} WHERE b.book_id = NEW.book_id;
+END;
+CREATE TRIGGER IF NOT EXISTS book_cards_book_update AFTER UPDATE ON books BEGIN
+    DELETE FROM book_cards WHERE book_id = OLD.book_id AND OLD.book_id != NEW.book_id;
+    INSERT OR REPLACE INTO book_cards ({CARD_COLUMNS}) {_SELECT_CARD} WHERE b.book_id = NEW.book_id;
+END;
+CREATE TRIGGER IF NOT EXISTS book_cards_book_delete AFTER DELETE ON books BEGIN
+    DELETE FROM book_cards WHERE book_id = OLD.book_id;
+END;
+
+CREATE TRIGGER IF NOT EXISTS book_cards_category_insert AFTER INSERT ON categories BEGIN
+    UPDATE book_cards SET category_name = NEW.category_name WHERE category_id = NEW.category_id;
+END;
+CREATE TRIGGER IF NOT EXISTS book_cards_category_update AFTER UPDATE OF category_name ON categories BEGIN
+    UPDATE book_cards SET category_name = NEW.category_name WHERE category_id = NEW.category_id;
+END;
+CREATE TRIGGER IF NOT EXISTS book_cards_category_delete AFTER DELETE ON categories BEGIN
+    UPDATE book_cards SET category_name = NULL WHERE category_id = OLD.category_id;
+END;
+
+CREATE TRIGGER IF NOT EXISTS book_cards_shop_update AFTER UPDATE OF shop_name ON shop BEGIN
+    UPDATE book_cards SET shop_name = NEW.shop_name WHERE shop_id = NEW.shop_id;
+END;
+CREATE TRIGGER IF NOT EXISTS book_cards_shop_delete AFTER DELETE ON shop BEGIN
+    UPDATE book_cards SET shop_name = NULL WHERE shop_id = OLD.shop_id;
+END;
+
+-- Reviews reach the cards through book_rating_stats, which reviews.py keeps in step
+CREATE TRIGGER IF NOT EXISTS book_cards_rating_insert AFTER INSERT ON book_rating_stats BEGIN
+    UPDATE book_cards SET rating_avg = IFNULL(NEW.rating_avg, 0), rating_count = NEW.rating_count
+    WHERE book_id = NEW.book_id;
+END;
+CREATE TRIGGER IF NOT EXISTS book_cards_rating_update AFTER UPDATE ON book_rating_stats BEGIN
+    UPDATE book_cards SET rating_avg = IFNULL(NEW.rating_avg, 0), rating_count = NEW.rating_count
+    WHERE book_id = NEW.book_id;
+END;
+CREATE TRIGGER IF NOT EXISTS book_cards_rating_delete AFTER DELETE ON book_rating_stats BEGIN
+    UPDATE book_cards SET rating_avg = 0, rating_count = 0 WHERE book_id = OLD.book_id;
+END;
+
+-- Backfill books added before the projection existed
+INSERT OR IGNORE INTO book_cards ({CARD_COLUMNS}) {_SELECT_CARD};
+
+-- category_id 0 counts books without a category
+CREATE TABLE IF NOT EXISTS book_facets (
+    category_id INTEGER NOT NULL,
+    price_band  INTEGER NOT NULL,
+    in_stock    INTEGER NOT NULL,
+    book_count  INTEGER NOT NULL DEFAULT 0,
+    PRIMARY KEY (category_id, price_band, in_stock)
+) WITHOUT ROWID;
+CREATE INDEX IF NOT EXISTS idx_book_facets_band ON book_facets (price_band, in_stock, category_id, book_count);
+
+CREATE TRIGGER IF NOT EXISTS book_facets_book_insert AFTER INSERT ON books BEGIN
+    INSERT INTO book_facets (category_id, price_band, in_stock, book_count) VALUES ({_facet_key_sql('NEW')}, 1)
+    ON CONFLICT DO UPDATE SET book_count = book_count + 1;
+END;
+CREATE TRIGGER IF NOT EXISTS book_facets_book_update AFTER UPDATE OF category_id, price, stock ON books BEGIN
+    UPDATE book_facets SET book_count = book_count - 1
+    WHERE (category_id, price_band, in_stock) = ({_facet_key_sql('OLD')});
+    INSERT INTO book_facets (category_id, price_band, in_stock, book_count) VALUES ({_facet_key_sql('NEW')}, 1)
+    ON CONFLICT DO UPDATE SET book_count = book_count + 1;
+END;
+CREATE TRIGGER IF NOT EXISTS book_facets_book_delete AFTER DELETE ON books BEGIN
+    UPDATE book_facets SET book_count = book_count - 1
+    WHERE (category_id, price_band, in_stock) = ({_facet_key_sql('OLD')});
+END;
+
+-- Backfill keys no trigger has written yet
+INSERT OR IGNORE INTO book_facets (category_id, price_band, in_stock, book_count)
+SELECT {_facet_key_sql('books')}, COUNT(*) FROM books GROUP BY 1, 2, 3;
+'''
+
+PG_SCHEMA = f'''
+CREATE TABLE IF NOT EXISTS book_cards (
+    book_id       INTEGER PRIMARY KEY,
+    shop_id       INTEGER,
+    category_id   INTEGER,
+    book_name     TEXT,
+    author        TEXT,
+    isbn          BIGINT,
+    price         DOUBLE PRECISION,
+    stock         INTEGER,
+    img_url       TEXT,
+    category_name TEXT,
+    shop_name     TEXT,
+    rating_avg    DOUBLE PRECISION NOT NULL DEFAULT 0,
+    rating_count  INTEGER NOT NULL DEFAULT 0
+);
+CREATE INDEX IF NOT EXISTS idx_book_cards_price ON book_cards
+    (price, book_id, book_name, author, img_url, category_name, rating_avg, rating_count, stock);
+CREATE INDEX IF NOT EXISTS idx_book_cards_rating ON book_cards
+    (rating_avg DESC, rating_count DESC, book_id, book_name, author, img_url, category_name, price, stock);
+CREATE INDEX IF NOT EXISTS idx_book_cards_shop ON book_cards
+    (shop_id, book_id, book_name, isbn, author, category_name, price, stock, img_url);
+CREATE INDEX IF NOT EXISTS idx_book_cards_category_price ON book_cards
+    (category_id, price, book_id, book_name, author, img_url, category_name, rating_avg, rating_count, stock);
+
+CREATE TABLE IF NOT EXISTS book_facets (
+    category_id INTEGER NOT NULL,
+    price_band  INTEGER NOT NULL,
+    in_stock    INTEGER NOT NULL,
+    book_count  INTEGER NOT NULL DEFAULT 0,
+    PRIMARY KEY (category_id, price_band, in_stock)
+);
+CREATE INDEX IF NOT EXISTS idx_book_facets_band ON book_facets (price_band, in_stock, category_id, book_count);
+
+CREATE OR REPLACE FUNCTION book_cards_book_changed() RETURNS trigger LANGUAGE plpgsql AS $$
+BEGIN
+    IF TG_OP <> 'INSERT' THEN
+        DELETE FROM book_cards WHERE book_id = OLD.book_id;
+    END IF;
+    IF TG_OP <> 'DELETE' THEN
+        INSERT INTO book_cards ({CARD_COLUMNS}) {_SELECT_CARD} WHERE b.book_id = NEW.book_id;
+    END IF;
+    RETURN NULL;
+END
+$$;
+CREATE OR REPLACE TRIGGER book_cards_book AFTER INSERT OR UPDATE OR DELETE ON books
+    FOR EACH ROW EXECUTE FUNCTION book_cards_book_changed();
+
+CREATE OR REPLACE FUNCTION book_cards_category_changed() RETURNS trigger LANGUAGE plpgsql AS $$
+BEGIN
+    IF TG_OP = 'DELETE' THEN
+        UPDATE book_cards SET category_name = NULL WHERE category_id = OLD.category_id;
+    ELSE
+        UPDATE book_cards SET category_name = NEW.category_name WHERE category_id = NEW.category_id;
+    END IF;
+    RETURN NULL;
+END
+$$;
+CREATE OR REPLACE TRIGGER book_cards_category AFTER INSERT OR UPDATE OF category_name OR DELETE ON categories
+    FOR EACH ROW EXECUTE FUNCTION book_cards_category_changed();
+
+CREATE OR REPLACE FUNCTION book_cards_shop_changed() RETURNS trigger LANGUAGE plpgsql AS $$
+BEGIN
+    IF TG_OP = 'DELETE' THEN
+        UPDATE book_cards SET shop_name = NULL WHERE shop_id = OLD.shop_id;
+    ELSE
+        UPDATE book_cards SET shop_name = NEW.shop_name WHERE shop_id = NEW.shop_id;
+    END IF;
+    RETURN NULL;
+END
+$$;
+CREATE OR REPLACE TRIGGER book_cards_shop AFTER UPDATE OF shop_name OR DELETE ON shop
+    FOR EACH ROW EXECUTE FUNCTION book_cards_shop_changed();
+
+CREATE OR REPLACE FUNCTION book_cards_rating_changed() RETURNS trigger LANGUAGE plpgsql AS $$
+BEGIN
+    IF TG_OP = 'DELETE' THEN
+        UPDATE book_cards SET rating_avg = 0, rating_count = 0 WHERE book_id = OLD.book_id;
+    ELSE
+        UPDATE book_cards SET rating_avg = COALESCE(NEW.rating_avg, 0), rating_count = NEW.rating_count
+        WHERE book_id = NEW.book_id;
+    END IF;
+    RETURN NULL;
+END
+$$;
+CREATE OR REPLACE TRIGGER book_cards_rating AFTER INSERT OR UPDATE OR DELETE ON book_rating_stats
+    FOR EACH ROW EXECUTE FUNCTION book_cards_rating_changed();
+
+CREATE OR REPLACE FUNCTION book_facets_book_changed() RETURNS trigger LANGUAGE plpgsql AS $$
+BEGIN
+    IF TG_OP <> 'INSERT' THEN
+        UPDATE book_facets SET book_count = book_count - 1
+        WHERE (category_id, price_band, in_stock) = ({_facet_key_sql('OLD')});
+    END IF;
+    IF TG_OP <> 'DELETE' THEN
+        INSERT INTO book_facets (category_id, price_band, in_stock, book_count) VALUES ({_facet_key_sql('NEW')}, 1)
+        ON CONFLICT (category_id, price_band, in_stock) DO UPDATE SET book_count = book_facets.book_count + 1;
+    END IF;
+    RETURN NULL;
+END
+$$;
+CREATE OR REPLACE TRIGGER book_facets_book AFTER INSERT OR UPDATE OF category_id, price, stock OR DELETE ON books
+    FOR EACH ROW EXECUTE FUNCTION book_facets_book_changed();
+
+INSERT INTO book_cards ({CARD_COLUMNS}) {_SELECT_CARD} ON CONFLICT DO NOTHING;
+INSERT INTO book_facets (category_id, price_band, in_stock, book_count)
+SELECT {_facet_key_sql('books')}, COUNT(*) FROM books GROUP BY 1, 2, 3
+ON CONFLICT DO NOTHING;
+'''
+
+
+def price_band(band):
+    """(low, high) prices of a band, high None for the open top band; None for an unknown band."""
+    for number, _, low, high in PRICE_BANDS:
+        if number == band:
+            return low, high
+    return None
+
+
+def facet_counts(db, category_id=None, band=None, in_stock=False):
+    """Book counts per category, per price band and in stock, each within the other selected filters."""
+    stock_filter = 'AND in_stock = 1' if in_stock else ''
+    categories = db.execute(f'''
+        SELECT c.category_id, c.category_name, COALESCE(SUM(f.book_count), 0) AS book_count
+        FROM categories c
+        LEFT JOIN book_facets f
+            ON f.category_id = c.category_id AND (CAST(:band AS INTEGER) IS NULL OR f.price_band = :band)
+            {stock_filter}
+        GROUP BY c.category_id
+        ORDER BY c.category_name
+    ''', {'band': band}).fetchall()
+    bands = dict(db.execute(f'''
+        SELECT price_band, SUM(book_count)
+        FROM book_facets
+        WHERE (CAST(:category_id AS INTEGER) IS NULL OR category_id = :category_id) {stock_filter}
+        GROUP BY price_band
+    ''', {'category_id': category_id}).fetchall())
+    stock = dict(db.execute('''
+        SELECT in_stock, SUM(book_count)
+        FROM book_facets
+        WHERE (CAST(:category_id AS INTEGER) IS NULL OR category_id = :category_id)
+            AND (CAST(:band AS INTEGER) IS NULL OR price_band = :band)
+        GROUP BY in_stock
+    ''', {'category_id': category_id, 'band': band}).fetchall())
+
+    return {
+        'categories': [{'category_id': row['category_id'], 'category_name': row['category_name'],
+                        'count': row['book_count']} for row in categories],
+        'price_bands': [{'band': number, 'label': label, 'min_price': low, 'max_price': high,
+                         'count': bands.get(number, 0)} for number, label, low, high in PRICE_BANDS],
+        'in_stock': stock.get(1, 0),
+        'total': stock.get(0, 0) + stock.get(1, 0),
+    }
+
@@ -4,4 +4,92 @@ import os
 class Config:
     SECRET_KEY = os.getenv('SECRET_KEY', 'default-secret-key')
     DATABASE = os.getenv('DATABASE', 'penta_book.db')
+    DATABASE_URL = os.getenv('DATABASE_URL', '')  # postgresql://... to use PostgreSQL instead of DATABASE
+    DATABASE_POOL_MIN = int(os.getenv('DATABASE_POOL_MIN', '1'))
+    DATABASE_POOL_MAX = int(os.getenv('DATABASE_POOL_MAX', '10'))
+    DATABASE_POOL_TIMEOUT = float(os.getenv('DATABASE_POOL_TIMEOUT', '10'))
     DEBUG = os.getenv('DEBUG', 'false').lower() in ['true', '1', 't', 'y', 'yes']
+    ANALYTICS_DATABASE = os.getenv('ANALYTICS_DATABASE', 'penta_book_analytics.db')
+    ANALYTICS_SNAPSHOT_INTERVAL = int(os.getenv('ANALYTICS_SNAPSHOT_INTERVAL', '300'))
+    HISTORY_DATABASE = os.getenv('HISTORY_DATABASE', 'penta_book_history.db')
+    ARCHIVE_AFTER_DAYS = int(os.getenv('ARCHIVE_AFTER_DAYS', '365'))
+    OPEN_CART_MAX_AGE_DAYS = int(os.getenv('OPEN_CART_MAX_AGE_DAYS', '30'))
+    ARCHIVE_BATCH_SIZE = int(os.getenv('ARCHIVE_BATCH_SIZE', '500'))
+    RECONCILE_BATCH_SIZE = int(os.getenv('RECONCILE_BATCH_SIZE', '5000'))
+    RECONCILE_SETTLE_MINUTES = int(os.getenv('RECONCILE_SETTLE_MINUTES', '30'))
+    UPLOAD_FOLDER = os.getenv('UPLOAD_FOLDER', 'static/uploads')
+    JINJA_BYTECODE_CACHE_DIR = os.getenv('JINJA_BYTECODE_CACHE_DIR', '.jinja_cache')
+    FRAGMENT_CACHE_ENABLED = os.getenv('FRAGMENT_CACHE_ENABLED', 'true').lower() in ['true', '1', 't', 'y', 'yes']
+    PASSWORD_HASH_METHOD = os.getenv('PASSWORD_HASH_METHOD', 'pbkdf2:sha256')
+    PASSWORD_SALT_LENGTH = int(os.getenv('PASSWORD_SALT_LENGTH', '16'))
+    HASH_POOL_WORKERS = int(os.getenv('HASH_POOL_WORKERS', '2'))
+    HASH_QUEUE_LIMIT = int(os.getenv('HASH_QUEUE_LIMIT', '16'))
+    HASH_TIMEOUT = float(os.getenv('HASH_TIMEOUT', '5'))
+    LOGIN_IP_LIMIT = int(os.getenv('LOGIN_IP_LIMIT', '20'))
+    LOGIN_IP_WINDOW = int(os.getenv('LOGIN_IP_WINDOW', '60'))
+    LOGIN_ACCOUNT_FAILURE_LIMIT = int(os.getenv('LOGIN_ACCOUNT_FAILURE_LIMIT', '5'))
+    LOGIN_ACCOUNT_FAILURE_WINDOW = int(os.getenv('LOGIN_ACCOUNT_FAILURE_WINDOW', '300'))
+    ADMISSION_ENABLED = os.getenv('ADMISSION_ENABLED', 'true').lower() in ['true', '1', 't', 'y', 'yes']
+    ADMISSION_BACKEND = os.getenv('ADMISSION_BACKEND', 'memory')  # 'memory' or 'sqlite'
+    ADMISSION_DATABASE = os.getenv('ADMISSION_DATABASE', 'penta_book_admission.db')
+    ADMISSION_BUDGETS = {
+        'customer.login': {'rate': 0.5, 'burst': 10, 'concurrency': 8},
+        'shop.shop_login': {'rate': 0.5, 'burst': 10, 'concurrency': 8},
+        'admin.admin_login': {'rate': 0.2, 'burst': 5, 'concurrency': 4},
+        'customer.checkout': {'rate': 1, 'burst': 5, 'concurrency': 8},
+        'customer.payment': {'rate': 1, 'burst': 5, 'concurrency': 8},
+        'shipment.create_shipment_route': {'rate': 2, 'burst': 10, 'concurrency': 8},
+        'api.list_books': {'rate': 20, 'burst': 60, 'concurrency': 16, 'methods': ('GET',)},
+        # Upstream mocks (mock_payment_gateway.py, mock_shipment_api.py)
+        'process_payment': {'rate': 20, 'burst': 40, 'concurrency': 16},
+        'initiate_shipment': {'rate': 20, 'burst': 40, 'concurrency': 16},
+        'track_shipment': {'rate': 20, 'burst': 40, 'concurrency': 16, 'methods': ('GET',)},
+    }
+    EVENTS_HEARTBEAT = int(os.getenv('EVENTS_HEARTBEAT', '15'))
+    EVENTS_STREAM_TIMEOUT = int(os.getenv('EVENTS_STREAM_TIMEOUT', '300'))
+    EVENTS_RETRY_MS = int(os.getenv('EVENTS_RETRY_MS', '3000'))
+    EVENTS_POLL_INTERVAL = float(os.getenv('EVENTS_POLL_INTERVAL', '0.5'))
+    TRACKING_CACHE_ENABLED = os.getenv('TRACKING_CACHE_ENABLED', 'true').lower() in ['true', '1', 't', 'y', 'yes']
+    TRACKING_TTL_IN_TRANSIT = int(os.getenv('TRACKING_TTL_IN_TRANSIT', '60'))
+    TRACKING_TTL_DELIVERED = int(os.getenv('TRACKING_TTL_DELIVERED', str(30 * 24 * 3600)))
+    CHANGE_FEED_ENABLED = os.getenv('CHANGE_FEED_ENABLED', 'true').lower() in ['true', '1', 't', 'y', 'yes']
+    CHANGE_LOG_KEEP = int(os.getenv('CHANGE_LOG_KEEP', '86400'))
+    OUTBOUND_TIMEOUT = float(os.getenv('OUTBOUND_TIMEOUT', '10'))
+    OUTBOUND_POOL_SIZE = int(os.getenv('OUTBOUND_POOL_SIZE', '100'))
+    NOTIFY_TRANSPORT = os.getenv('NOTIFY_TRANSPORT', 'log')  # 'log' or 'smtp'
+    NOTIFY_SENDER = os.getenv('NOTIFY_SENDER', 'orders@pentabook.local')
+    SMTP_HOST = os.getenv('SMTP_HOST', 'localhost')
+    SMTP_PORT = int(os.getenv('SMTP_PORT', '8025'))
+    NOTIFY_INTERVAL = int(os.getenv('NOTIFY_INTERVAL', '60'))
+    NOTIFY_BATCH_SIZE = int(os.getenv('NOTIFY_BATCH_SIZE', '500'))
+    NOTIFY_LEASE = int(os.getenv('NOTIFY_LEASE', '300'))
+    NOTIFY_MAX_ATTEMPTS = int(os.getenv('NOTIFY_MAX_ATTEMPTS', '8'))
+    NOTIFY_BACKOFF_BASE = int(os.getenv('NOTIFY_BACKOFF_BASE', '30'))
+    NOTIFY_BACKOFF_MAX = int(os.getenv('NOTIFY_BACKOFF_MAX', '3600'))
+    MAINTENANCE_INTERVAL = int(os.getenv('MAINTENANCE_INTERVAL', '60'))
+    MAINTENANCE_OPTIMIZE_INTERVAL = int(os.getenv('MAINTENANCE_OPTIMIZE_INTERVAL', '3600'))
+    MAINTENANCE_VACUUM_INTERVAL = int(os.getenv('MAINTENANCE_VACUUM_INTERVAL', '3600'))
+    MAINTENANCE_CHECKPOINT_INTERVAL = int(os.getenv('MAINTENANCE_CHECKPOINT_INTERVAL', '300'))
+    MAINTENANCE_BACKUP_INTERVAL = int(os.getenv('MAINTENANCE_BACKUP_INTERVAL', '86400'))
+    MAINTENANCE_CHANGELOG_INTERVAL = int(os.getenv('MAINTENANCE_CHANGELOG_INTERVAL', '3600'))
+    MAINTENANCE_ANALYSIS_LIMIT = int(os.getenv('MAINTENANCE_ANALYSIS_LIMIT', '1000'))
+    MAINTENANCE_STEP_PAGES = int(os.getenv('MAINTENANCE_STEP_PAGES', '256'))
+    MAINTENANCE_STEP_SLEEP = float(os.getenv('MAINTENANCE_STEP_SLEEP', '0.05'))
+    MAINTENANCE_VACUUM_MAX_PAGES = int(os.getenv('MAINTENANCE_VACUUM_MAX_PAGES', '10000'))
+    MAINTENANCE_BUSY_TIMEOUT = float(os.getenv('MAINTENANCE_BUSY_TIMEOUT', '1'))
+    BACKUP_DIR = os.getenv('BACKUP_DIR', 'backups')
+    BACKUP_KEEP = int(os.getenv('BACKUP_KEEP', '7'))
+    LEADERBOARD_REFRESH_INTERVAL = int(os.getenv('LEADERBOARD_REFRESH_INTERVAL', '15'))
+    STOCK_HOLD_TTL = int(os.getenv('STOCK_HOLD_TTL', '900'))
+    STOCK_SWEEP_INTERVAL = int(os.getenv('STOCK_SWEEP_INTERVAL', '60'))
+    PROFILING_ENABLED = os.getenv('PROFILING_ENABLED', 'false').lower() in ['true', '1', 't', 'y', 'yes']
+    PROFILE_SAMPLE_RATE = float(os.getenv('PROFILE_SAMPLE_RATE', '0'))
+    PROFILE_TOKEN = os.getenv('PROFILE_TOKEN', '')
+    PROFILE_INTERVAL = float(os.getenv('PROFILE_INTERVAL', '0.005'))
+    PROFILE_DIR = os.getenv('PROFILE_DIR', 'profiles')
+    PROFILE_KEEP = int(os.getenv('PROFILE_KEEP', '200'))
+    WARMUP_ENABLED = os.getenv('WARMUP_ENABLED', 'true').lower() in ['true', '1', 't', 'y', 'yes']
+    WARMUP_FILE = os.getenv('WARMUP_FILE', 'warmup.json')
+    WARMUP_TOP_N = int(os.getenv('WARMUP_TOP_N', '100'))
+    WARMUP_RECORD_INTERVAL = int(os.getenv('WARMUP_RECORD_INTERVAL', '300'))
+    WARMUP_BUDGET = float(os.getenv('WARMUP_BUDGET', '10'))
@@ -0,0 +1,185 @@
+"""Password hashing off the request threads.
+
+PBKDF2 is deliberately slow, so hashing runs in a small process pool. At
+most HASH_QUEUE_LIMIT jobs may be queued or running at once; beyond that
+logins fail fast instead of piling up behind each other. Per-account and
+per-IP throttles reject attack traffic before it reaches the pool.
+"""
+import hashlib
+import multiprocessing
+import os
+import threading
+import time
+from collections import defaultdict, deque
+from concurrent.futures import ProcessPoolExecutor, TimeoutError
+from concurrent.futures.process import BrokenProcessPool
+
+from flask import current_app, request
+from werkzeug.security import DEFAULT_PBKDF2_ITERATIONS, check_password_hash, generate_password_hash
+
+
+def hash_strength(method):
+    """(scheme, digest size, work factor) of a Werkzeug method string, with its defaults filled in."""
+    scheme, *args = method.split(':')
+    if scheme == 'pbkdf2':
+        digest = args[0] if args else 'sha256'
+        iterations = int(args[1]) if len(args) > 1 else DEFAULT_PBKDF2_ITERATIONS
+        return scheme, hashlib.new(digest).digest_size, iterations
+    if scheme == 'scrypt':
+        n, r, p = (list(map(int, args)) + [2 ** 15, 8, 1][len(args):])[:3]
+        return scheme, 0, n * r * p
+    return scheme, 0, 0
+
+
+class CredentialError(Exception):
+    pass
+
+
+class LoginThrottled(CredentialError):
+    pass
+
+
+class CredentialServiceBusy(CredentialError):
+    pass
+
+
+class SlidingWindow:
+    """Timestamps per key inside the last `window` seconds."""
+
+    max_keys = 10000
+
+    def __init__(self, limit, window):
+        self.limit = limit
+        self.window = window
+        self._hits = defaultdict(deque)
+        self._lock = threading.Lock()
+
+    def _trim(self, hits, now):
+        while hits and hits[0] <= now - self.window:
+            hits.popleft()
+
+    def is_blocked(self, key):
+        now = time.monotonic()
+        with self._lock:
+            hits = self._hits.get(key)
+            if not hits:
+                return False
+            self._trim(hits, now)
+            if not hits:
+                del self._hits[key]
+                return False
+            return len(hits) >= self.limit
+
+    def hit(self, key):
+        now = time.monotonic()
+        with self._lock:
+            if len(self._hits) >= self.max_keys:
+                # Forget keys whose last hit has left the window
+                for stale in [k for k, hits in self._hits.items() if hits[-1] <= now - self.window]:
+                    del self._hits[stale]
+            hits = self._hits[key]
+            self._trim(hits, now)
+            hits.append(now)
+
+    def reset(self, key):
+        with self._lock:
+            self._hits.pop(key, None)
+
+
+class CredentialService:
+    def __init__(self, config):
+        self.method = config['PASSWORD_HASH_METHOD']
+        self.salt_length = config['PASSWORD_SALT_LENGTH']
+        self.workers = config['HASH_POOL_WORKERS']
+        self.timeout = config['HASH_TIMEOUT']
+        self.slots = threading.BoundedSemaphore(config['HASH_QUEUE_LIMIT'])
+        self.ip_attempts = SlidingWindow(config['LOGIN_IP_LIMIT'], config['LOGIN_IP_WINDOW'])
+        self.account_failures = SlidingWindow(config['LOGIN_ACCOUNT_FAILURE_LIMIT'],
+                                              config['LOGIN_ACCOUNT_FAILURE_WINDOW'])
+        self._pool = None
+        self._pool_pid = None
+        self._pool_lock = threading.Lock()
+
+    def _get_pool(self):
+        # A pool inherited through fork has no live workers, so each process makes its own
+        if self._pool_pid != os.getpid():
+            with self._pool_lock:
+                if self._pool_pid != os.getpid():
+                    self._pool = ProcessPoolExecutor(max_workers=self.workers,
+                                                     mp_context=multiprocessing.get_context('spawn'))
+                    self._pool_pid = os.getpid()
+        return self._pool
+
+    def _run(self, func, *args):
+        if self.workers <= 0:
+            return func(*args)
+        if not self.slots.acquire(blocking=False):
+            raise CredentialServiceBusy('The server is busy. Please try again in a moment.')
+        try:
+            future = self._get_pool().submit(func, *args)
+        except BrokenProcessPool:
+            self.slots.release()
+            self._pool_pid = None  # start a fresh pool on the next call
+            raise CredentialServiceBusy('The server is busy. Please try again in a moment.')
+        # The slot is held until the job leaves the pool, not until this caller gives up on it
+        future.add_done_callback(lambda _: self.slots.release())
+        try:
+            return future.result(timeout=self.timeout)
+        except TimeoutError:
+            raise CredentialServiceBusy('The server is busy. Please try again in a moment.')
+        except BrokenProcessPool:
+            self._pool_pid = None
+            raise CredentialServiceBusy('The server is busy. Please try again in a moment.')
+
+    def hash_password(self, password):
+        return self._run(generate_password_hash, password, self.method, self.salt_length)
+
+    def needs_rehash(self, password_hash):
+        """True if the hash uses another scheme than the configured one, or a weaker digest or work factor."""
+        try:
+            scheme, digest_size, cost = hash_strength(password_hash.split('$', 1)[0])
+        except (ValueError, TypeError):
+            return True
+        wanted_scheme, wanted_digest_size, wanted_cost = hash_strength(self.method)
+        return scheme != wanted_scheme or digest_size < wanted_digest_size or cost < wanted_cost
+
+    def check_login(self, account, password_hash, password, ip):
+        if self.ip_attempts.is_blocked(ip) or self.account_failures.is_blocked(account):
+            raise LoginThrottled('Too many login attempts. Please wait a few minutes and try again.')
+        self.ip_attempts.hit(ip)
+
+        if password_hash and self._run(check_password_hash, password_hash, password):
+            self.account_failures.reset(account)
+            return True
+        self.account_failures.hit(account)
+        return False
+
+
+def init_app(app):
+    app.extensions['credentials'] = CredentialService(app.config)
+
+
+def _service():
+    return current_app.extensions['credentials']
+
+
+def hash_password(password):
+    return _service().hash_password(password)
+
+
+def check_login(account, password_hash, password):
+    """True if password matches; raises CredentialError when throttled or busy."""
+    return _service().check_login(account, password_hash, password, request.remote_addr)
+
+
+def rehash_if_needed(db, table, key_column, key, password_hash, password):
+    # Upgrade hashes made with older parameters while the plain password is at hand
+    service = _service()
+    if not service.needs_rehash(password_hash):
+        return
+    try:
+        new_hash = service.hash_password(password)
+    except CredentialError:
+        return  # try again on a later login
+    db.execute(f'UPDATE {table} SET password = ? WHERE {key_column} = ?', (new_hash, key))
+    db.commit()
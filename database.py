@@ -0,0 +1,198 @@
+from flask import current_app, g
+
+import archive
+import backends
+import bulk_edit
+import catalog
+import events
+import fragment_cache
+import invalidation
+import leaderboards
+import maintenance
+import notifications
+import order_history
+import recommendations
+import reconcile
+import reporting
+import reviews
+import stock_holds
+import tracking
+
+# The base tables, which SQLite has in the shipped penta_book.db. Ids are identity
+# columns and REAL is double precision, like SQLite's. Foreign keys are left out:
+# SQLite does not enforce them here, and deleting a book or a shop must not start failing.
+PG_SCHEMA = '''
+CREATE TABLE IF NOT EXISTS shop (
+    shop_id          INTEGER GENERATED BY DEFAULT AS IDENTITY PRIMARY KEY,
+    shop_name        TEXT NOT NULL UNIQUE,
+    owner_name       TEXT NOT NULL,
+    shop_phone       TEXT NOT NULL UNIQUE,
+    shop_address     TEXT NOT NULL,
+    shop_email       TEXT NOT NULL UNIQUE,
+    shop_description TEXT,
+    password         TEXT,
+    isverified       INTEGER
+);
+CREATE TABLE IF NOT EXISTS categories (
+    category_id   INTEGER GENERATED BY DEFAULT AS IDENTITY PRIMARY KEY,
+    category_name TEXT UNIQUE
+);
+CREATE TABLE IF NOT EXISTS paymentmethods (
+    method_id   INTEGER GENERATED BY DEFAULT AS IDENTITY PRIMARY KEY,
+    method_name TEXT
+);
+CREATE TABLE IF NOT EXISTS buyer (
+    buyer_id      INTEGER GENERATED BY DEFAULT AS IDENTITY PRIMARY KEY,
+    username      TEXT NOT NULL UNIQUE,
+    dob           TEXT,
+    email         TEXT NOT NULL UNIQUE,
+    phone_number  TEXT,
+    password      TEXT NOT NULL,
+    buyer_address TEXT
+);
+CREATE TABLE IF NOT EXISTS admin (
+    admin_id   INTEGER GENERATED BY DEFAULT AS IDENTITY PRIMARY KEY,
+    admin_name TEXT,
+    password   TEXT
+);
+CREATE TABLE IF NOT EXISTS books (
+    book_id     INTEGER GENERATED BY DEFAULT AS IDENTITY PRIMARY KEY,
+    category_id INTEGER,
+    shop_id     INTEGER,
+    book_name   TEXT,
+    isbn        BIGINT,
+    author      TEXT,
+    "desc"      TEXT,
+    price       DOUBLE PRECISION,
+    stock       INTEGER,
+    img_url     TEXT
+);
+CREATE TABLE IF NOT EXISTS cart (
+    cart_id  INTEGER GENERATED BY DEFAULT AS IDENTITY PRIMARY KEY,
+    buyer_id INTEGER,
+    status   TEXT NOT NULL
+);
+CREATE TABLE IF NOT EXISTS cartitems (
+    cart_item_id INTEGER GENERATED BY DEFAULT AS IDENTITY PRIMARY KEY,
+    cart_id      INTEGER,
+    book_id      INTEGER,
+    quantity     INTEGER NOT NULL
+);
+CREATE TABLE IF NOT EXISTS orders (
+    order_id         INTEGER GENERATED BY DEFAULT AS IDENTITY PRIMARY KEY,
+    cart_id          INTEGER,
+    buyer_id         INTEGER,
+    order_date       TEXT,
+    subtotal         DOUBLE PRECISION,
+    total            DOUBLE PRECISION,
+    status           TEXT,
+    delivery_address TEXT
+);
+CREATE TABLE IF NOT EXISTS orderitems (
+    order_item_id INTEGER GENERATED BY DEFAULT AS IDENTITY PRIMARY KEY,
+    order_id      INTEGER,
+    book_id       INTEGER,
+    shop_id       INTEGER,
+    quantity      INTEGER,
+    price         DOUBLE PRECISION,
+    total_price   DOUBLE PRECISION
+);
+CREATE TABLE IF NOT EXISTS payments (
+    payment_id     INTEGER GENERATED BY DEFAULT AS IDENTITY PRIMARY KEY,
+    method_id      INTEGER,
+    order_id       INTEGER,
+    transaction_id TEXT,
+    payment_date   TEXT,
+    payment_status TEXT,
+    payment_total  DOUBLE PRECISION
+);
+CREATE TABLE IF NOT EXISTS shipment (
+    shipment_id      INTEGER GENERATED BY DEFAULT AS IDENTITY PRIMARY KEY,
+    order_id         INTEGER,
+    tracking_no      TEXT,
+    shipment_date    TEXT,
+    received_date    TEXT,
+    status           TEXT,
+    shipment_service TEXT
+);
+CREATE TABLE IF NOT EXISTS reviews (
+    review_id     INTEGER GENERATED BY DEFAULT AS IDENTITY PRIMARY KEY,
+    buyer_id      INTEGER,
+    book_id       INTEGER,
+    order_item_id INTEGER,
+    rating        INTEGER,
+    comment       TEXT
+);
+'''
+
+# Modules with tables, indexes or columns of their own, in the order their schemas are created
+SCHEMA_MODULES = (reviews, catalog, recommendations, archive, fragment_cache, tracking, notifications,
+                  order_history, leaderboards, stock_holds, invalidation, events, bulk_edit)
+
+
+def get_backend():
+    return current_app.extensions['database']
+
+
+def get_db():
+    if 'db' not in g:
+        g.db = get_backend().connect()
+    return g.db
+
+
+def get_report_db():
+    # Reporting reads go to the analytics snapshot, never the live database
+    if get_backend().dialect != 'sqlite':
+        # The snapshot is a copy of the SQLite file; PostgreSQL reports read the live database
+        return get_db()
+    return reporting.get_report_db(current_app)
+
+
+def close_db(exception):
+    db = g.pop('db', None)
+    if db is not None:
+        db.close()
+    reporting.close_report_db(exception)
+
+
+def init_db(app):
+    backend = app.extensions['database'] = backends.make_backend(app.config)
+    if backend.dialect != 'sqlite':
+        init_pg_schema(backend)
+        return
+
+    # Create the tables and indexes added on top of the base schema
+    db = backend.connect()
+    try:
+        db.executescript(reviews.SCHEMA)
+        db.executescript(catalog.SCHEMA)
+        db.executescript(recommendations.SCHEMA)
+        db.executescript(archive.SCHEMA)
+        db.executescript(fragment_cache.SCHEMA)
+        db.executescript(tracking.SCHEMA)
+        db.executescript(notifications.SCHEMA)
+        db.executescript(order_history.SCHEMA)
+        db.executescript(reconcile.SCHEMA)
+        db.executescript(maintenance.SCHEMA)
+        db.executescript(leaderboards.SCHEMA)
+        db.executescript(stock_holds.SCHEMA)
+        db.executescript(invalidation.SCHEMA)
+        db.executescript(events.SCHEMA)
+        archive.migrate(db)
+        bulk_edit.migrate(db)
+    finally:
+        db.close()
+
+
+def init_pg_schema(backend):
+    """Create the base tables and every module's PG_SCHEMA in one transaction."""
+    db = backend.connect()
+    try:
+        # Workers starting together take turns, so none sees another's half-made schema
+        db.execute("SELECT pg_advisory_xact_lock(hashtext('penta_book.init_db'))")
+        db.executescript(PG_SCHEMA)
+        for module in SCHEMA_MODULES:
+            db.executescript(module.PG_SCHEMA)
+        db.commit()
+    finally:
+        db.close()
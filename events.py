@@ -0,0 +1,221 @@
+"""Pub/sub for order and shipment status changes, shared by every worker.
+
+Views publish after committing a state change; /events/orders streams the
+events to the buyer and shops involved as Server-Sent Events. Every
+subscriber is one small bounded queue, so idle watchers cost a parked
+thread or greenlet and nothing else.
+
+On SQLite a published event is written to order_events, and each worker's
+relay thread checks PRAGMA data_version every EVENTS_POLL_INTERVAL seconds
+and hands the new rows to the subscribers in its own process. An event
+therefore reaches every stream whichever worker serves it, and its id,
+the row's event_id, means the same to all of them when a browser resumes
+with Last-Event-ID. Without the relay (PostgreSQL, or an interval of 0)
+events only reach subscribers of the publishing process. The `changelog`
+maintenance task deletes events older than CHANGE_LOG_KEEP seconds.
+"""
+import itertools
+import json
+import logging
+import os
+import queue
+import sqlite3
+import threading
+import time
+from collections import deque
+
+from flask import current_app
+
+logger = logging.getLogger(__name__)
+
+SCHEMA = '''
+CREATE TABLE IF NOT EXISTS order_events (
+    event_id   INTEGER PRIMARY KEY AUTOINCREMENT,
+    channel    TEXT NOT NULL,
+    kind       TEXT NOT NULL,
+    data       TEXT NOT NULL,
+    created_at REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS idx_order_events_created_at ON order_events (created_at);
+'''
+
+PG_SCHEMA = '''
+CREATE TABLE IF NOT EXISTS order_events (
+    event_id   BIGINT GENERATED BY DEFAULT AS IDENTITY PRIMARY KEY,
+    channel    TEXT NOT NULL,
+    kind       TEXT NOT NULL,
+    data       TEXT NOT NULL,
+    created_at DOUBLE PRECISION NOT NULL
+);
+CREATE INDEX IF NOT EXISTS idx_order_events_created_at ON order_events (created_at);
+'''
+
+REPLAY_SIZE = 500
+QUEUE_SIZE = 100
+
+
+class Subscription:
+    def __init__(self, broker, channels):
+        self.broker = broker
+        self.channels = channels
+        self.queue = queue.Queue(QUEUE_SIZE)
+        self.closed = False
+
+    def get(self, timeout):
+        """Next event, or None after `timeout` seconds without one."""
+        try:
+            return self.queue.get(timeout=timeout)
+        except queue.Empty:
+            return None
+
+    def close(self):
+        self.broker.unsubscribe(self)
+
+
+class Broker:
+    def __init__(self, replay_size=REPLAY_SIZE):
+        self._subscribers = {}
+        self._recent = deque(maxlen=replay_size)
+        self._ids = itertools.count(1)
+        self._lock = threading.Lock()
+
+    def subscribe(self, channels, last_event_id=None):
+        subscription = Subscription(self, frozenset(channels))
+        with self._lock:
+            for channel in subscription.channels:
+                self._subscribers.setdefault(channel, set()).add(subscription)
+            if last_event_id is not None:
+                # Replay what a reconnecting client missed, as far as we still remember
+                for event in self._recent:
+                    if event['id'] > last_event_id and event['channel'] in subscription.channels:
+                        subscription.queue.put_nowait(event)
+        return subscription
+
+    def unsubscribe(self, subscription):
+        with self._lock:
+            subscription.closed = True
+            for channel in subscription.channels:
+                subscribers = self._subscribers.get(channel)
+                if subscribers:
+                    subscribers.discard(subscription)
+                    if not subscribers:
+                        del self._subscribers[channel]
+
+    def publish(self, channel, kind, data, event_id=None):
+        with self._lock:
+            event = {'id': event_id or next(self._ids), 'channel': channel, 'kind': kind, 'data': data}
+            self._recent.append(event)
+            subscribers = list(self._subscribers.get(channel, ()))
+        for subscription in subscribers:
+            try:
+                subscription.queue.put_nowait(event)
+            except queue.Full:
+                # A client this far behind gets dropped; it reconnects with Last-Event-ID
+                self.unsubscribe(subscription)
+
+    def subscriber_count(self):
+        with self._lock:
+            return len({s for subscribers in self._subscribers.values() for s in subscribers})
+
+
+broker = Broker()
+
+
+def buyer_channel(buyer_id):
+    return f'buyer:{buyer_id}'
+
+
+def shop_channel(shop_id):
+    return f'shop:{shop_id}'
+
+
+class Relay:
+    """Hands the order_events rows committed by any worker to this worker's broker."""
+
+    def __init__(self, path, interval, broker):
+        self.path = path
+        self.interval = interval
+        self.broker = broker
+        self._db = None
+        self._pid = None
+        self._data_version = None
+        self._last_event_id = None
+
+    def _connect(self):
+        # One connection per worker; a forked worker must not use its parent's
+        if self._pid != os.getpid():
+            self._db = sqlite3.connect(self.path, check_same_thread=False, isolation_level=None)
+            self._pid = os.getpid()
+            self._data_version = None
+        return self._db
+
+    def poll(self):
+        """Publish the events committed since the last poll; returns how many there were."""
+        db = self._connect()
+        data_version = db.execute('PRAGMA data_version').fetchone()[0]
+        if data_version == self._data_version:
+            return 0
+        self._data_version = data_version
+        if self._last_event_id is None:
+            # Streams opened before this worker started were served elsewhere
+            self._last_event_id = db.execute('SELECT COALESCE(MAX(event_id), 0) FROM order_events').fetchone()[0]
+            return 0
+        rows = db.execute('SELECT event_id, channel, kind, data FROM order_events WHERE event_id > ? '
+                          'ORDER BY event_id', (self._last_event_id,)).fetchall()
+        for event_id, channel, kind, data in rows:
+            self.broker.publish(channel, kind, json.loads(data), event_id)
+            self._last_event_id = event_id
+        return len(rows)
+
+    def run(self):
+        while True:
+            try:
+                self.poll()
+            except sqlite3.Error as e:
+                logger.error('Relaying order events failed: %s', e)
+            time.sleep(self.interval)
+
+
+def start_relay_thread(app):
+    """Relay order events from every worker to this one's streams in a daemon thread."""
+    interval = app.config['EVENTS_POLL_INTERVAL']
+    if interval <= 0 or app.extensions['database'].dialect != 'sqlite':
+        logger.warning('Order events are not relayed between workers; '
+                       'serve /events/orders from a single worker process.')
+        return None
+    relay = app.extensions['event_relay'] = Relay(app.config['DATABASE'], interval, broker)
+    relay.poll()
+    thread = threading.Thread(target=relay.run, name='event-relay', daemon=True)
+    thread.start()
+    return thread
+
+
+def prune(db, keep):
+    return db.execute('DELETE FROM order_events WHERE created_at < ?', (time.time() - keep,)).rowcount
+
+
+def publish_order_event(db, order_id, kind, **data):
+    """Tell the order's buyer and every shop with items in it about a change.
+
+    With the relay running the event is committed to order_events, so call
+    this after the change itself has been committed.
+    """
+    order = db.execute('SELECT buyer_id FROM orders WHERE order_id = ?', (order_id,)).fetchone()
+    if not order:
+        return
+    data['order_id'] = order_id
+    shops = db.execute('SELECT DISTINCT shop_id FROM orderitems WHERE order_id = ?', (order_id,)).fetchall()
+    channels = [buyer_channel(order['buyer_id'])] + [shop_channel(shop['shop_id']) for shop in shops]
+
+    if 'event_relay' not in current_app.extensions:
+        for channel in channels:
+            broker.publish(channel, kind, data)
+        return
+    now = time.time()
+    db.executemany('INSERT INTO order_events (channel, kind, data, created_at) VALUES (?, ?, ?, ?)',
+                   [(channel, kind, json.dumps(data), now) for channel in channels])
+    db.commit()
+
+
+def format_sse(event):
+    return f"id: {event['id']}\nevent: {event['kind']}\ndata: {json.dumps(event['data'])}\n\n"
@@ -59,3 +59,10 @@ class ShopUpdateForm(FlaskForm):
     shop_description = StringField('Description')
     submit = SubmitField('Update')
 
+
+class ReviewForm(FlaskForm):
+    rating = SelectField('Rating', coerce=int, choices=[(5, '5 - Excellent'), (4, '4 - Good'), (3, '3 - Average'),
+                                                        (2, '2 - Poor'), (1, '1 - Terrible')],
+                         validators=[DataRequired(), NumberRange(min=1, max=5)])
+    comment = TextAreaField('Comment', validators=[Length(max=1000)])
+    submit = SubmitField('Submit Review')
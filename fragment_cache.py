@@ -0,0 +1,155 @@
+"""`{% cache key, ttl %}...{% endcache %}` for rarely changing template blocks.
+
+Rendered fragments are kept in process memory under (key, data version).
+Writes that change what a fragment shows call bump_version() in their own
+transaction, so the next render in any worker misses and re-renders.
+
+With the change feed running there is no version in the key. Instead a
+fragment names what it shows while it renders, with
+`{{ cache_depends('book', book_id) }}`, and the feed evicts only the
+fragments that depend on a changed entity. A book grid shows the books in
+it, so a sale or a review drops just the grids listing that book; writes
+that can add a book to a grid record a 'listing' change for its category.
+"""
+import threading
+import time
+from collections import OrderedDict, defaultdict
+
+from flask import g
+from jinja2 import nodes
+from jinja2.ext import Extension
+
+SCHEMA = '''
+CREATE TABLE IF NOT EXISTS data_versions (
+    name    TEXT PRIMARY KEY,
+    version INTEGER NOT NULL DEFAULT 0
+);
+INSERT OR IGNORE INTO data_versions (name, version) VALUES ('catalog', 0);
+'''
+
+PG_SCHEMA = '''
+CREATE TABLE IF NOT EXISTS data_versions (
+    name    TEXT PRIMARY KEY,
+    version INTEGER NOT NULL DEFAULT 0
+);
+INSERT INTO data_versions (name, version) VALUES ('catalog', 0) ON CONFLICT DO NOTHING;
+'''
+
+DEFAULT_TTL = 300
+MAX_ENTRIES = 1000
+# entity_id meaning every entity of a kind
+ANY = '*'
+
+
+def bump_version(db, name='catalog'):
+    db.execute('INSERT INTO data_versions (name, version) VALUES (?, 1) '
+               'ON CONFLICT(name) DO UPDATE SET version = data_versions.version + 1', (name,))
+
+
+def current_version(db, name='catalog'):
+    # Read at most once per request
+    versions = g.setdefault('data_versions', {})
+    if name not in versions:
+        row = db.execute('SELECT version FROM data_versions WHERE name = ?', (name,)).fetchone()
+        versions[name] = row[0] if row else 0
+    return versions[name]
+
+
+class FragmentCache:
+    def __init__(self, max_entries=MAX_ENTRIES):
+        self.max_entries = max_entries
+        self.enabled = True
+        self.version_func = None
+        self._entries = OrderedDict()
+        # (entity, entity_id) -> cache keys of the fragments that show it
+        self._dependents = defaultdict(set)
+        self._rendering = threading.local()
+        self._lock = threading.Lock()
+
+    def depends(self, entity, entity_id=ANY):
+        """Mark the fragments being rendered as showing entity_id, or every entity of the kind."""
+        for tags in getattr(self._rendering, 'stack', ()):
+            tags.add((entity, str(entity_id)))
+
+    def get_or_render(self, key, ttl, render):
+        if not self.enabled:
+            return render()
+
+        version = self.version_func() if self.version_func else None
+        cache_key = (key, version)
+        now = time.monotonic()
+        with self._lock:
+            entry = self._entries.get(cache_key)
+            if entry and entry[0] > now:
+                self._entries.move_to_end(cache_key)
+                return entry[1]
+
+        stack = self._rendering.__dict__.setdefault('stack', [])
+        stack.append(set())
+        try:
+            html = render()
+        finally:
+            tags = stack.pop()
+        if stack:
+            # An enclosing fragment shows whatever this one does
+            stack[-1].update(tags)
+        with self._lock:
+            self._drop(cache_key)
+            self._entries[cache_key] = (now + (ttl or DEFAULT_TTL), html, tags)
+            for tag in tags:
+                self._dependents[tag].add(cache_key)
+            while len(self._entries) > self.max_entries:
+                self._drop(next(iter(self._entries)))
+        return html
+
+    def evict(self, entity, entity_id):
+        """Drop the fragments that show entity_id or every entity of its kind; ANY drops all of the kind."""
+        with self._lock:
+            if str(entity_id) == ANY:
+                tags = [tag for tag in self._dependents if tag[0] == entity]
+            else:
+                tags = [(entity, str(entity_id)), (entity, ANY)]
+            for cache_key in {key for tag in tags for key in self._dependents.get(tag, ())}:
+                self._drop(cache_key)
+
+    def _drop(self, cache_key):
+        entry = self._entries.pop(cache_key, None)
+        if entry is None:
+            return
+        for tag in entry[2]:
+            keys = self._dependents.get(tag)
+            if keys is not None:
+                keys.discard(cache_key)
+                if not keys:
+                    del self._dependents[tag]
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._dependents.clear()
+
+
+class FragmentCacheExtension(Extension):
+    tags = {'cache'}
+
+    def __init__(self, environment):
+        super().__init__(environment)
+        environment.extend(fragment_cache=FragmentCache())
+        environment.globals['cache_depends'] = self._depends
+
+    def parse(self, parser):
+        lineno = next(parser.stream).lineno
+        args = [parser.parse_expression()]
+        if parser.stream.skip_if('comma'):
+            args.append(parser.parse_expression())
+        else:
+            args.append(nodes.Const(None))
+        body = parser.parse_statements(('name:endcache',), drop_needle=True)
+        return nodes.CallBlock(self.call_method('_render_cached', args), [], [], body).set_lineno(lineno)
+
+    def _depends(self, entity, entity_id=ANY):
+        self.environment.fragment_cache.depends(entity, entity_id)
+        return ''
+
+    def _render_cached(self, key, ttl, caller):
+        return self.environment.fragment_cache.get_or_render(key, ttl, caller)
@@ -0,0 +1,126 @@
+"""Cross-worker invalidation of in-process caches.
+
+Writes that change cached data call record() inside their own transaction,
+which appends (entity, entity_id) rows to change_log; the row's seq is the
+change's version. Caches subscribe to the entities they hold, and before
+each request the worker's ChangeFeed asks its own long-lived connection for
+PRAGMA data_version. That number only moves when another connection has
+committed to the file, so an idle database costs one pragma per request.
+When it moves, the feed reads the change_log rows past the last seq it has
+seen and hands each one to the subscribers of its entity, which evict just
+those keys.
+
+A worker that falls behind the pruned log has every subscriber cleared.
+The `changelog` maintenance task deletes rows older than CHANGE_LOG_KEEP
+seconds.
+"""
+import os
+import sqlite3
+import threading
+import time
+from collections import defaultdict
+
+from flask import request
+
+SCHEMA = '''
+CREATE TABLE IF NOT EXISTS change_log (
+    seq        INTEGER PRIMARY KEY AUTOINCREMENT,
+    entity     TEXT NOT NULL,
+    entity_id  TEXT NOT NULL,
+    changed_at REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS idx_change_log_changed_at ON change_log (changed_at);
+'''
+
+PG_SCHEMA = '''
+CREATE TABLE IF NOT EXISTS change_log (
+    seq        BIGINT GENERATED BY DEFAULT AS IDENTITY PRIMARY KEY,
+    entity     TEXT NOT NULL,
+    entity_id  TEXT NOT NULL,
+    changed_at DOUBLE PRECISION NOT NULL
+);
+CREATE INDEX IF NOT EXISTS idx_change_log_changed_at ON change_log (changed_at);
+'''
+
+
+def record(db, entity, *entity_ids):
+    """Log a change to each entity_id in db's current transaction; the caller commits."""
+    now = time.time()
+    db.executemany('INSERT INTO change_log (entity, entity_id, changed_at) VALUES (?, ?, ?)',
+                   [(entity, str(entity_id), now) for entity_id in entity_ids])
+
+
+def prune(db, keep):
+    return db.execute('DELETE FROM change_log WHERE changed_at < ?', (time.time() - keep,)).rowcount
+
+
+class ChangeFeed:
+    def __init__(self, path):
+        self.path = path
+        self.stats = {'polls': 0, 'reads': 0, 'changes': 0, 'resets': 0}
+        self._handlers = defaultdict(list)
+        self._lock = threading.Lock()
+        self._db = None
+        self._pid = None
+        self._data_version = None
+        self._seq = None
+
+    def subscribe(self, entities, handler):
+        """Call handler(entity_id) for each change to one of entities; handler(None) means drop everything."""
+        for entity in entities:
+            self._handlers[entity].append(handler)
+
+    def _connect(self):
+        # One connection per worker; a forked worker must not use its parent's
+        if self._pid != os.getpid():
+            self._db = sqlite3.connect(self.path, check_same_thread=False, isolation_level=None)
+            self._pid = os.getpid()
+            self._data_version = None
+        return self._db
+
+    def poll(self):
+        """Dispatch the changes committed since the last poll; returns how many there were."""
+        with self._lock:
+            db = self._connect()
+            self.stats['polls'] += 1
+            data_version = db.execute('PRAGMA data_version').fetchone()[0]
+            if data_version == self._data_version:
+                return 0
+            self._data_version = data_version
+            self.stats['reads'] += 1
+
+            high = db.execute("SELECT seq FROM sqlite_sequence WHERE name = 'change_log'").fetchone()
+            high = high[0] if high else 0
+            if self._seq is None:
+                # Caches start empty, so earlier changes do not concern this worker
+                self._seq = high
+                return 0
+            rows = db.execute('SELECT seq, entity, entity_id FROM change_log WHERE seq > ? ORDER BY seq',
+                              (self._seq,)).fetchall()
+            missed = high > self._seq and (not rows or rows[0][0] > self._seq + 1)
+            self._seq = max(high, rows[-1][0] if rows else 0, self._seq)
+            self.stats['changes'] += len(rows)
+            if missed:
+                self.stats['resets'] += 1
+
+        if missed:
+            for handler in {handler for handlers in self._handlers.values() for handler in handlers}:
+                handler(None)
+            return len(rows)
+        for _, entity, entity_id in rows:
+            for handler in self._handlers.get(entity, ()):
+                handler(entity_id)
+        return len(rows)
+
+
+def _poll(feed):
+    if request.endpoint != 'static':
+        feed.poll()
+
+
+def init_app(app):
+    if not app.config['CHANGE_FEED_ENABLED'] or app.extensions['database'].dialect != 'sqlite':
+        return None
+    feed = app.extensions['change_feed'] = ChangeFeed(app.config['DATABASE'])
+    app.before_request(lambda: _poll(feed))
+    return feed
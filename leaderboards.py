@@ -0,0 +1,301 @@
+"""Bestseller leaderboards over the last 1, 7 and 30 days.
+
+payment() adds each paid order's units to per-day sales buckets, in the
+same transaction that marks the order paid, and marks the order's scopes
+(overall, each category, each shop) dirty. A refresh thread merges the
+buckets of every dirty scope into its top-K for each window and stores
+them in leaderboard_entries, so storefront and dashboard reads are a
+primary-key range scan. When the day changes every scope is recomputed and
+buckets older than the longest window are dropped.
+
+Refresh by hand with ``python leaderboards.py``; ``--full`` rebuilds the
+buckets from paid orders first.
+"""
+import argparse
+import datetime
+import heapq
+import logging
+import sqlite3
+import threading
+import time
+from collections import Counter
+
+import backends
+from config import Config
+
+logger = logging.getLogger(__name__)
+
+WINDOWS = (1, 7, 30)
+TOP_K = 10
+
+# Sales from before leaderboards existed are bucketed by order date, once
+SCHEMA = f'''
+CREATE TABLE IF NOT EXISTS book_sales_daily (
+    day         TEXT NOT NULL,
+    book_id     INTEGER NOT NULL,
+    shop_id     INTEGER NOT NULL,
+    category_id INTEGER NOT NULL,
+    units       INTEGER NOT NULL DEFAULT 0,
+    PRIMARY KEY (day, book_id)
+) WITHOUT ROWID;
+CREATE INDEX IF NOT EXISTS idx_book_sales_daily_category ON book_sales_daily (category_id, day, book_id, units);
+CREATE INDEX IF NOT EXISTS idx_book_sales_daily_shop ON book_sales_daily (shop_id, day, book_id, units);
+CREATE TABLE IF NOT EXISTS leaderboard_entries (
+    scope       TEXT NOT NULL,
+    scope_id    INTEGER NOT NULL,
+    window_days INTEGER NOT NULL,
+    rank        INTEGER NOT NULL,
+    book_id     INTEGER NOT NULL,
+    units       INTEGER NOT NULL,
+    PRIMARY KEY (scope, scope_id, window_days, rank)
+) WITHOUT ROWID;
+CREATE TABLE IF NOT EXISTS leaderboard_dirty (
+    scope    TEXT NOT NULL,
+    scope_id INTEGER NOT NULL,
+    PRIMARY KEY (scope, scope_id)
+) WITHOUT ROWID;
+CREATE TABLE IF NOT EXISTS leaderboard_state (
+    name  TEXT PRIMARY KEY,
+    value INTEGER NOT NULL
+);
+
+INSERT INTO book_sales_daily (day, book_id, shop_id, category_id, units)
+SELECT date(o.order_date), oi.book_id, IFNULL(oi.shop_id, 0), IFNULL(b.category_id, 0), SUM(oi.quantity)
+FROM orders o
+JOIN orderitems oi ON oi.order_id = o.order_id
+LEFT JOIN books b ON b.book_id = oi.book_id
+WHERE o.order_date >= date('now', '-{max(WINDOWS) - 1} days') AND o.status IN ('paid', 'Shipped')
+    AND oi.book_id IS NOT NULL
+    AND NOT EXISTS (SELECT 1 FROM leaderboard_state WHERE name = 'backfilled')
+GROUP BY 1, 2
+ON CONFLICT DO NOTHING;
+INSERT INTO leaderboard_state (name, value) VALUES ('backfilled', 1) ON CONFLICT DO NOTHING;
+'''
+
+PG_SCHEMA = f'''
+CREATE TABLE IF NOT EXISTS book_sales_daily (
+    day         TEXT NOT NULL,
+    book_id     INTEGER NOT NULL,
+    shop_id     INTEGER NOT NULL,
+    category_id INTEGER NOT NULL,
+    units       INTEGER NOT NULL DEFAULT 0,
+    PRIMARY KEY (day, book_id)
+);
+CREATE INDEX IF NOT EXISTS idx_book_sales_daily_category ON book_sales_daily (category_id, day, book_id, units);
+CREATE INDEX IF NOT EXISTS idx_book_sales_daily_shop ON book_sales_daily (shop_id, day, book_id, units);
+CREATE TABLE IF NOT EXISTS leaderboard_entries (
+    scope       TEXT NOT NULL,
+    scope_id    INTEGER NOT NULL,
+    window_days INTEGER NOT NULL,
+    rank        INTEGER NOT NULL,
+    book_id     INTEGER NOT NULL,
+    units       INTEGER NOT NULL,
+    PRIMARY KEY (scope, scope_id, window_days, rank)
+);
+CREATE TABLE IF NOT EXISTS leaderboard_dirty (
+    scope    TEXT NOT NULL,
+    scope_id INTEGER NOT NULL,
+    PRIMARY KEY (scope, scope_id)
+);
+CREATE TABLE IF NOT EXISTS leaderboard_state (
+    name  TEXT PRIMARY KEY,
+    value INTEGER NOT NULL
+);
+
+INSERT INTO book_sales_daily (day, book_id, shop_id, category_id, units)
+SELECT left(o.order_date, 10), oi.book_id, MAX(COALESCE(oi.shop_id, 0)), MAX(COALESCE(b.category_id, 0)),
+       SUM(oi.quantity)
+FROM orders o
+JOIN orderitems oi ON oi.order_id = o.order_id
+LEFT JOIN books b ON b.book_id = oi.book_id
+WHERE o.order_date >= to_char(now() AT TIME ZONE 'UTC' - interval '{max(WINDOWS) - 1} days', 'YYYY-MM-DD')
+    AND o.status IN ('paid', 'Shipped') AND oi.book_id IS NOT NULL
+    AND NOT EXISTS (SELECT 1 FROM leaderboard_state WHERE name = 'backfilled')
+GROUP BY 1, 2
+ON CONFLICT DO NOTHING;
+INSERT INTO leaderboard_state (name, value) VALUES ('backfilled', 1) ON CONFLICT DO NOTHING;
+'''
+
+
+def _today():
+    # UTC, like the CURRENT_TIMESTAMP order and payment dates
+    return datetime.datetime.now(datetime.timezone.utc).date()
+
+
+def record_order_paid(db, order_id):
+    """Add the order's units to today's buckets and mark its scopes dirty; the caller commits."""
+    items = db.execute('''
+        SELECT oi.book_id, MAX(COALESCE(oi.shop_id, 0)) AS shop_id, MAX(COALESCE(b.category_id, 0)) AS category_id,
+               SUM(oi.quantity) AS units
+        FROM orderitems oi
+        LEFT JOIN books b ON b.book_id = oi.book_id
+        WHERE oi.order_id = ? AND oi.book_id IS NOT NULL
+        GROUP BY oi.book_id
+    ''', (order_id,)).fetchall()
+    day = _today().isoformat()
+    db.executemany('''
+        INSERT INTO book_sales_daily (day, book_id, shop_id, category_id, units) VALUES (?, ?, ?, ?, ?)
+        ON CONFLICT (day, book_id) DO UPDATE SET units = book_sales_daily.units + excluded.units
+    ''', [(day, item['book_id'], item['shop_id'], item['category_id'], item['units']) for item in items])
+
+    scopes = {('all', 0)}
+    scopes.update(('category', item['category_id']) for item in items)
+    scopes.update(('shop', item['shop_id']) for item in items)
+    db.executemany('INSERT INTO leaderboard_dirty (scope, scope_id) VALUES (?, ?) ON CONFLICT DO NOTHING',
+                   sorted(scopes))
+
+
+def top_sellers(db, scope='all', scope_id=0, window_days=7, limit=TOP_K):
+    return db.execute('''
+        SELECT e.rank, e.book_id, e.units, c.book_name, c.author, c.img_url, c.price, c.category_name
+        FROM leaderboard_entries e
+        JOIN book_cards c ON c.book_id = e.book_id
+        WHERE e.scope = ? AND e.scope_id = ? AND e.window_days = ?
+        ORDER BY e.rank
+        LIMIT ?
+    ''', (scope, scope_id, window_days, limit)).fetchall()
+
+
+def _compute(db, scope, scope_id, today, top_k):
+    # One read of the longest window; the shorter windows are sums of its newest buckets
+    first_days = {days: (today - datetime.timedelta(days=days - 1)).isoformat() for days in WINDOWS}
+    scope_filter = {'all': '', 'category': 'AND category_id = ?', 'shop': 'AND shop_id = ?'}[scope]
+    rows = db.execute(f'SELECT day, book_id, units FROM book_sales_daily WHERE day >= ? {scope_filter}',
+                      (first_days[max(WINDOWS)], *(() if scope == 'all' else (scope_id,)))).fetchall()
+
+    totals = {days: Counter() for days in WINDOWS}
+    for day, book_id, units in rows:
+        for days in WINDOWS:
+            if day >= first_days[days]:
+                totals[days][book_id] += units
+
+    db.execute('DELETE FROM leaderboard_entries WHERE scope = ? AND scope_id = ?', (scope, scope_id))
+    for days, counts in totals.items():
+        best = heapq.nlargest(top_k, counts.items(), key=lambda item: (item[1], -item[0]))
+        db.executemany('''
+            INSERT INTO leaderboard_entries (scope, scope_id, window_days, rank, book_id, units)
+            VALUES (?, ?, ?, ?, ?, ?)
+        ''', [(scope, scope_id, days, rank, book_id, units)
+              for rank, (book_id, units) in enumerate(best, start=1) if units > 0])
+
+
+def _roll_over(db, today):
+    # Windows moved: drop expired buckets and recompute every scope that had or has sales
+    cutoff = (today - datetime.timedelta(days=max(WINDOWS) - 1)).isoformat()
+    db.execute('DELETE FROM book_sales_daily WHERE day < ?', (cutoff,))
+    db.execute('''
+        INSERT INTO leaderboard_dirty (scope, scope_id)
+        SELECT 'all', 0
+        UNION SELECT 'category', category_id FROM book_sales_daily
+        UNION SELECT 'shop', shop_id FROM book_sales_daily
+        UNION SELECT scope, scope_id FROM leaderboard_entries WHERE true
+        ON CONFLICT DO NOTHING
+    ''')
+    db.execute("INSERT INTO leaderboard_state (name, value) VALUES ('refreshed_day', ?) "
+               "ON CONFLICT(name) DO UPDATE SET value = excluded.value", (today.toordinal(),))
+
+
+def _begin(db):
+    if backends.dialect(db) == 'sqlite':
+        db.execute('BEGIN IMMEDIATE')
+    else:
+        # Held to the end of the transaction, like SQLite's write lock
+        db.execute("SELECT pg_advisory_xact_lock(hashtext('penta_book.leaderboards'))")
+
+
+def refresh(db, top_k=TOP_K, batch_size=100):
+    """Recompute the dirty scopes; returns how many were recomputed."""
+    today = _today()
+    refreshed = 0
+    while True:
+        # Claiming and recomputing in one locked transaction keeps workers off each other's scopes
+        _begin(db)
+        try:
+            row = db.execute("SELECT value FROM leaderboard_state WHERE name = 'refreshed_day'").fetchone()
+            if row is None or row[0] != today.toordinal():
+                _roll_over(db, today)
+            scopes = _claim_dirty(db, batch_size)
+            for scope, scope_id in scopes:
+                _compute(db, scope, scope_id, today, top_k)
+            db.commit()
+        except BaseException:
+            db.rollback()
+            raise
+        refreshed += len(scopes)
+        if len(scopes) < batch_size:
+            return refreshed
+
+
+def _claim_dirty(db, batch_size):
+    scopes = db.execute('SELECT scope, scope_id FROM leaderboard_dirty ORDER BY scope, scope_id LIMIT ?',
+                        (batch_size,)).fetchall()
+    db.executemany('DELETE FROM leaderboard_dirty WHERE scope = ? AND scope_id = ?', scopes)
+    return scopes
+
+
+def rebuild(db):
+    """Re-bucket the paid orders of the longest window and recompute every scope."""
+    _begin(db)
+    try:
+        db.execute('DELETE FROM book_sales_daily')
+        db.execute('DELETE FROM leaderboard_entries')
+        db.execute("DELETE FROM leaderboard_state WHERE name IN ('backfilled', 'refreshed_day')")
+        db.commit()
+    except BaseException:
+        db.rollback()
+        raise
+    db.executescript(SCHEMA if backends.dialect(db) == 'sqlite' else PG_SCHEMA)
+    db.commit()
+    return refresh(db)
+
+
+def connect(path):
+    # Autocommit, so refresh() controls its own transactions
+    db = sqlite3.connect(path, timeout=30, isolation_level=None)
+    db.row_factory = sqlite3.Row
+    return db
+
+
+def start_refresh_thread(app):
+    """Recompute dirty leaderboards every LEADERBOARD_REFRESH_INTERVAL seconds in a daemon thread."""
+    interval = app.config['LEADERBOARD_REFRESH_INTERVAL']
+    if interval <= 0:
+        return None
+    backend = app.extensions['database']
+
+    def run():
+        db = connect(app.config['DATABASE']) if backend.dialect == 'sqlite' else None
+        while True:
+            # A pooled PostgreSQL connection is borrowed for one pass, not held between passes
+            conn = db or backend.connect()
+            try:
+                refresh(conn)
+            except backends.DB_ERRORS as e:
+                logger.error('Leaderboard refresh failed: %s', e)
+            finally:
+                if conn is not db:
+                    conn.close()
+            time.sleep(interval)
+
+    thread = threading.Thread(target=run, name='leaderboard-refresh', daemon=True)
+    thread.start()
+    return thread
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Recompute bestseller leaderboards.')
+    parser.add_argument('--database', default=Config.DATABASE)
+    parser.add_argument('--full', action='store_true', help='rebuild the sales buckets from paid orders first')
+    args = parser.parse_args()
+
+    db = connect(args.database)
+    try:
+        db.executescript(SCHEMA)
+        refreshed = rebuild(db) if args.full else refresh(db)
+    finally:
+        db.close()
+    print(f'Recomputed {refreshed} leaderboards.')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,299 @@
+"""Routine upkeep of penta_book.db.
+
+  optimize    ANALYZE on the first run, PRAGMA optimize afterwards, so the
+              planner has sqlite_stat1 to choose join orders from
+  vacuum      returns free pages to the filesystem with incremental_vacuum
+  checkpoint  copies the WAL back into the database file (WAL mode only)
+  backup      online copy into BACKUP_DIR with the backup API, keeping the
+              newest BACKUP_KEEP files
+  changelog   deletes change_log rows and order_events older than
+              CHANGE_LOG_KEEP seconds
+
+Each worker runs a scheduler thread that wakes every MAINTENANCE_INTERVAL
+seconds and runs the tasks whose own interval has passed. A task is claimed
+in maintenance_runs first, so only one worker runs it. Work is done in
+small steps with sleeps in between, and a task that cannot get a lock
+within MAINTENANCE_BUSY_TIMEOUT is put off to the next tick, so maintenance
+gives way to requests.
+
+Incremental vacuum needs auto_vacuum=INCREMENTAL, which an existing file
+only gets from a full VACUUM. Convert it once, while the app is stopped,
+with ``python maintenance.py setup`` (which also switches to WAL).
+
+Run due tasks with ``python maintenance.py``, one task with
+``python maintenance.py backup``, and print file and cache stats with
+``python maintenance.py stats``.
+"""
+import argparse
+import datetime
+import glob
+import logging
+import os
+import sqlite3
+import threading
+import time
+
+import events
+import invalidation
+from config import Config
+
+logger = logging.getLogger(__name__)
+
+SCHEMA = '''
+CREATE TABLE IF NOT EXISTS maintenance_runs (
+    task        TEXT PRIMARY KEY,
+    started_at  REAL NOT NULL DEFAULT 0,
+    finished_at REAL,
+    duration    REAL,
+    detail      TEXT
+);
+'''
+
+AUTO_VACUUM_INCREMENTAL = 2
+
+
+def _pragma(db, name):
+    return db.execute(f'PRAGMA {name}').fetchone()[0]
+
+
+def optimize(db, config):
+    db.execute(f"PRAGMA analysis_limit = {int(config['MAINTENANCE_ANALYSIS_LIMIT'])}")
+    analyzed = db.execute("SELECT 1 FROM sqlite_master WHERE name = 'sqlite_stat1'").fetchone()
+    if analyzed:
+        # Re-analyzes only the tables whose row counts changed enough to matter
+        db.execute('PRAGMA optimize')
+        return 'PRAGMA optimize'
+    db.execute('ANALYZE')
+    return 'ANALYZE (first run)'
+
+
+def vacuum(db, config):
+    if _pragma(db, 'auto_vacuum') != AUTO_VACUUM_INCREMENTAL:
+        return 'skipped: auto_vacuum is not INCREMENTAL (run `python maintenance.py setup`)'
+    freed = 0
+    free = _pragma(db, 'freelist_count')
+    while free and freed < config['MAINTENANCE_VACUUM_MAX_PAGES']:
+        pages = min(free, config['MAINTENANCE_STEP_PAGES'], config['MAINTENANCE_VACUUM_MAX_PAGES'] - freed)
+        # Each step of the statement frees one page; executescript runs it to the end
+        db.executescript(f'PRAGMA incremental_vacuum({pages})')
+        left = _pragma(db, 'freelist_count')
+        if left >= free:
+            break
+        freed, free = freed + free - left, left
+        time.sleep(config['MAINTENANCE_STEP_SLEEP'])
+    return f'freed {freed} pages, {free} left'
+
+
+def checkpoint(db, config, mode='PASSIVE'):
+    if _pragma(db, 'journal_mode') != 'wal':
+        return 'skipped: not in WAL mode'
+    busy, log_pages, checkpointed = db.execute(f'PRAGMA wal_checkpoint({mode})').fetchone()
+    return f'{checkpointed} of {log_pages} WAL pages checkpointed' + (' (readers active)' if busy else '')
+
+
+def backup(db, config):
+    source_path = db.execute('PRAGMA database_list').fetchone()[2]
+    backup_dir = config['BACKUP_DIR']
+    os.makedirs(backup_dir, exist_ok=True)
+    name = os.path.splitext(os.path.basename(source_path))[0]
+    path = os.path.join(backup_dir, f'{name}-{datetime.datetime.now():%Y%m%d-%H%M%S}.db')
+
+    # Copied into a temporary file and moved into place, so a backup file is always complete
+    tmp_path = f'{path}.{os.getpid()}.tmp'
+    target = sqlite3.connect(tmp_path)
+    try:
+        db.backup(target, pages=config['MAINTENANCE_STEP_PAGES'], sleep=config['MAINTENANCE_STEP_SLEEP'])
+    finally:
+        target.close()
+    os.replace(tmp_path, path)
+
+    backups = sorted(glob.glob(os.path.join(backup_dir, f'{name}-*.db')))
+    for old in backups[:-config['BACKUP_KEEP']] if config['BACKUP_KEEP'] > 0 else []:
+        os.remove(old)
+    return f'{path} ({os.path.getsize(path)} bytes)'
+
+
+def changelog(db, config):
+    keep = config['CHANGE_LOG_KEEP']
+    return f'pruned {invalidation.prune(db, keep)} change log rows and {events.prune(db, keep)} order events'
+
+
+# In the order a tick runs them
+TASKS = {'optimize': optimize, 'vacuum': vacuum, 'checkpoint': checkpoint, 'backup': backup, 'changelog': changelog}
+
+
+def stats(db):
+    """File size, free pages and page cache figures for db."""
+    path = db.execute('PRAGMA database_list').fetchone()[2]
+    page_size = _pragma(db, 'page_size')
+    page_count = _pragma(db, 'page_count')
+    freelist = _pragma(db, 'freelist_count')
+    cache_size = _pragma(db, 'cache_size')
+    # A negative cache_size is a limit in KiB rather than in pages
+    cache_bytes = -cache_size * 1024 if cache_size < 0 else cache_size * page_size
+    wal_path = f'{path}-wal'
+    return {
+        'file_size': os.path.getsize(path),
+        'wal_size': os.path.getsize(wal_path) if os.path.exists(wal_path) else 0,
+        'page_size': page_size,
+        'page_count': page_count,
+        'freelist_count': freelist,
+        'free_ratio': freelist / page_count if page_count else 0,
+        'journal_mode': _pragma(db, 'journal_mode'),
+        'auto_vacuum': ('none', 'full', 'incremental')[_pragma(db, 'auto_vacuum')],
+        'analyzed': db.execute("SELECT 1 FROM sqlite_master WHERE name = 'sqlite_stat1'").fetchone() is not None,
+        'cache_bytes': cache_bytes,
+        'cache_coverage': min(1.0, cache_bytes / (page_count * page_size)) if page_count else 1.0,
+        'mmap_size': _pragma(db, 'mmap_size'),
+    }
+
+
+def last_runs(db):
+    return db.execute('SELECT task, started_at, finished_at, duration, detail FROM maintenance_runs '
+                      'ORDER BY task').fetchall()
+
+
+def claim(db, task, interval):
+    # Only one worker gets a task per interval; started_at moves forward when it is claimed
+    now = time.time()
+    return db.execute('''
+        INSERT INTO maintenance_runs (task, started_at) VALUES (?, ?)
+        ON CONFLICT(task) DO UPDATE SET started_at = excluded.started_at
+        WHERE maintenance_runs.started_at <= ?
+        RETURNING task
+    ''', (task, now, now - interval)).fetchone() is not None
+
+
+def _interval(config, task):
+    return config[f'MAINTENANCE_{task.upper()}_INTERVAL']
+
+
+def connect(path, busy_timeout=Config.MAINTENANCE_BUSY_TIMEOUT):
+    # Autocommit, so every step commits and releases its locks straight away
+    db = sqlite3.connect(path, timeout=busy_timeout, isolation_level=None, check_same_thread=False)
+    db.row_factory = sqlite3.Row
+    return db
+
+
+def _is_busy(error):
+    return 'locked' in str(error) or 'busy' in str(error)
+
+
+def record(db, task, started, detail):
+    finished = time.time()
+    db.execute('''
+        INSERT INTO maintenance_runs (task, started_at, finished_at, duration, detail) VALUES (?, ?, ?, ?, ?)
+        ON CONFLICT(task) DO UPDATE SET started_at = excluded.started_at, finished_at = excluded.finished_at,
+            duration = excluded.duration, detail = excluded.detail
+    ''', (task, started, finished, finished - started, detail))
+    logger.info('Maintenance %s took %.2fs: %s', task, finished - started, detail)
+
+
+def run_tasks(db, config, tasks=TASKS, force=False):
+    """Run the given tasks that are due (all of them with force); returns {task: detail}."""
+    results = {}
+    for task in tasks:
+        claimed = False
+        try:
+            if not force:
+                claimed = claim(db, task, _interval(config, task))
+                if not claimed:
+                    continue
+            started = time.time()
+            results[task] = TASKS[task](db, config)
+            record(db, task, started, results[task])
+        except sqlite3.OperationalError as e:
+            if not _is_busy(e):
+                raise
+            # Put off to the next tick rather than wait on foreground writers
+            results[task] = f'deferred: {e}'
+            logger.info('Maintenance %s deferred: %s', task, e)
+            if claimed:
+                try:
+                    db.execute('UPDATE maintenance_runs SET started_at = 0 WHERE task = ?', (task,))
+                except sqlite3.OperationalError as e:
+                    if not _is_busy(e):
+                        raise
+    return results
+
+
+def setup(path):
+    """Switch an existing file to auto_vacuum=INCREMENTAL and WAL; rewrites the whole file."""
+    db = connect(path, busy_timeout=30)
+    try:
+        db.execute('PRAGMA auto_vacuum = INCREMENTAL')
+        db.execute('VACUUM')
+        db.execute('PRAGMA journal_mode = WAL')
+        return stats(db)
+    finally:
+        db.close()
+
+
+def start_maintenance_thread(app):
+    """Run due maintenance tasks every MAINTENANCE_INTERVAL seconds in a daemon thread."""
+    interval = app.config['MAINTENANCE_INTERVAL']
+    if interval <= 0 or app.extensions['database'].dialect != 'sqlite':
+        return None
+
+    def run():
+        db = connect(app.config['DATABASE'], app.config['MAINTENANCE_BUSY_TIMEOUT'])
+        while True:
+            time.sleep(interval)
+            try:
+                run_tasks(db, app.config)
+            except (sqlite3.Error, OSError) as e:
+                logger.error('Maintenance failed: %s', e)
+
+    thread = threading.Thread(target=run, name='database-maintenance', daemon=True)
+    thread.start()
+    return thread
+
+
+def print_stats(db):
+    for name, value in stats(db).items():
+        print(f'{name:16} {value:.1%}' if name in ('free_ratio', 'cache_coverage') else f'{name:16} {value}')
+    for run in last_runs(db):
+        finished = datetime.datetime.fromtimestamp(run['finished_at']).isoformat(timespec='seconds') \
+            if run['finished_at'] else 'never'
+        print(f"last {run['task']:11} {finished}  {run['detail'] or ''}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Run database maintenance tasks.')
+    parser.add_argument('command', nargs='?', default='due', choices=('due', 'all', 'stats', 'setup', *TASKS),
+                        help='due: tasks whose interval has passed; all: every task now')
+    parser.add_argument('--database', default=Config.DATABASE)
+    parser.add_argument('--backup-dir', default=Config.BACKUP_DIR)
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO)
+    config = {name: getattr(Config, name) for name in dir(Config) if name.isupper()}
+    config['BACKUP_DIR'] = args.backup_dir
+
+    if args.command == 'setup':
+        setup(args.database)
+        print(f'{args.database} now uses auto_vacuum=INCREMENTAL and WAL.')
+        return
+
+    db = connect(args.database)
+    try:
+        db.executescript(SCHEMA)
+        db.executescript(invalidation.SCHEMA)
+        db.executescript(events.SCHEMA)
+        if args.command == 'stats':
+            print_stats(db)
+            return
+        if args.command == 'due':
+            results = run_tasks(db, config)
+        else:
+            results = run_tasks(db, config, list(TASKS) if args.command == 'all' else [args.command], force=True)
+        for task, detail in results.items():
+            print(f'{task:11} {detail}')
+        if not results:
+            print('Nothing due.')
+    finally:
+        db.close()
+
+
+if __name__ == '__main__':
+    main()
@@ -1,9 +1,27 @@
+import os
+
+# MOCK_ASYNC serves each request from a greenlet, so MOCK_LATENCY delays overlap
+# instead of queueing behind a thread per request
+if os.getenv('MOCK_ASYNC', 'false').lower() in ['true', '1', 't', 'y', 'yes']:
+    from gevent import monkey
+    monkey.patch_all()
+
 from flask import Flask, request, jsonify
 import uuid
 import logging
+import time
 import sqlite3
 
+import admission
+import backends
+from config import Config
+
 app = Flask(__name__)
+app.config.from_object(Config)
+admission.init_app(app)
+backend = backends.make_backend(app.config)
+
+MOCK_LATENCY = float(os.getenv('MOCK_LATENCY', '0'))
 
 # Configuring logging
 logging.basicConfig(level=logging.DEBUG)
@@ -12,19 +30,52 @@ logger = logging.getLogger(__name__)
 # In-memory store for payment activities
 payment_history = []
 
+# Every processed transaction, for the reconciliation job's batch reads
+GATEWAY_DATABASE = os.getenv('GATEWAY_DATABASE', 'mock_gateway.db')
+TRANSACTIONS_SCHEMA = '''
+CREATE TABLE IF NOT EXISTS gateway_transactions (
+    transaction_id TEXT PRIMARY KEY,
+    order_id       INTEGER NOT NULL,
+    amount         REAL NOT NULL,
+    method_id      TEXT NOT NULL,
+    status         TEXT NOT NULL,
+    created_at     TEXT NOT NULL DEFAULT CURRENT_TIMESTAMP
+);
+CREATE INDEX IF NOT EXISTS idx_gateway_transactions_order ON gateway_transactions (order_id, transaction_id);
+'''
+MAX_BATCH = 10000
+MAX_ORDER_IDS = 1000
+
 
 def get_db():
-    conn = sqlite3.connect('penta_book.db')
+    return backend.connect()
+
+
+def get_gateway_db():
+    conn = sqlite3.connect(GATEWAY_DATABASE, timeout=30)
     conn.row_factory = sqlite3.Row
     return conn
 
 
+def init_gateway_db():
+    gateway_db = get_gateway_db()
+    try:
+        gateway_db.executescript(TRANSACTIONS_SCHEMA)
+    finally:
+        gateway_db.close()
+
+
+init_gateway_db()
+
+
 # Retrieving valid payment methods from the database
 def get_valid_payment_methods():
     try:
         db = get_db()
-        cur = db.execute('SELECT method_id, method_name FROM paymentmethods')
-        payment_methods = cur.fetchall()
+        try:
+            payment_methods = db.execute('SELECT method_id, method_name FROM paymentmethods').fetchall()
+        finally:
+            db.close()
         return {str(method['method_id']): method['method_name'] for method in payment_methods}
     except Exception as e:
         logger.error(f"Error retrieving payment methods from database: {e}")
@@ -34,6 +85,7 @@ def get_valid_payment_methods():
 @app.route('/process_payment', methods=['POST'])
 def process_payment():
     data = request.json
+    time.sleep(MOCK_LATENCY)
     app.logger.debug(f"Received payment request: {data}")
 
     if not data.get('amount') or not isinstance(data['amount'], (int, float)):
@@ -73,6 +125,15 @@ def process_payment():
 
     app.logger.info(f'Processed payment: {response}')
 
+    gateway_db = get_gateway_db()
+    try:
+        with gateway_db:
+            gateway_db.execute('INSERT INTO gateway_transactions (transaction_id, order_id, amount, method_id, status) '
+                               'VALUES (?, ?, ?, ?, ?)',
+                               (transaction_id, int(data['order_id']), data['amount'], method_id, payment_status))
+    finally:
+        gateway_db.close()
+
     return jsonify({'status': 'success', 'data': response}), 200
 
 
@@ -81,5 +142,55 @@ def get_payment_history():
     return jsonify({'status': 'success', 'data': payment_history}), 200
 
 
+@app.route('/transactions', methods=['GET'])
+def list_transactions():
+    # Keyset pages in (order_id, transaction_id) order; pass the last row's pair
+    # as after_order_id/after_transaction_id to get the next page, or
+    # after_order_id alone to start after a whole order. order_ids (comma-separated)
+    # limits the pages to those orders
+    limit = min(request.args.get('limit', 1000, type=int), MAX_BATCH)
+    after_order_id = request.args.get('after_order_id', type=int)
+    after_transaction_id = request.args.get('after_transaction_id')
+    max_order_id = request.args.get('max_order_id', type=int)
+    order_ids = request.args.get('order_ids')
+    if order_ids is not None:
+        try:
+            order_ids = [int(order_id) for order_id in order_ids.split(',') if order_id.strip()]
+        except ValueError:
+            return jsonify({'status': 'failed', 'message': 'order_ids must be comma-separated order ids'}), 400
+        if not order_ids or len(order_ids) > MAX_ORDER_IDS:
+            return jsonify({'status': 'failed', 'message': f'order_ids takes 1 to {MAX_ORDER_IDS} order ids'}), 400
+
+    query = 'SELECT transaction_id, order_id, amount, method_id, status FROM gateway_transactions WHERE 1 = 1'
+    params = []
+    if after_order_id is not None and after_transaction_id is not None:
+        query += ' AND (order_id, transaction_id) > (?, ?)'
+        params += [after_order_id, after_transaction_id]
+    elif after_order_id is not None:
+        query += ' AND order_id > ?'
+        params.append(after_order_id)
+    if max_order_id is not None:
+        query += ' AND order_id <= ?'
+        params.append(max_order_id)
+    if order_ids is not None:
+        query += f" AND order_id IN ({', '.join('?' * len(order_ids))})"
+        params += order_ids
+    query += ' ORDER BY order_id, transaction_id LIMIT ?'
+    params.append(limit)
+
+    gateway_db = get_gateway_db()
+    try:
+        rows = [dict(row) for row in gateway_db.execute(query, params)]
+    finally:
+        gateway_db.close()
+    next_cursor = {'order_id': rows[-1]['order_id'], 'transaction_id': rows[-1]['transaction_id']} \
+        if len(rows) == limit else None
+    return jsonify({'status': 'success', 'data': rows, 'next': next_cursor}), 200
+
+
 if __name__ == '__main__':
-    app.run(port=5001, debug=True)
+    if os.getenv('MOCK_ASYNC', 'false').lower() in ['true', '1', 't', 'y', 'yes']:
+        from gevent.pywsgi import WSGIServer
+        WSGIServer(('127.0.0.1', 5001), app, log=None).serve_forever()
+    else:
+        app.run(port=5001, debug=True)
@@ -1,11 +1,29 @@
+import os
+
+# MOCK_ASYNC serves each request from a greenlet, so MOCK_LATENCY delays overlap
+# instead of queueing behind a thread per request
+if os.getenv('MOCK_ASYNC', 'false').lower() in ['true', '1', 't', 'y', 'yes']:
+    from gevent import monkey
+    monkey.patch_all()
+
 from flask import Flask, request, jsonify
-import sqlite3
 import random
 import datetime
 import logging
+import time
+
+import admission
+import backends
+import queries
+from config import Config
 
 # Set up application
 app = Flask(__name__)
+app.config.from_object(Config)
+admission.init_app(app)
+backend = backends.make_backend(app.config)
+
+MOCK_LATENCY = float(os.getenv('MOCK_LATENCY', '0'))
 
 # Configure logging
 logging.basicConfig(level=logging.INFO)
@@ -13,10 +31,8 @@ logging.basicConfig(level=logging.INFO)
 
 def get_db():
     try:
-        db = sqlite3.connect('penta_book.db')  # Ensure the path is correct
-        db.row_factory = sqlite3.Row
-        return db
-    except sqlite3.Error as e:
+        return backend.connect()
+    except backends.DB_ERRORS as e:
         logging.error(f"Database connection failed: {e}")
         raise
 
@@ -24,6 +40,7 @@ def get_db():
 @app.route('/initiate_shipment', methods=['POST'])
 def initiate_shipment():
     data = request.json
+    time.sleep(MOCK_LATENCY)
 
     if not data or 'order_id' not in data:
         return jsonify({'status': 'error', 'message': 'Order ID is required.'}), 400
@@ -42,20 +59,14 @@ def initiate_shipment():
         tracking_no = 'TRK' + str(random.randint(100000, 999999))
 
         # Create shipment entry
-        db.execute('''
-            INSERT INTO shipment (order_id, tracking_no, shipment_date, status, shipment_service)
-            VALUES (?, ?, ?, ?, ?)
-        ''', (order_id, tracking_no, datetime.datetime.now().isoformat(), 'Shipped', shipment_service))
-        db.commit()
-        db.execute('''
-            INSERT INTO orders (status)
-            VALUES (?)
-            ''', 'Shipped')
+        queries.run(db, 'create_shipment', order_id=order_id, tracking_no=tracking_no,
+                    shipment_date=datetime.datetime.now().isoformat(), shipment_service=shipment_service)
+        queries.run(db, 'mark_order_shipped', order_id=order_id)
         db.commit()
 
         logging.info(f"Shipment initiated for order {order_id} with tracking number {tracking_no}.")
         return jsonify({'status': 'success', 'tracking_no': tracking_no}), 201
-    except sqlite3.Error as e:
+    except backends.DB_ERRORS as e:
         logging.error(f"SQL error: {e}")
         return jsonify({'status': 'error', 'message': 'Database error occurred.'}), 500
     except Exception as e:
@@ -68,6 +79,7 @@ def initiate_shipment():
 
 @app.route('/track_shipment/<tracking_no>', methods=['GET'])
 def track_shipment(tracking_no):
+    time.sleep(MOCK_LATENCY)
     db = get_db()
     try:
         shipment = db.execute('SELECT * FROM shipment WHERE tracking_no = ?', (tracking_no,)).fetchone()
@@ -85,7 +97,7 @@ def track_shipment(tracking_no):
 
         logging.info(f"Shipment tracked with tracking number {tracking_no}.")
         return jsonify({'status': 'success', 'shipment_data': shipment_data}), 200
-    except sqlite3.Error as e:
+    except backends.DB_ERRORS as e:
         logging.error(f"SQL error: {e}")
         return jsonify({'status': 'error', 'message': 'Database error occurred.'}), 500
     except Exception as e:
@@ -97,4 +109,8 @@ def track_shipment(tracking_no):
 
 
 if __name__ == '__main__':
-    app.run(port=5002, debug=True)
+    if os.getenv('MOCK_ASYNC', 'false').lower() in ['true', '1', 't', 'y', 'yes']:
+        from gevent.pywsgi import WSGIServer
+        WSGIServer(('127.0.0.1', 5002), app, log=None).serve_forever()
+    else:
+        app.run(port=5002, debug=True)
@@ -0,0 +1,236 @@
+"""Digest emails to shops about their newly paid orders.
+
+payment() writes one outbox row per shop in the same transaction that marks
+the order paid, so a notification exists exactly when the payment does and
+the buyer's request never waits on mail. A dispatcher thread in each worker
+claims due rows, sends each shop one digest of everything pending for it,
+and retries failed deliveries with exponential backoff.
+
+Transports are picked with NOTIFY_TRANSPORT: 'log' writes digests to the
+log, 'smtp' sends them to SMTP_HOST:SMTP_PORT. Any local SMTP stand-in
+works for development, e.g. ``python -m aiosmtpd -n -l localhost:8025``.
+
+Run one dispatch pass by hand with ``python notifications.py``.
+"""
+import argparse
+import json
+import logging
+import random
+import smtplib
+import sqlite3
+import threading
+import time
+from email.message import EmailMessage
+
+import backends
+import queries
+from config import Config
+
+logger = logging.getLogger(__name__)
+
+SCHEMA = '''
+CREATE TABLE IF NOT EXISTS outbox (
+    event_id        INTEGER PRIMARY KEY,
+    shop_id         INTEGER NOT NULL REFERENCES shop,
+    order_id        INTEGER NOT NULL REFERENCES orders,
+    kind            TEXT NOT NULL,
+    payload         TEXT NOT NULL,
+    created_at      TEXT NOT NULL DEFAULT CURRENT_TIMESTAMP,
+    status          TEXT NOT NULL DEFAULT 'pending',
+    attempts        INTEGER NOT NULL DEFAULT 0,
+    next_attempt_at REAL NOT NULL DEFAULT 0,
+    sent_at         TEXT,
+    last_error      TEXT
+);
+CREATE INDEX IF NOT EXISTS idx_outbox_due ON outbox (status, next_attempt_at);
+'''
+
+PG_SCHEMA = f'''
+CREATE TABLE IF NOT EXISTS outbox (
+    event_id        BIGINT GENERATED BY DEFAULT AS IDENTITY PRIMARY KEY,
+    shop_id         INTEGER NOT NULL,
+    order_id        INTEGER NOT NULL,
+    kind            TEXT NOT NULL,
+    payload         TEXT NOT NULL,
+    created_at      TEXT NOT NULL DEFAULT {queries.NOW['postgresql']},
+    status          TEXT NOT NULL DEFAULT 'pending',
+    attempts        INTEGER NOT NULL DEFAULT 0,
+    next_attempt_at DOUBLE PRECISION NOT NULL DEFAULT 0,
+    sent_at         TEXT,
+    last_error      TEXT
+);
+CREATE INDEX IF NOT EXISTS idx_outbox_due ON outbox (status, next_attempt_at);
+'''
+
+
+def enqueue_order_paid(db, order_id):
+    """Queue a notification for every shop in the order; the caller commits."""
+    # A book deleted since it was ordered is still sold; the shop hears about it under its old id
+    items = db.execute('''
+        SELECT oi.shop_id, oi.book_id, oi.quantity, oi.total_price, b.book_name
+        FROM orderitems oi
+        LEFT JOIN books b ON b.book_id = oi.book_id
+        WHERE oi.order_id = ?
+        ORDER BY oi.shop_id, oi.order_item_id
+    ''', (order_id,)).fetchall()
+
+    by_shop = {}
+    for item in items:
+        by_shop.setdefault(item['shop_id'], []).append(
+            {'book_name': item['book_name'] or f"Book #{item['book_id']} (no longer listed)",
+             'quantity': item['quantity'], 'total_price': item['total_price']})
+    db.executemany('INSERT INTO outbox (shop_id, order_id, kind, payload) VALUES (?, ?, ?, ?)',
+                   [(shop_id, order_id, 'order_paid', json.dumps({'items': shop_items}))
+                    for shop_id, shop_items in by_shop.items()])
+
+
+class LogTransport:
+    def send(self, message):
+        logger.info('Notification to %s: %s\n%s', message['To'], message['Subject'], message.get_content())
+
+
+class SMTPTransport:
+    def __init__(self, host, port, timeout=10):
+        self.host = host
+        self.port = port
+        self.timeout = timeout
+
+    def send(self, message):
+        with smtplib.SMTP(self.host, self.port, timeout=self.timeout) as smtp:
+            smtp.send_message(message)
+
+
+def make_transport(config):
+    if config['NOTIFY_TRANSPORT'] == 'smtp':
+        return SMTPTransport(config['SMTP_HOST'], config['SMTP_PORT'])
+    return LogTransport()
+
+
+def _claim(db, batch_size, lease):
+    # One UPDATE ... RETURNING, so dispatchers in other workers never claim the same rows
+    now = time.time()
+    with db:
+        return db.execute('''
+            UPDATE outbox SET next_attempt_at = ?
+            WHERE event_id IN (
+                SELECT event_id FROM outbox
+                WHERE status = 'pending' AND next_attempt_at <= ?
+                ORDER BY event_id
+                LIMIT ?
+            )
+            RETURNING event_id, shop_id, order_id, kind, payload, created_at, attempts
+        ''', (now + lease, now, batch_size)).fetchall()
+
+
+def build_digest(shop, events, sender):
+    from views import format_currency
+
+    message = EmailMessage()
+    message['From'] = sender
+    message['To'] = shop['shop_email']
+    message['Subject'] = f'{len(events)} new paid order(s) on PentaBook'
+
+    lines = [f"Hello {shop['owner_name']},", '', f"New paid orders for {shop['shop_name']}:", '']
+    for event in sorted(events, key=lambda e: e['event_id']):
+        lines.append(f"Order #{event['order_id']} ({event['created_at']})")
+        for item in json.loads(event['payload'])['items']:
+            lines.append(f"  {item['quantity']} x {item['book_name']}  {format_currency(item['total_price'])}")
+    lines += ['', 'Please prepare the shipments from your shop dashboard.']
+    message.set_content('\n'.join(lines))
+    return message
+
+
+def _backoff(attempts, base, maximum):
+    return min(maximum, base * 2 ** (attempts - 1)) * random.uniform(0.8, 1.2)
+
+
+def dispatch_once(db, transport, config):
+    """Send one digest per shop for the due outbox rows; returns (sent, failed) row counts."""
+    events = _claim(db, config['NOTIFY_BATCH_SIZE'], config['NOTIFY_LEASE'])
+    by_shop = {}
+    for event in events:
+        by_shop.setdefault(event['shop_id'], []).append(event)
+
+    sent = failed = 0
+    for shop_id, shop_events in by_shop.items():
+        ids = [event['event_id'] for event in shop_events]
+        placeholders = ', '.join('?' * len(ids))
+        shop = db.execute('SELECT shop_name, owner_name, shop_email FROM shop WHERE shop_id = ?',
+                          (shop_id,)).fetchone()
+        try:
+            if shop is None:
+                raise LookupError(f'shop {shop_id} no longer exists')
+            transport.send(build_digest(shop, shop_events, config['NOTIFY_SENDER']))
+        except Exception as e:
+            failed += len(ids)
+            attempts = max(event['attempts'] for event in shop_events) + 1
+            giving_up = attempts >= config['NOTIFY_MAX_ATTEMPTS']
+            logger.warning('Notification to shop %s failed (attempt %s): %s', shop_id, attempts, e)
+            with db:
+                db.execute(f'''
+                    UPDATE outbox SET attempts = ?, status = ?, next_attempt_at = ?, last_error = ?
+                    WHERE event_id IN ({placeholders})
+                ''', (attempts, 'failed' if giving_up else 'pending',
+                      time.time() + _backoff(attempts, config['NOTIFY_BACKOFF_BASE'], config['NOTIFY_BACKOFF_MAX']),
+                      str(e), *ids))
+        else:
+            sent += len(ids)
+            with db:
+                db.execute(f'''
+                    UPDATE outbox SET status = 'sent', sent_at = {queries.NOW[backends.dialect(db)]}, last_error = NULL
+                    WHERE event_id IN ({placeholders})
+                ''', ids)
+    return sent, failed
+
+
+def connect(path):
+    db = sqlite3.connect(path, timeout=30)
+    db.row_factory = sqlite3.Row
+    return db
+
+
+def start_dispatcher_thread(app):
+    """Run dispatch_once every NOTIFY_INTERVAL seconds in a daemon thread."""
+    interval = app.config['NOTIFY_INTERVAL']
+    if interval <= 0:
+        return None
+    transport = make_transport(app.config)
+    backend = app.extensions['database']
+
+    def run():
+        # The outbox is in whichever database payment() writes to
+        db = connect(app.config['DATABASE']) if backend.dialect == 'sqlite' else None
+        while True:
+            # A pooled PostgreSQL connection is borrowed for one pass, not held between passes
+            conn = db or backend.connect()
+            try:
+                dispatch_once(conn, transport, app.config)
+            except backends.DB_ERRORS as e:
+                logger.error('Notification dispatch failed: %s', e)
+            finally:
+                if conn is not db:
+                    conn.close()
+            time.sleep(interval)
+
+    thread = threading.Thread(target=run, name='notification-dispatcher', daemon=True)
+    thread.start()
+    return thread
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Send pending shop notification digests.')
+    parser.add_argument('--database', default=Config.DATABASE)
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO)
+    config = {name: getattr(Config, name) for name in dir(Config) if name.isupper()}
+    db = connect(args.database)
+    try:
+        sent, failed = dispatch_once(db, make_transport(config), config)
+    finally:
+        db.close()
+    print(f'Sent {sent} notifications, {failed} failed.')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,52 @@
+ORDERS_PER_PAGE = 20
+
+# Pages walk this index newest first; order_id breaks ties between orders placed in the same second
+SCHEMA = '''
+CREATE INDEX IF NOT EXISTS idx_orders_buyer_date ON orders (buyer_id, order_date DESC, order_id DESC);
+'''
+
+PG_SCHEMA = SCHEMA
+
+
+def list_orders(db, buyer_id, before=None, limit=ORDERS_PER_PAGE):
+    # Keyset pagination over (order_date, order_id), newest first; `before` is the
+    # (order_date, order_id) of the last order on the previous page.
+    # Returns the page and the cursor for the next one (None on the last page).
+    query = '''
+        SELECT o.order_id, o.order_date, o.total, o.status,
+               (SELECT COUNT(*) FROM orderitems oi WHERE oi.order_id = o.order_id) AS item_count,
+               (SELECT s.status FROM shipment s WHERE s.order_id = o.order_id
+                ORDER BY s.shipment_id DESC LIMIT 1) AS shipment_status
+        FROM orders o
+        WHERE o.buyer_id = :buyer_id {after_cursor}
+        ORDER BY o.order_date DESC, o.order_id DESC
+        LIMIT :limit
+    '''
+    params = {'buyer_id': buyer_id, 'limit': limit + 1}
+    if before is None:
+        rows = db.execute(query.format(after_cursor=''), params).fetchall()
+    else:
+        params['before_date'], params['before_id'] = before
+        rows = db.execute(query.format(after_cursor='AND (o.order_date, o.order_id) < (:before_date, :before_id)'),
+                          params).fetchall()
+
+    next_cursor = (rows[limit - 1]['order_date'], rows[limit - 1]['order_id']) if len(rows) > limit else None
+    return rows[:limit], next_cursor
+
+
+def get_order(db, buyer_id, order_id):
+    """The buyer's order with its line items and shipments, or None if it is not theirs."""
+    order = db.execute('SELECT * FROM orders WHERE order_id = ? AND buyer_id = ?', (order_id, buyer_id)).fetchone()
+    if not order:
+        return None, [], []
+    items = db.execute('''
+        SELECT oi.order_item_id, oi.book_id, oi.quantity, oi.price, oi.total_price, b.book_name, sh.shop_name
+        FROM orderitems oi
+        LEFT JOIN books b ON b.book_id = oi.book_id
+        LEFT JOIN shop sh ON sh.shop_id = oi.shop_id
+        WHERE oi.order_id = ?
+        ORDER BY oi.order_item_id
+    ''', (order_id,)).fetchall()
+    shipments = db.execute('SELECT * FROM shipment WHERE order_id = ? ORDER BY shipment_id',
+                           (order_id,)).fetchall()
+    return order, items, shipments
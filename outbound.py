@@ -0,0 +1,44 @@
+"""HTTP calls from request handlers to the payment and shipment services.
+
+All calls share one pooled session per process, so they reuse keep-alive
+connections, and every call has a timeout. Under the gevent worker (see
+wsgi.py) the sockets are cooperative: a request waiting on a gateway
+parks a greenlet instead of holding a thread, so one worker can keep
+hundreds of payments in flight.
+"""
+import os
+import threading
+
+from flask import current_app
+
+_session = None
+_session_pid = None
+_lock = threading.Lock()
+
+
+def get_session():
+    global _session, _session_pid
+    # Pooled connections must not be shared with a forked worker
+    if _session_pid != os.getpid():
+        with _lock:
+            if _session_pid != os.getpid():
+                import requests
+                from requests.adapters import HTTPAdapter
+
+                pool_size = current_app.config['OUTBOUND_POOL_SIZE']
+                session = requests.Session()
+                adapter = HTTPAdapter(pool_connections=4, pool_maxsize=pool_size)
+                session.mount('http://', adapter)
+                session.mount('https://', adapter)
+                _session, _session_pid = session, os.getpid()
+    return _session
+
+
+def get(url, **kwargs):
+    kwargs.setdefault('timeout', current_app.config['OUTBOUND_TIMEOUT'])
+    return get_session().get(url, **kwargs)
+
+
+def post(url, **kwargs):
+    kwargs.setdefault('timeout', current_app.config['OUTBOUND_TIMEOUT'])
+    return get_session().post(url, **kwargs)
@@ -0,0 +1,240 @@
+"""On-demand sampling profiles of single requests.
+
+With PROFILING_ENABLED, a request is profiled when an admin adds
+?_profile=1 (or sends the X-Profile header), when its X-Profile-Token
+header matches PROFILE_TOKEN, or at random for a PROFILE_SAMPLE_RATE share
+of requests. Without PROFILING_ENABLED no hook is registered at all.
+
+A sampler thread records the profiled request's Python stack every
+PROFILE_INTERVAL seconds. While a SQL statement runs, the sample gets a
+`sql:<statement>` frame on top, so database time shows up in the
+flamegraph under the code that issued it. Each capture is written to
+PROFILE_DIR as collapsed stacks (<name>.folded, readable by flamegraph.pl
+or speedscope) next to a <name>.json summary with per-statement SQL time.
+/admin/profiles lists the newest captures.
+"""
+import collections
+import datetime
+import glob
+import hmac
+import json
+import os
+import random
+import re
+import sys
+import threading
+import time
+import uuid
+
+from flask import current_app, g, request, session
+
+PROFILE_FLAG = '_profile'
+
+
+def _real_threading():
+    # Under the gevent worker the sampler still needs a real thread and the real thread id
+    try:
+        from gevent import monkey
+        if monkey.is_module_patched('threading'):
+            return (monkey.get_original('threading', 'Thread'), monkey.get_original('_thread', 'get_ident'),
+                    monkey.get_original('time', 'sleep'))
+    except ImportError:
+        pass
+    return threading.Thread, threading.get_ident, time.sleep
+
+
+def _frame_name(frame):
+    return f"{frame.f_globals.get('__name__', '?')}.{frame.f_code.co_qualname}"
+
+
+def _sql_label(sql):
+    return 'sql:' + re.sub(r'\s+', ' ', sql).strip()[:100].replace(';', ',')
+
+
+class Sampler:
+    def __init__(self, interval):
+        Thread, get_ident, self._sleep = _real_threading()
+        self.interval = interval
+        self.thread_id = get_ident()
+        self.stacks = collections.Counter()
+        self.samples = 0
+        self.current_sql = None
+        self._running = True
+        self._thread = Thread(target=self._run, name='request-profiler', daemon=True)
+        self._thread.start()
+
+    def _run(self):
+        while self._running:
+            frame = sys._current_frames().get(self.thread_id)
+            if frame is not None:
+                stack = []
+                while frame is not None:
+                    stack.append(_frame_name(frame))
+                    frame = frame.f_back
+                stack.reverse()
+                if self.current_sql:
+                    stack.append(self.current_sql)
+                self.stacks[';'.join(stack)] += 1
+                self.samples += 1
+            self._sleep(self.interval)
+
+    def stop(self):
+        self._running = False
+        self._thread.join()
+
+
+class _TimedCursor:
+    def __init__(self, cursor, profile):
+        self._cursor = cursor
+        self._profile = profile
+
+    def execute(self, sql, params=()):
+        self._profile.timed(self._cursor.execute, sql, params)
+        return self
+
+    def executemany(self, sql, seq_of_params):
+        self._profile.timed(self._cursor.executemany, sql, seq_of_params)
+        return self
+
+    def __iter__(self):
+        return iter(self._cursor)
+
+    def __getattr__(self, name):
+        return getattr(self._cursor, name)
+
+
+class TimedConnection:
+    """Wraps the request's connection so every statement is timed and shows up in samples."""
+
+    def __init__(self, db, profile):
+        self._db = db
+        self._profile = profile
+
+    def execute(self, sql, params=()):
+        return _TimedCursor(self._profile.timed(self._db.execute, sql, params), self._profile)
+
+    def executemany(self, sql, seq_of_params):
+        return _TimedCursor(self._profile.timed(self._db.executemany, sql, seq_of_params), self._profile)
+
+    def cursor(self):
+        return _TimedCursor(self._db.cursor(), self._profile)
+
+    def __enter__(self):
+        self._db.__enter__()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        return self._db.__exit__(exc_type, exc, tb)
+
+    def __getattr__(self, name):
+        return getattr(self._db, name)
+
+
+class Profile:
+    def __init__(self, trigger, interval):
+        self.trigger = trigger
+        self.started = time.perf_counter()
+        self.sql = {}
+        self.sampler = Sampler(interval)
+
+    def timed(self, method, sql, params):
+        label = _sql_label(sql)
+        self.sampler.current_sql = label
+        start = time.perf_counter()
+        try:
+            return method(sql, params)
+        finally:
+            elapsed = time.perf_counter() - start
+            self.sampler.current_sql = None
+            stats = self.sql.setdefault(label, [0, 0.0])
+            stats[0] += 1
+            stats[1] += elapsed
+
+    def finish(self, directory, keep, status):
+        self.sampler.stop()
+        duration = time.perf_counter() - self.started
+        name = f"{datetime.datetime.now():%Y%m%d-%H%M%S}-{request.endpoint or 'unknown'}-{uuid.uuid4().hex[:6]}"
+        os.makedirs(directory, exist_ok=True)
+        with open(os.path.join(directory, f'{name}.folded'), 'w') as f:
+            for stack, count in self.sampler.stacks.most_common():
+                f.write(f'{stack} {count}\n')
+        statements = sorted(self.sql.items(), key=lambda item: item[1][1], reverse=True)
+        summary = {
+            'name': name,
+            'captured_at': datetime.datetime.now().isoformat(timespec='seconds'),
+            'method': request.method,
+            'path': request.full_path.rstrip('?'),
+            'endpoint': request.endpoint,
+            'status': status,
+            'trigger': self.trigger,
+            'duration_ms': round(duration * 1000, 2),
+            'samples': self.sampler.samples,
+            'sql_count': sum(count for count, _ in self.sql.values()),
+            'sql_ms': round(sum(seconds for _, seconds in self.sql.values()) * 1000, 2),
+            'statements': [{'sql': label[4:], 'count': count, 'ms': round(seconds * 1000, 2)}
+                           for label, (count, seconds) in statements[:20]],
+        }
+        with open(os.path.join(directory, f'{name}.json'), 'w') as f:
+            json.dump(summary, f, indent=1)
+        _prune(directory, keep)
+        return summary
+
+
+def _prune(directory, keep):
+    summaries = sorted(glob.glob(os.path.join(directory, '*.json')))
+    for path in summaries[:-keep] if keep > 0 else []:
+        base = path[:-len('.json')]
+        for old in (f'{base}.json', f'{base}.folded'):
+            if os.path.exists(old):
+                os.remove(old)
+
+
+def _trigger():
+    token = current_app.config['PROFILE_TOKEN']
+    # Constant-time, so response timing does not leak how much of the token matched
+    if token and hmac.compare_digest(request.headers.get('X-Profile-Token', '').encode(), token.encode()):
+        return 'token'
+    if 'admin_id' in session and (request.args.get(PROFILE_FLAG) or request.headers.get('X-Profile')):
+        return 'admin'
+    rate = current_app.config['PROFILE_SAMPLE_RATE']
+    if rate > 0 and random.random() < rate:
+        return 'sampled'
+    return None
+
+
+def _start():
+    trigger = _trigger()
+    if trigger is None or request.endpoint == 'static':
+        return
+    profile = g.profile = Profile(trigger, current_app.config['PROFILE_INTERVAL'])
+    from database import get_backend
+    g.db = TimedConnection(get_backend().connect(), profile)
+
+
+def _record_status(response):
+    if 'profile' in g:
+        g.profile_status = response.status_code
+    return response
+
+
+def _finish(exception):
+    profile = g.pop('profile', None)
+    if profile is not None:
+        status = g.pop('profile_status', 500 if exception else None)
+        profile.finish(current_app.config['PROFILE_DIR'], current_app.config['PROFILE_KEEP'], status)
+
+
+def init_app(app):
+    if not app.config['PROFILING_ENABLED']:
+        return
+    app.before_request(_start)
+    app.after_request(_record_status)
+    app.teardown_request(_finish)
+
+
+def recent_profiles(directory, limit=50):
+    summaries = []
+    for path in sorted(glob.glob(os.path.join(directory, '*.json')), reverse=True)[:limit]:
+        with open(path) as f:
+            summaries.append(json.load(f))
+    return summaries
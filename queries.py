@@ -0,0 +1,49 @@
+"""Named statements whose SQL differs between SQLite and PostgreSQL.
+
+Inserts return their new key with RETURNING (SQLite 3.35+ and PostgreSQL)
+instead of cursor.lastrowid, which psycopg does not provide. {now} is the
+current UTC time as text, in the format CURRENT_TIMESTAMP has in SQLite,
+so timestamps sort and compare the same on both backends.
+"""
+import functools
+
+import backends
+
+NOW = {
+    'sqlite': 'CURRENT_TIMESTAMP',
+    'postgresql': "to_char(CURRENT_TIMESTAMP AT TIME ZONE 'UTC', 'YYYY-MM-DD HH24:MI:SS')",
+}
+
+QUERIES = {
+    'create_cart': '''
+        INSERT INTO cart (buyer_id, status, updated_at) VALUES (:buyer_id, 'open', {now})
+        RETURNING cart_id
+    ''',
+    'touch_cart': 'UPDATE cart SET updated_at = {now} WHERE cart_id = :cart_id',
+    'create_order': '''
+        INSERT INTO orders (cart_id, buyer_id, subtotal, total, status, delivery_address, order_date)
+        VALUES (:cart_id, :buyer_id, :subtotal, :total, 'initiated', :delivery_address, {now})
+        RETURNING order_id
+    ''',
+    'record_payment': '''
+        INSERT INTO payments (method_id, order_id, transaction_id, payment_date, payment_status, payment_total)
+        VALUES (:method_id, :order_id, :transaction_id, {now}, :payment_status, :payment_total)
+        RETURNING payment_id
+    ''',
+    'create_shipment': '''
+        INSERT INTO shipment (order_id, tracking_no, shipment_date, status, shipment_service)
+        VALUES (:order_id, :tracking_no, :shipment_date, 'Shipped', :shipment_service)
+        RETURNING shipment_id
+    ''',
+    'mark_order_shipped': "UPDATE orders SET status = 'Shipped' WHERE order_id = :order_id",
+}
+
+
+@functools.lru_cache(maxsize=None)
+def get_sql(name, dialect):
+    return QUERIES[name].format(now=NOW[dialect])
+
+
+def run(db, name, **params):
+    """Execute the named statement on db with named parameters; returns the cursor."""
+    return db.execute(get_sql(name, backends.dialect(db)), params)
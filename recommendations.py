@@ -0,0 +1,272 @@
+"""Offline "customers who bought this also bought" job.
+
+Run nightly with ``python recommendations.py``. Each run streams the orders
+paid since the last high-water mark in batches, adds their book pairs to the
+co-purchase counts and rescores the top-K neighbours of every book whose
+order count changed, and of every book that has one of those among its
+neighbours.
+Use ``--full`` to rebuild everything from scratch.
+
+The mark is a payments.payment_id rather than an order_id: orders are paid
+out of order, and an order paid after a run has passed its id must still be
+counted.
+"""
+import argparse
+import heapq
+import itertools
+import math
+import sqlite3
+from collections import Counter
+
+from config import Config
+
+try:
+    import numpy as np
+    from scipy import sparse
+except ImportError:  # the pure Python counter below is used instead
+    np = None
+    sparse = None
+
+TOP_K = 10
+BATCH_ORDERS = 5000
+
+# Orders still waiting for payment are not purchases yet
+COUNTED_ORDER_STATUSES = ('paid', 'Shipped')
+
+SCHEMA = '''
+CREATE TABLE IF NOT EXISTS book_purchase_counts (
+    book_id     INTEGER PRIMARY KEY,
+    order_count INTEGER NOT NULL DEFAULT 0
+);
+CREATE TABLE IF NOT EXISTS book_copurchase (
+    book_id       INTEGER NOT NULL,
+    other_book_id INTEGER NOT NULL,
+    pair_count    INTEGER NOT NULL DEFAULT 0,
+    PRIMARY KEY (book_id, other_book_id)
+) WITHOUT ROWID;
+CREATE TABLE IF NOT EXISTS book_recommendations (
+    book_id             INTEGER NOT NULL,
+    rank                INTEGER NOT NULL,
+    recommended_book_id INTEGER NOT NULL,
+    score               REAL NOT NULL,
+    PRIMARY KEY (book_id, rank)
+) WITHOUT ROWID;
+CREATE INDEX IF NOT EXISTS idx_orderitems_order ON orderitems (order_id);
+CREATE INDEX IF NOT EXISTS idx_payments_order ON payments (order_id);
+CREATE TABLE IF NOT EXISTS recommendation_state (
+    name  TEXT PRIMARY KEY,
+    value INTEGER NOT NULL
+);
+'''
+
+PG_SCHEMA = '''
+CREATE TABLE IF NOT EXISTS book_purchase_counts (
+    book_id     INTEGER PRIMARY KEY,
+    order_count INTEGER NOT NULL DEFAULT 0
+);
+CREATE TABLE IF NOT EXISTS book_copurchase (
+    book_id       INTEGER NOT NULL,
+    other_book_id INTEGER NOT NULL,
+    pair_count    INTEGER NOT NULL DEFAULT 0,
+    PRIMARY KEY (book_id, other_book_id)
+);
+CREATE TABLE IF NOT EXISTS book_recommendations (
+    book_id             INTEGER NOT NULL,
+    rank                INTEGER NOT NULL,
+    recommended_book_id INTEGER NOT NULL,
+    score               DOUBLE PRECISION NOT NULL,
+    PRIMARY KEY (book_id, rank)
+);
+CREATE INDEX IF NOT EXISTS idx_orderitems_order ON orderitems (order_id);
+CREATE INDEX IF NOT EXISTS idx_payments_order ON payments (order_id);
+CREATE TABLE IF NOT EXISTS recommendation_state (
+    name  TEXT PRIMARY KEY,
+    value INTEGER NOT NULL
+);
+'''
+
+
+def get_recommendations(db, book_id, limit=TOP_K):
+    return db.execute('''
+        SELECT b.book_id, b.book_name, b.author, b.price, b.img_url, r.score
+        FROM book_recommendations r
+        JOIN books b ON b.book_id = r.recommended_book_id
+        WHERE r.book_id = ?
+        ORDER BY r.rank
+        LIMIT ?
+    ''', (book_id, limit)).fetchall()
+
+
+def _get_state(db, name, default=0):
+    row = db.execute('SELECT value FROM recommendation_state WHERE name = ?', (name,)).fetchone()
+    return row[0] if row else default
+
+
+def _set_state(db, name, value):
+    db.execute('INSERT INTO recommendation_state (name, value) VALUES (?, ?) '
+               'ON CONFLICT(name) DO UPDATE SET value = excluded.value', (name, value))
+
+
+def _next_batch(db, after_payment_id, batch_orders):
+    """Returns (last payment_id read, [(order_id, [book_id, ...]), ...]) for the next payments.
+
+    An order is counted at its first payment, and only while it is in a
+    counted status; orders archived since are skipped.
+    """
+    placeholders = ', '.join('?' * len(COUNTED_ORDER_STATUSES))
+    rows = db.execute(f'''
+        SELECT p.payment_id, o.order_id FROM payments p
+        LEFT JOIN orders o ON o.order_id = p.order_id AND o.status IN ({placeholders})
+            AND NOT EXISTS (SELECT 1 FROM payments earlier
+                            WHERE earlier.order_id = p.order_id AND earlier.payment_id < p.payment_id)
+        WHERE p.payment_id > ?
+        ORDER BY p.payment_id
+        LIMIT ?
+    ''', (*COUNTED_ORDER_STATUSES, after_payment_id, batch_orders)).fetchall()
+    if not rows:
+        return after_payment_id, []
+
+    order_ids = [row[1] for row in rows if row[1] is not None]
+    baskets = {order_id: [] for order_id in order_ids}
+    for start in range(0, len(order_ids), 500):
+        chunk = order_ids[start:start + 500]
+        cur = db.execute(f'''
+            SELECT order_id, book_id FROM orderitems
+            WHERE order_id IN ({', '.join('?' * len(chunk))}) AND book_id IS NOT NULL
+            ORDER BY order_id
+        ''', chunk)
+        for order_id, items in itertools.groupby(cur, key=lambda row: row[0]):
+            baskets[order_id] = sorted({row[1] for row in items})
+    return rows[-1][0], list(baskets.items())
+
+
+def _count_batch_sparse(baskets):
+    # Order x book incidence matrix X; X.T @ X gives every pair count at once
+    book_ids = sorted({book_id for basket in baskets for book_id in basket})
+    column = {book_id: i for i, book_id in enumerate(book_ids)}
+    rows = np.repeat(np.arange(len(baskets)), [len(basket) for basket in baskets])
+    cols = np.fromiter((column[book_id] for basket in baskets for book_id in basket), dtype=np.int64,
+                       count=len(rows))
+    incidence = sparse.csr_matrix((np.ones(len(rows), dtype=np.int64), (rows, cols)),
+                                  shape=(len(baskets), len(book_ids)))
+    co = (incidence.T @ incidence).tocoo()
+
+    ids = np.asarray(book_ids)
+    singles = Counter()
+    pairs = Counter()
+    for i, j, count in zip(ids[co.row].tolist(), ids[co.col].tolist(), co.data.tolist()):
+        if i == j:
+            singles[i] = count
+        else:
+            pairs[(i, j)] = count
+    return singles, pairs
+
+
+def _count_batch_python(baskets):
+    singles = Counter()
+    pairs = Counter()
+    for basket in baskets:
+        singles.update(basket)
+        for a, b in itertools.permutations(basket, 2):
+            pairs[(a, b)] += 1
+    return singles, pairs
+
+
+def _count_batch(baskets):
+    if not baskets:
+        return Counter(), Counter()
+    if sparse is not None:
+        return _count_batch_sparse(baskets)
+    return _count_batch_python(baskets)
+
+
+def _merge_counts(db, singles, pairs):
+    db.executemany('''
+        INSERT INTO book_purchase_counts (book_id, order_count) VALUES (?, ?)
+        ON CONFLICT(book_id) DO UPDATE SET order_count = order_count + excluded.order_count
+    ''', singles.items())
+    db.executemany('''
+        INSERT INTO book_copurchase (book_id, other_book_id, pair_count) VALUES (?, ?, ?)
+        ON CONFLICT(book_id, other_book_id) DO UPDATE SET pair_count = pair_count + excluded.pair_count
+    ''', ((a, b, count) for (a, b), count in pairs.items()))
+
+
+def _neighbours(db, book_ids):
+    # A score divides by both books' order counts, so a book whose count moved changes its neighbours' lists too.
+    # Pairs are stored both ways round, so the books that list book_id are the ones it lists.
+    book_ids = sorted(book_ids)
+    found = set()
+    for start in range(0, len(book_ids), 500):
+        chunk = book_ids[start:start + 500]
+        found.update(row[0] for row in db.execute(
+            f"SELECT DISTINCT other_book_id FROM book_copurchase WHERE book_id IN ({', '.join('?' * len(chunk))})",
+            chunk))
+    return found
+
+
+def _rescore(db, book_ids, top_k):
+    # Cosine similarity between the two books' sets of orders
+    order_counts = dict(db.execute('SELECT book_id, order_count FROM book_purchase_counts'))
+    for book_id in sorted(book_ids):
+        neighbours = db.execute('SELECT other_book_id, pair_count FROM book_copurchase WHERE book_id = ?',
+                                (book_id,)).fetchall()
+        scored = (
+            (pair_count / math.sqrt(order_counts[book_id] * order_counts[other_id]), other_id)
+            for other_id, pair_count in neighbours
+            if order_counts.get(book_id) and order_counts.get(other_id)
+        )
+        best = heapq.nlargest(top_k, scored, key=lambda item: (item[0], -item[1]))
+        db.execute('DELETE FROM book_recommendations WHERE book_id = ?', (book_id,))
+        db.executemany(
+            'INSERT INTO book_recommendations (book_id, rank, recommended_book_id, score) VALUES (?, ?, ?, ?)',
+            ((book_id, rank, other_id, score) for rank, (score, other_id) in enumerate(best, start=1)))
+
+
+def build_recommendations(db, top_k=TOP_K, full=False, batch_orders=BATCH_ORDERS):
+    """Process new orders since the high-water mark; returns the number of orders counted."""
+    db.executescript(SCHEMA)
+    if full:
+        with db:
+            db.execute('DELETE FROM book_purchase_counts')
+            db.execute('DELETE FROM book_copurchase')
+            db.execute('DELETE FROM book_recommendations')
+            db.execute('DELETE FROM recommendation_state')
+
+    high_water_mark = _get_state(db, 'last_payment_id')
+    touched = set()
+    processed = 0
+    while True:
+        last_payment_id, batch = _next_batch(db, high_water_mark, batch_orders)
+        if last_payment_id == high_water_mark:
+            break
+        singles, pairs = _count_batch([basket for _, basket in batch if basket])
+        high_water_mark = last_payment_id
+        # Counts and the high-water mark move together so a crash never double counts
+        with db:
+            _merge_counts(db, singles, pairs)
+            _set_state(db, 'last_payment_id', high_water_mark)
+        touched.update(singles)
+        processed += len(batch)
+
+    with db:
+        _rescore(db, touched | _neighbours(db, touched), top_k)
+    return processed
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Rebuild co-purchase book recommendations.')
+    parser.add_argument('--database', default=Config.DATABASE)
+    parser.add_argument('--top-k', type=int, default=TOP_K)
+    parser.add_argument('--full', action='store_true', help='discard existing counts and rebuild from all payments')
+    args = parser.parse_args()
+
+    db = sqlite3.connect(args.database)
+    try:
+        processed = build_recommendations(db, top_k=args.top_k, full=args.full)
+    finally:
+        db.close()
+    print(f'Processed {processed} new orders.')
+
+
+if __name__ == '__main__':
+    main()
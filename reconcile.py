@@ -0,0 +1,326 @@
+"""Checks recorded payments against the transactions the gateway approved.
+
+Local payments, gateway transactions (read in pages from the gateway's
+/transactions endpoint) and orders are each streamed in order_id,
+transaction_id order and merge-joined, so memory stays bounded by one page
+per side however many rows there are. Differences are written to
+payment_discrepancies.
+
+Orders are reconciled once they are older than RECONCILE_SETTLE_MINUTES, so
+payments still in flight are not reported. Two checkpoints are kept with
+the discrepancies they produced: the last order checked, and the last
+settled payment seen. An order that gets a payment after it was checked,
+such as one paid a day after it was placed, is checked again and its
+earlier discrepancies replaced. ``--full`` clears everything and starts
+over.
+
+Run with ``python reconcile.py``.
+"""
+import argparse
+import concurrent.futures
+import logging
+import os
+import sqlite3
+
+import requests
+
+from config import Config
+
+logger = logging.getLogger(__name__)
+
+SCHEMA = '''
+CREATE INDEX IF NOT EXISTS idx_payments_order_transaction ON payments (order_id, transaction_id);
+CREATE TABLE IF NOT EXISTS payment_discrepancies (
+    discrepancy_id INTEGER PRIMARY KEY,
+    kind           TEXT NOT NULL,
+    order_id       INTEGER NOT NULL,
+    transaction_id TEXT,
+    local_amount   REAL,
+    gateway_amount REAL,
+    local_status   TEXT,
+    gateway_status TEXT,
+    found_at       TEXT NOT NULL DEFAULT CURRENT_TIMESTAMP
+);
+CREATE INDEX IF NOT EXISTS idx_payment_discrepancies_order ON payment_discrepancies (order_id);
+CREATE TABLE IF NOT EXISTS reconcile_state (
+    name  TEXT PRIMARY KEY,
+    value INTEGER NOT NULL
+);
+'''
+
+PAID_ORDER_STATUSES = ('paid', 'Shipped')
+APPROVED_PAYMENT_STATUSES = ('approved', 'Completed')
+AMOUNT_TOLERANCE = 0.005
+GATEWAY_URL = 'http://localhost:5001'
+# Late-paid orders are rechecked this many at a time: one IN list per table and one order_ids filter per
+# /transactions read, which keeps the query string and the bound parameters small
+RECHECK_CHUNK = 500
+
+
+def _get_state(db, name, default=0):
+    row = db.execute('SELECT value FROM reconcile_state WHERE name = ?', (name,)).fetchone()
+    return row[0] if row else default
+
+
+def _set_state(db, name, value):
+    db.execute('INSERT INTO reconcile_state (name, value) VALUES (?, ?) '
+               'ON CONFLICT(name) DO UPDATE SET value = excluded.value', (name, value))
+
+
+def _local_payments(db, after_order_id, max_order_id, batch_size):
+    # Payments without a transaction id cannot be matched and are left out
+    rows = db.execute('''
+        SELECT order_id, transaction_id, payment_total, payment_status FROM payments
+        WHERE order_id > ? AND order_id <= ? AND transaction_id IS NOT NULL
+        ORDER BY order_id, transaction_id LIMIT ?
+    ''', (after_order_id, max_order_id, batch_size)).fetchall()
+    while rows:
+        yield from rows
+        if len(rows) < batch_size:
+            return
+        last = rows[-1]
+        rows = db.execute('''
+            SELECT order_id, transaction_id, payment_total, payment_status FROM payments
+            WHERE (order_id, transaction_id) > (?, ?) AND order_id <= ? AND transaction_id IS NOT NULL
+            ORDER BY order_id, transaction_id LIMIT ?
+        ''', (last['order_id'], last['transaction_id'], max_order_id, batch_size)).fetchall()
+
+
+def _gateway_transactions(session, gateway_url, after_order_id, max_order_id, batch_size, order_ids=None):
+    # The next page is fetched while the current one is merged
+    filters = {'max_order_id': max_order_id, 'limit': batch_size}
+    if order_ids is not None:
+        filters['order_ids'] = ','.join(map(str, order_ids))
+
+    def fetch(params):
+        response = session.get(f'{gateway_url}/transactions', timeout=60, params=dict(params, **filters))
+        response.raise_for_status()
+        return response.json()
+
+    with concurrent.futures.ThreadPoolExecutor(max_workers=1) as executor:
+        page = executor.submit(fetch, {'after_order_id': after_order_id})
+        while page is not None:
+            body = page.result()
+            cursor = body['next']
+            page = executor.submit(fetch, {'after_order_id': cursor['order_id'],
+                                           'after_transaction_id': cursor['transaction_id']}) if cursor else None
+            yield from body['data']
+
+
+def _orders(db, after_order_id, max_order_id, batch_size):
+    while True:
+        rows = db.execute('SELECT order_id, status FROM orders WHERE order_id > ? AND order_id <= ? '
+                          'ORDER BY order_id LIMIT ?', (after_order_id, max_order_id, batch_size)).fetchall()
+        yield from rows
+        if len(rows) < batch_size:
+            return
+        after_order_id = rows[-1]['order_id']
+
+
+def _merge_transactions(local, gateway):
+    # Yields (local payment or None, gateway transaction or None) in (order_id, transaction_id) order
+    local_row, gateway_row = next(local, None), next(gateway, None)
+    while local_row is not None or gateway_row is not None:
+        local_key = (local_row['order_id'], local_row['transaction_id']) if local_row is not None else None
+        gateway_key = (gateway_row['order_id'], gateway_row['transaction_id']) if gateway_row is not None else None
+        if gateway_key is None or (local_key is not None and local_key < gateway_key):
+            yield local_row, None
+            local_row = next(local, None)
+        elif local_key is None or gateway_key < local_key:
+            yield None, gateway_row
+            gateway_row = next(gateway, None)
+        else:
+            yield local_row, gateway_row
+            local_row, gateway_row = next(local, None), next(gateway, None)
+
+
+def _by_order(orders, pairs):
+    # Yields (order_id, order or None, [(local, gateway), ...]) for every order_id on any side
+    order, pair = next(orders, None), next(pairs, None)
+    while order is not None or pair is not None:
+        pair_order_id = (pair[0] or pair[1])['order_id'] if pair is not None else None
+        if pair_order_id is None or (order is not None and order['order_id'] < pair_order_id):
+            yield order['order_id'], order, []
+            order = next(orders, None)
+            continue
+        current = order if order is not None and order['order_id'] == pair_order_id else None
+        group = []
+        while pair is not None and (pair[0] or pair[1])['order_id'] == pair_order_id:
+            group.append(pair)
+            pair = next(pairs, None)
+        yield pair_order_id, current, group
+        if current is not None:
+            order = next(orders, None)
+
+
+def _discrepancy(kind, order_id, local=None, gateway=None):
+    return (kind, order_id,
+            (local or gateway)['transaction_id'] if local or gateway else None,
+            local['payment_total'] if local else None, gateway['amount'] if gateway else None,
+            local['payment_status'] if local else None, gateway['status'] if gateway else None)
+
+
+def check_order(order_id, order, pairs, archived=False):
+    """Discrepancy rows for one order and its matched (local, gateway) transactions."""
+    if order is None and archived:
+        # Archived orders took their payments to the history database
+        return []
+    found = []
+    for local, gateway in pairs:
+        if gateway is None:
+            found.append(_discrepancy('missing_at_gateway', order_id, local=local))
+        elif local is None:
+            found.append(_discrepancy('missing_locally', order_id, gateway=gateway))
+        else:
+            if local['payment_total'] is None or abs(local['payment_total'] - gateway['amount']) > AMOUNT_TOLERANCE:
+                found.append(_discrepancy('amount_mismatch', order_id, local, gateway))
+            if (local['payment_status'] in APPROVED_PAYMENT_STATUSES) != (gateway['status'] == 'approved'):
+                found.append(_discrepancy('status_mismatch', order_id, local, gateway))
+
+    approved = sum(1 for local, _ in pairs if local is not None and local['payment_status'] in APPROVED_PAYMENT_STATUSES)
+    if order is None:
+        found.append(_discrepancy('unknown_order', order_id))
+    elif order['status'] in PAID_ORDER_STATUSES and approved == 0:
+        found.append(_discrepancy('paid_without_payment', order_id))
+    elif order['status'] not in PAID_ORDER_STATUSES and approved:
+        found.append(_discrepancy('payment_on_unpaid_order', order_id))
+    if approved > 1:
+        found.append(_discrepancy('duplicate_payment', order_id))
+    return found
+
+
+def _is_archived(db, order_id):
+    attached = [row[1] for row in db.execute('PRAGMA database_list')]
+    return 'history' in attached and db.execute('SELECT 1 FROM history.orders WHERE order_id = ?',
+                                                (order_id,)).fetchone() is not None
+
+
+def _check_orders(db, session, gateway_url, after_order_id, max_order_id, batch_size):
+    """Yields (order_id, discrepancies) for every order_id in (after_order_id, max_order_id] on any side."""
+    pairs = _merge_transactions(
+        _local_payments(db, after_order_id, max_order_id, batch_size),
+        _gateway_transactions(session, gateway_url, after_order_id, max_order_id, batch_size))
+    for order_id, order, group in _by_order(_orders(db, after_order_id, max_order_id, batch_size), pairs):
+        archived = order is None and _is_archived(db, order_id)
+        yield order_id, check_order(order_id, order, group, archived)
+
+
+def _recheck_orders(db, session, gateway_url, order_ids, batch_size):
+    """_check_orders for just the sorted order_ids, with one read of each side for all of them."""
+    placeholders = ', '.join('?' * len(order_ids))
+    local = db.execute(f'''
+        SELECT order_id, transaction_id, payment_total, payment_status FROM payments
+        WHERE order_id IN ({placeholders}) AND transaction_id IS NOT NULL
+        ORDER BY order_id, transaction_id
+    ''', order_ids).fetchall()
+    orders = db.execute(f'SELECT order_id, status FROM orders WHERE order_id IN ({placeholders}) ORDER BY order_id',
+                        order_ids).fetchall()
+    pairs = _merge_transactions(
+        iter(local), _gateway_transactions(session, gateway_url, order_ids[0] - 1, order_ids[-1], batch_size,
+                                           order_ids=order_ids))
+    for order_id, order, group in _by_order(iter(orders), pairs):
+        archived = order is None and _is_archived(db, order_id)
+        yield order_id, check_order(order_id, order, group, archived)
+
+
+def reconcile(db, gateway_url=GATEWAY_URL, batch_size=Config.RECONCILE_BATCH_SIZE,
+              settle_minutes=Config.RECONCILE_SETTLE_MINUTES, full=False):
+    """Reconcile orders settled or paid since the last checkpoints; returns (orders checked, discrepancies)."""
+    if full:
+        with db:
+            db.execute('DELETE FROM payment_discrepancies')
+            db.execute('DELETE FROM reconcile_state')
+
+    after_order_id = _get_state(db, 'last_order_id')
+    after_payment_id = _get_state(db, 'last_payment_id')
+    settled = (f'-{settle_minutes} minutes',)
+    max_order_id = db.execute("SELECT MAX(order_id) FROM orders WHERE order_date <= datetime('now', ?)",
+                              settled).fetchone()[0] or after_order_id
+    max_payment_id = db.execute("SELECT MAX(payment_id) FROM payments WHERE IFNULL(payment_date, '') "
+                                "<= datetime('now', ?)", settled).fetchone()[0] or after_payment_id
+    if max_order_id <= after_order_id and max_payment_id <= after_payment_id:
+        return 0, 0
+    # Orders an earlier run checked that have been paid since
+    paid_later = [row[0] for row in db.execute('''
+        SELECT DISTINCT order_id FROM payments
+        WHERE payment_id > ? AND payment_id <= ? AND order_id <= ?
+        ORDER BY order_id
+    ''', (after_payment_id, max_payment_id, after_order_id))]
+
+    # Each stream reads whole pages with fetchall(), so all three can share db with the writes
+    session = requests.Session()
+    checked = total = 0
+    pending = []
+    try:
+        chunk_size = min(batch_size, RECHECK_CHUNK)
+        for start in range(0, len(paid_later), chunk_size):
+            chunk = paid_later[start:start + chunk_size]
+            for _, found in _recheck_orders(db, session, gateway_url, chunk, batch_size):
+                pending += found
+            checked += len(chunk)
+            total += _flush(db, pending, rechecked=chunk)
+            pending = []
+        if max_payment_id > after_payment_id:
+            _flush(db, [], ('last_payment_id', max_payment_id))
+
+        if max_order_id > after_order_id:
+            for order_id, found in _check_orders(db, session, gateway_url, after_order_id, max_order_id,
+                                                 batch_size):
+                pending += found
+                checked += 1
+                if checked % batch_size == 0:
+                    total += _flush(db, pending, ('last_order_id', order_id))
+                    pending = []
+            total += _flush(db, pending, ('last_order_id', max_order_id))
+    finally:
+        session.close()
+    logger.info('Reconciled %s orders up to order %s and payment %s, %s discrepancies',
+                checked, max_order_id, max_payment_id, total)
+    return checked, total
+
+
+def _flush(db, discrepancies, checkpoint=None, rechecked=()):
+    # Discrepancies and the checkpoint commit together; a rechecked order's old findings are replaced
+    with db:
+        db.executemany('DELETE FROM payment_discrepancies WHERE order_id = ?',
+                       [(order_id,) for order_id in rechecked])
+        db.executemany('''
+            INSERT INTO payment_discrepancies
+                (kind, order_id, transaction_id, local_amount, gateway_amount, local_status, gateway_status)
+            VALUES (?, ?, ?, ?, ?, ?, ?)
+        ''', discrepancies)
+        if checkpoint is not None:
+            _set_state(db, *checkpoint)
+    return len(discrepancies)
+
+
+def connect(path, history_path=None):
+    db = sqlite3.connect(path, timeout=30)
+    db.row_factory = sqlite3.Row
+    if history_path and os.path.exists(history_path):
+        db.execute('ATTACH DATABASE ? AS history', (history_path,))
+    return db
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Reconcile payments against the payment gateway.')
+    parser.add_argument('--database', default=Config.DATABASE)
+    parser.add_argument('--history-database', default=Config.HISTORY_DATABASE)
+    parser.add_argument('--gateway-url', default=GATEWAY_URL)
+    parser.add_argument('--batch-size', type=int, default=Config.RECONCILE_BATCH_SIZE)
+    parser.add_argument('--settle-minutes', type=int, default=Config.RECONCILE_SETTLE_MINUTES)
+    parser.add_argument('--full', action='store_true', help='forget the checkpoints and recheck every order')
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO)
+    db = connect(args.database, args.history_database)
+    try:
+        db.executescript(SCHEMA)
+        checked, found = reconcile(db, args.gateway_url, args.batch_size, args.settle_minutes, args.full)
+    finally:
+        db.close()
+    print(f'Checked {checked} orders, found {found} discrepancies.')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,142 @@
+"""Read-only analytics snapshot of the main database.
+
+Reports (shop dashboard, shop profile totals) read from a periodic copy of
+penta_book.db instead of the live file, so a long aggregate never holds a
+lock that a buyer's checkout or payment commit has to wait for.
+
+Every worker runs a snapshot thread, but each refresh is claimed in
+maintenance_runs first, so only one of them copies the file per
+ANALYTICS_SNAPSHOT_INTERVAL. Until the first snapshot exists, reports read
+the live database, opened read-only, rather than wait for a copy.
+
+Take a snapshot by hand with ``python reporting.py``.
+"""
+import datetime
+import logging
+import os
+import sqlite3
+import threading
+import time
+
+from flask import g
+
+import backends
+import maintenance
+from config import Config
+
+logger = logging.getLogger(__name__)
+
+# Claim attempts per interval, so the refresh is late by at most a fraction of it
+SNAPSHOT_CHECKS_PER_INTERVAL = 4
+
+
+def take_snapshot(source_path, target_path):
+    """Copy source_path to target_path with the online backup API.
+
+    The whole file is copied in one step. A copy made in several steps
+    starts over whenever another connection writes between them, so under
+    steady checkout traffic it might never finish; one step is a single
+    read transaction, which in WAL mode does not hold up writers. The copy
+    is built in a temporary file and moved into place atomically, so open
+    report connections keep reading the previous snapshot.
+    """
+    # Per-process name so snapshot threads in several workers never share a file
+    tmp_path = f'{target_path}.{os.getpid()}.tmp'
+    if os.path.exists(tmp_path):
+        os.remove(tmp_path)
+
+    source = sqlite3.connect(source_path)
+    target = sqlite3.connect(tmp_path)
+    try:
+        source.backup(target, pages=-1)
+        taken_at = datetime.datetime.now().isoformat(timespec='seconds')
+        target.execute('CREATE TABLE IF NOT EXISTS snapshot_meta (taken_at TEXT NOT NULL)')
+        target.execute('DELETE FROM snapshot_meta')
+        target.execute('INSERT INTO snapshot_meta (taken_at) VALUES (?)', (taken_at,))
+        target.commit()
+    finally:
+        target.close()
+        source.close()
+
+    os.replace(tmp_path, target_path)
+    logger.info('Analytics snapshot written to %s', target_path)
+    return taken_at
+
+
+def connect_report_db(path):
+    # Read-only at the SQLite level, so a report can never write to the copy
+    db = sqlite3.connect(f'file:{path}?mode=ro', uri=True)
+    db.row_factory = sqlite3.Row
+    return db
+
+
+def get_report_db(app):
+    if 'report_db' not in g:
+        path = app.config['ANALYTICS_DATABASE']
+        # No snapshot yet: a read-only connection to the live file beats blocking on a full copy
+        g.report_db = connect_report_db(path if os.path.exists(path) else app.config['DATABASE'])
+    return g.report_db
+
+
+def close_report_db(exception=None):
+    db = g.pop('report_db', None)
+    if db is not None:
+        db.close()
+
+
+def snapshot_status(db):
+    """Returns (taken_at, age in seconds) for the snapshot behind db; (None, None) for the live database."""
+    if backends.dialect(db) != 'sqlite':
+        # Snapshots are SQLite copies, and a failed query would abort the PostgreSQL transaction
+        return None, None
+    try:
+        row = db.execute('SELECT taken_at FROM snapshot_meta').fetchone()
+    except sqlite3.OperationalError:
+        return None, None
+    if not row:
+        return None, None
+    taken_at = datetime.datetime.fromisoformat(row['taken_at'])
+    return row['taken_at'], (datetime.datetime.now() - taken_at).total_seconds()
+
+
+def refresh_snapshot(db, config):
+    """Take a snapshot if this worker claims the refresh; returns the taken_at, or None."""
+    path = config['ANALYTICS_DATABASE']
+    # A missing snapshot is due straight away, whenever the last one was claimed
+    interval = config['ANALYTICS_SNAPSHOT_INTERVAL'] if os.path.exists(path) else 0
+    if not maintenance.claim(db, 'snapshot', interval):
+        return None
+    started = time.time()
+    try:
+        taken_at = take_snapshot(config['DATABASE'], path)
+    except sqlite3.Error:
+        # Let the next check, in any worker, try again
+        db.execute("UPDATE maintenance_runs SET started_at = 0 WHERE task = 'snapshot'")
+        raise
+    maintenance.record(db, 'snapshot', started, taken_at)
+    return taken_at
+
+
+def start_snapshot_thread(app):
+    """Refresh the snapshot every ANALYTICS_SNAPSHOT_INTERVAL seconds in a daemon thread."""
+    interval = app.config['ANALYTICS_SNAPSHOT_INTERVAL']
+    if interval <= 0 or app.extensions['database'].dialect != 'sqlite':
+        return None
+
+    def run():
+        db = maintenance.connect(app.config['DATABASE'])
+        while True:
+            try:
+                refresh_snapshot(db, app.config)
+            except sqlite3.Error as e:
+                logger.error('Analytics snapshot failed: %s', e)
+            time.sleep(interval / SNAPSHOT_CHECKS_PER_INTERVAL)
+
+    thread = threading.Thread(target=run, name='analytics-snapshot', daemon=True)
+    thread.start()
+    return thread
+
+
+if __name__ == '__main__':
+    logging.basicConfig(level=logging.INFO)
+    take_snapshot(Config.DATABASE, Config.ANALYTICS_DATABASE)
@@ -0,0 +1,181 @@
+import fragment_cache
+import invalidation
+from backends import INTEGRITY_ERRORS
+
+REVIEWS_PER_PAGE = 10
+
+# One row per reviewed book; kept in step with `reviews` inside the same
+# transaction so listings never have to run AVG() over the reviews table.
+SCHEMA = '''
+CREATE TABLE IF NOT EXISTS book_rating_stats (
+    book_id      INTEGER PRIMARY KEY REFERENCES books,
+    rating_count INTEGER NOT NULL DEFAULT 0,
+    rating_sum   INTEGER NOT NULL DEFAULT 0,
+    rating_avg   REAL,
+    stars_1      INTEGER NOT NULL DEFAULT 0,
+    stars_2      INTEGER NOT NULL DEFAULT 0,
+    stars_3      INTEGER NOT NULL DEFAULT 0,
+    stars_4      INTEGER NOT NULL DEFAULT 0,
+    stars_5      INTEGER NOT NULL DEFAULT 0
+);
+CREATE INDEX IF NOT EXISTS idx_book_rating_stats_avg ON book_rating_stats (rating_avg, rating_count);
+CREATE INDEX IF NOT EXISTS idx_reviews_book_review ON reviews (book_id, review_id);
+CREATE UNIQUE INDEX IF NOT EXISTS idx_reviews_order_item ON reviews (order_item_id);
+
+-- Backfill books that were reviewed before the stats table existed
+INSERT OR IGNORE INTO book_rating_stats
+    (book_id, rating_count, rating_sum, rating_avg, stars_1, stars_2, stars_3, stars_4, stars_5)
+SELECT book_id, COUNT(*), SUM(rating), AVG(rating),
+       SUM(rating = 1), SUM(rating = 2), SUM(rating = 3), SUM(rating = 4), SUM(rating = 5)
+FROM reviews
+WHERE rating BETWEEN 1 AND 5
+GROUP BY book_id;
+'''
+
+PG_SCHEMA = '''
+CREATE TABLE IF NOT EXISTS book_rating_stats (
+    book_id      INTEGER PRIMARY KEY,
+    rating_count INTEGER NOT NULL DEFAULT 0,
+    rating_sum   INTEGER NOT NULL DEFAULT 0,
+    rating_avg   DOUBLE PRECISION,
+    stars_1      INTEGER NOT NULL DEFAULT 0,
+    stars_2      INTEGER NOT NULL DEFAULT 0,
+    stars_3      INTEGER NOT NULL DEFAULT 0,
+    stars_4      INTEGER NOT NULL DEFAULT 0,
+    stars_5      INTEGER NOT NULL DEFAULT 0
+);
+CREATE INDEX IF NOT EXISTS idx_book_rating_stats_avg ON book_rating_stats (rating_avg, rating_count);
+CREATE INDEX IF NOT EXISTS idx_reviews_book_review ON reviews (book_id, review_id);
+CREATE UNIQUE INDEX IF NOT EXISTS idx_reviews_order_item ON reviews (order_item_id);
+
+INSERT INTO book_rating_stats
+    (book_id, rating_count, rating_sum, rating_avg, stars_1, stars_2, stars_3, stars_4, stars_5)
+SELECT book_id, COUNT(*), SUM(rating), AVG(rating),
+       COUNT(*) FILTER (WHERE rating = 1), COUNT(*) FILTER (WHERE rating = 2), COUNT(*) FILTER (WHERE rating = 3),
+       COUNT(*) FILTER (WHERE rating = 4), COUNT(*) FILTER (WHERE rating = 5)
+FROM reviews
+WHERE rating BETWEEN 1 AND 5
+GROUP BY book_id
+ON CONFLICT DO NOTHING;
+'''
+
+STAR_COLUMNS = {1: 'stars_1', 2: 'stars_2', 3: 'stars_3', 4: 'stars_4', 5: 'stars_5'}
+
+
+class ReviewError(Exception):
+    pass
+
+
+def _adjust_stats(db, book_id, rating, delta):
+    star_column = STAR_COLUMNS[rating]
+    db.execute('INSERT INTO book_rating_stats (book_id) VALUES (?) ON CONFLICT DO NOTHING', (book_id,))
+    db.execute(f'''
+        UPDATE book_rating_stats
+        SET rating_count = rating_count + :delta,
+            rating_sum = rating_sum + :delta * :rating,
+            rating_avg = (rating_sum + :delta * :rating) * 1.0 / NULLIF(rating_count + :delta, 0),
+            {star_column} = {star_column} + :delta
+        WHERE book_id = :book_id
+    ''', {'delta': delta, 'rating': rating, 'book_id': book_id})
+
+
+def _check_rating(rating):
+    if rating not in STAR_COLUMNS:
+        raise ReviewError('Rating must be between 1 and 5.')
+
+
+def reviewable_order_item(db, buyer_id, book_id):
+    # A buyer may review each delivered order item once
+    row = db.execute('''
+        SELECT oi.order_item_id
+        FROM orderitems oi
+        JOIN orders o ON o.order_id = oi.order_id
+        JOIN shipment s ON s.order_id = o.order_id
+        LEFT JOIN reviews r ON r.order_item_id = oi.order_item_id
+        WHERE o.buyer_id = ? AND oi.book_id = ? AND s.status = 'Delivered' AND r.review_id IS NULL
+        ORDER BY oi.order_item_id
+        LIMIT 1
+    ''', (buyer_id, book_id)).fetchone()
+    return row['order_item_id'] if row else None
+
+
+def add_review(db, buyer_id, book_id, rating, comment):
+    _check_rating(rating)
+    order_item_id = reviewable_order_item(db, buyer_id, book_id)
+    if order_item_id is None:
+        raise ReviewError('You can only review books from your delivered orders.')
+
+    try:
+        with db:
+            review_id = db.execute(
+                'INSERT INTO reviews (buyer_id, book_id, order_item_id, rating, comment) VALUES (?, ?, ?, ?, ?) '
+                'RETURNING review_id',
+                (buyer_id, book_id, order_item_id, rating, comment)).fetchone()[0]
+            _adjust_stats(db, book_id, rating, 1)
+            fragment_cache.bump_version(db)
+            invalidation.record(db, 'book', book_id)
+    except INTEGRITY_ERRORS:
+        raise ReviewError('This order item has already been reviewed.')
+    return review_id
+
+
+def _own_review(db, review_id, buyer_id):
+    review = db.execute('SELECT * FROM reviews WHERE review_id = ? AND buyer_id = ?',
+                        (review_id, buyer_id)).fetchone()
+    if not review:
+        raise ReviewError('Review not found or you do not have permission to change it.')
+    return review
+
+
+def update_review(db, review_id, buyer_id, rating, comment):
+    _check_rating(rating)
+    review = _own_review(db, review_id, buyer_id)
+    with db:
+        db.execute('UPDATE reviews SET rating = ?, comment = ? WHERE review_id = ?',
+                   (rating, comment, review_id))
+        if review['rating'] != rating:
+            _adjust_stats(db, review['book_id'], review['rating'], -1)
+            _adjust_stats(db, review['book_id'], rating, 1)
+            fragment_cache.bump_version(db)
+            invalidation.record(db, 'book', review['book_id'])
+    return review['book_id']
+
+
+def delete_review(db, review_id, buyer_id):
+    review = _own_review(db, review_id, buyer_id)
+    with db:
+        db.execute('DELETE FROM reviews WHERE review_id = ?', (review_id,))
+        _adjust_stats(db, review['book_id'], review['rating'], -1)
+        fragment_cache.bump_version(db)
+        invalidation.record(db, 'book', review['book_id'])
+    return review['book_id']
+
+
+def get_rating_stats(db, book_id):
+    return db.execute('SELECT * FROM book_rating_stats WHERE book_id = ?', (book_id,)).fetchone()
+
+
+def list_reviews(db, book_id, before=None, limit=REVIEWS_PER_PAGE):
+    # Keyset pagination over (book_id, review_id), newest first.
+    # Returns the page and the cursor for the next one (None on the last page).
+    if before is None:
+        rows = db.execute('''
+            SELECT r.review_id, r.buyer_id, r.rating, r.comment, b.username
+            FROM reviews r
+            LEFT JOIN buyer b ON b.buyer_id = r.buyer_id
+            WHERE r.book_id = ?
+            ORDER BY r.review_id DESC
+            LIMIT ?
+        ''', (book_id, limit + 1)).fetchall()
+    else:
+        rows = db.execute('''
+            SELECT r.review_id, r.buyer_id, r.rating, r.comment, b.username
+            FROM reviews r
+            LEFT JOIN buyer b ON b.buyer_id = r.buyer_id
+            WHERE r.book_id = ? AND r.review_id < ?
+            ORDER BY r.review_id DESC
+            LIMIT ?
+        ''', (book_id, before, limit + 1)).fetchall()
+
+    next_cursor = rows[limit - 1]['review_id'] if len(rows) > limit else None
+    return rows[:limit], next_cursor
@@ -0,0 +1,95 @@
+// Bulk price and stock edits on manage_books. Only changed rows are sent, each
+// with the version it was loaded at; rows changed elsewhere in the meantime come
+// back as conflicts with their current values and are left for the shop to review.
+(function () {
+    var script = document.currentScript;
+    var button = document.getElementById('bulk-save');
+    var status = document.getElementById('bulk-status');
+    if (!script || !button) {
+        return;
+    }
+
+    function inputs(row) {
+        return row.querySelectorAll('input[data-field]');
+    }
+
+    function changed(row) {
+        return Array.prototype.some.call(inputs(row), function (input) {
+            return input.value !== input.dataset.original;
+        });
+    }
+
+    function show(kind, message) {
+        status.className = 'alert alert-' + kind;
+        status.textContent = message;
+    }
+
+    document.addEventListener('input', function (event) {
+        var row = event.target.closest('tr[data-book-id]');
+        if (row) {
+            row.classList.toggle('table-info', changed(row));
+            button.disabled = !document.querySelector('tr.table-info');
+        }
+    });
+
+    button.addEventListener('click', function () {
+        var rows = {};
+        var changes = [];
+        document.querySelectorAll('tr[data-book-id]').forEach(function (row) {
+            if (!changed(row)) {
+                return;
+            }
+            var change = {book_id: Number(row.dataset.bookId), version: Number(row.dataset.version)};
+            inputs(row).forEach(function (input) {
+                if (input.value !== input.dataset.original && input.value !== '') {
+                    change[input.dataset.field] = Number(input.value);
+                }
+            });
+            rows[change.book_id] = row;
+            changes.push(change);
+        });
+        if (!changes.length) {
+            return;
+        }
+
+        button.disabled = true;
+        fetch(script.dataset.bulkUrl, {
+            method: 'POST',
+            headers: {'Content-Type': 'application/json'},
+            credentials: 'same-origin',
+            body: JSON.stringify({changes: changes})
+        }).then(function (response) {
+            return response.json();
+        }).then(function (result) {
+            if (result.status !== 'success') {
+                show('danger', result.message);
+                button.disabled = false;
+                return;
+            }
+            result.updated.forEach(function (book) {
+                var row = rows[book.book_id];
+                row.dataset.version = book.version;
+                inputs(row).forEach(function (input) {
+                    input.dataset.original = input.value;
+                });
+                row.querySelector('[data-conflict]').textContent = '';
+                row.classList.remove('table-info', 'table-warning');
+            });
+            // The shop's values stay in the inputs; saving again applies them over the current ones
+            result.conflicts.forEach(function (book) {
+                var row = rows[book.book_id];
+                row.dataset.version = book.version;
+                row.querySelector('[data-conflict]').textContent =
+                    'Diubah di tempat lain: harga ' + book.price + ', stok ' + book.stock;
+                row.classList.add('table-warning');
+            });
+            show(result.conflicts.length ? 'warning' : 'success',
+                 result.updated.length + ' buku disimpan, ' + result.conflicts.length + ' konflik' +
+                 (result.missing.length ? ', ' + result.missing.length + ' tidak ditemukan' : '') + '.');
+            button.disabled = !document.querySelector('tr.table-info');
+        }).catch(function () {
+            show('danger', 'Gagal menyimpan perubahan.');
+            button.disabled = false;
+        });
+    });
+})();
@@ -0,0 +1,28 @@
+// Live order status over Server-Sent Events, so shipment pages need no refreshing.
+// Elements with data-order-id get their [data-field] children updated; a page
+// marked data-reload-on-new reloads when an order it does not show changes.
+(function () {
+    var script = document.currentScript;
+    if (!window.EventSource || !script) {
+        return;
+    }
+
+    var source = new EventSource(script.dataset.eventsUrl);
+    source.addEventListener('order', function (message) {
+        var data = JSON.parse(message.data);
+        var rows = document.querySelectorAll('[data-order-id="' + data.order_id + '"]');
+        if (!rows.length) {
+            if (document.querySelector('[data-reload-on-new]')) {
+                window.location.reload();
+            }
+            return;
+        }
+        rows.forEach(function (row) {
+            Object.keys(data).forEach(function (field) {
+                row.querySelectorAll('[data-field="' + field + '"]').forEach(function (cell) {
+                    cell.textContent = data[field];
+                });
+            });
+        });
+    });
+})();
@@ -0,0 +1,219 @@
+"""Time-limited stock reservations for books in open carts.
+
+Adding a book to the cart holds the cart's quantity in stock_holds for
+STOCK_HOLD_TTL seconds, and every later add moves the expiry of the cart's
+live holds forward. A book's available stock is books.stock minus the live
+holds of other carts. The hold is a single conditional UPSERT, so the check
+and the reservation happen in one statement and a hot book cannot be
+oversold, and the books row itself is only written when checkout turns the
+holds into a sale.
+
+Expired holds no longer count, whether or not they were deleted yet. Each
+worker runs a sweeper thread that keeps the expiry times of the carts it
+knows about in a min-heap, sleeps until the earliest one and deletes those
+holds. Every STOCK_SWEEP_INTERVAL seconds it reloads the holds expiring
+within the next interval, which picks up the carts of other workers.
+
+Delete the expired holds by hand with ``python stock_holds.py``.
+"""
+import argparse
+import heapq
+import logging
+import sqlite3
+import threading
+import time
+
+from flask import current_app
+
+import backends
+from config import Config
+
+logger = logging.getLogger(__name__)
+
+SCHEMA = '''
+CREATE TABLE IF NOT EXISTS stock_holds (
+    cart_id    INTEGER NOT NULL,
+    book_id    INTEGER NOT NULL,
+    quantity   INTEGER NOT NULL,
+    expires_at REAL NOT NULL,
+    PRIMARY KEY (cart_id, book_id)
+) WITHOUT ROWID;
+CREATE INDEX IF NOT EXISTS idx_stock_holds_book ON stock_holds (book_id, expires_at, quantity);
+CREATE INDEX IF NOT EXISTS idx_stock_holds_expires ON stock_holds (expires_at);
+'''
+
+PG_SCHEMA = '''
+CREATE TABLE IF NOT EXISTS stock_holds (
+    cart_id    INTEGER NOT NULL,
+    book_id    INTEGER NOT NULL,
+    quantity   INTEGER NOT NULL,
+    expires_at DOUBLE PRECISION NOT NULL,
+    PRIMARY KEY (cart_id, book_id)
+);
+CREATE INDEX IF NOT EXISTS idx_stock_holds_book ON stock_holds (book_id, expires_at, quantity);
+CREATE INDEX IF NOT EXISTS idx_stock_holds_expires ON stock_holds (expires_at);
+'''
+
+HOLD = '''
+    INSERT INTO stock_holds (cart_id, book_id, quantity, expires_at)
+    SELECT :cart_id, :book_id, :quantity, :expires_at
+    WHERE :quantity <= (SELECT COALESCE(stock, 0) FROM books WHERE book_id = :book_id)
+        - (SELECT COALESCE(SUM(quantity), 0) FROM stock_holds
+           WHERE book_id = :book_id AND cart_id <> :cart_id AND expires_at > :now)
+    ON CONFLICT (cart_id, book_id) DO UPDATE SET quantity = excluded.quantity, expires_at = excluded.expires_at
+'''
+
+
+def available(db, book_id, cart_id=None, now=None):
+    """Stock of book_id not held by other carts."""
+    row = db.execute('''
+        SELECT COALESCE(stock, 0) - (SELECT COALESCE(SUM(quantity), 0) FROM stock_holds
+                                     WHERE book_id = :book_id AND cart_id <> :cart_id AND expires_at > :now)
+        FROM books WHERE book_id = :book_id
+    ''', {'book_id': book_id, 'cart_id': -1 if cart_id is None else cart_id,
+          'now': time.time() if now is None else now}).fetchone()
+    return max(row[0], 0) if row else 0
+
+
+def hold(db, cart_id, book_id, quantity, ttl):
+    """Hold quantity copies of book_id for the cart; returns the expiry, or None when there are too few.
+
+    The cart's other live holds move to the same expiry. The caller commits.
+    """
+    now = time.time()
+    expires_at = now + ttl
+    params = {'cart_id': cart_id, 'book_id': book_id, 'quantity': quantity, 'expires_at': expires_at, 'now': now}
+    if backends.dialect(db) != 'sqlite':
+        # SQLite has one writer at a time; PostgreSQL holds of one book wait on its row instead
+        db.execute('SELECT 1 FROM books WHERE book_id = ? FOR UPDATE', (book_id,))
+    if db.execute(HOLD, params).rowcount != 1:
+        return None
+    db.execute('UPDATE stock_holds SET expires_at = :expires_at WHERE cart_id = :cart_id AND expires_at > :now',
+               params)
+    return expires_at
+
+
+def hold_for_cart(db, cart_id, book_id, quantity):
+    """hold() with STOCK_HOLD_TTL, scheduled on this worker's sweeper."""
+    expires_at = hold(db, cart_id, book_id, quantity, current_app.config['STOCK_HOLD_TTL'])
+    sweeper = current_app.extensions.get('stock_sweeper')
+    if expires_at is not None and sweeper is not None:
+        sweeper.schedule(expires_at, cart_id)
+    return expires_at
+
+
+def release(db, cart_id):
+    """Drop every hold of the cart; the caller commits."""
+    db.execute('DELETE FROM stock_holds WHERE cart_id = ?', (cart_id,))
+
+
+def convert(db, cart_id, items):
+    """Turn the cart's holds into a sale of items, a list of (book_id, quantity).
+
+    A hold that expired is taken again if the stock is still there. Returns
+    the book_ids that could not be held; stock is only taken when that list
+    is empty. The caller commits, or rolls back on a shortfall.
+    """
+    short = [book_id for book_id, quantity in items
+             if hold(db, cart_id, book_id, quantity, current_app.config['STOCK_HOLD_TTL']) is None]
+    if short:
+        return short
+    db.executemany('UPDATE books SET stock = stock - ?, version = version + 1 WHERE book_id = ?',
+                   [(quantity, book_id) for book_id, quantity in items])
+    release(db, cart_id)
+    return []
+
+
+def sweep(db, now=None):
+    """Delete every expired hold; returns how many were deleted."""
+    cur = db.execute('DELETE FROM stock_holds WHERE expires_at <= ?', (time.time() if now is None else now,))
+    return cur.rowcount
+
+
+class Sweeper:
+    """Deletes the holds of each cart when its earliest known expiry comes round."""
+
+    def __init__(self, path, reload_interval):
+        self.path = path
+        self.reload_interval = reload_interval
+        self._heap = []
+        self._condition = threading.Condition()
+
+    def schedule(self, expires_at, cart_id):
+        with self._condition:
+            heapq.heappush(self._heap, (expires_at, cart_id))
+            if self._heap[0] == (expires_at, cart_id):
+                self._condition.notify()
+
+    def _reload(self, db, now):
+        rows = db.execute('SELECT expires_at, cart_id FROM stock_holds WHERE expires_at <= ?',
+                          (now + self.reload_interval,)).fetchall()
+        with self._condition:
+            self._heap.extend(tuple(row) for row in rows)
+            heapq.heapify(self._heap)
+
+    def _due(self, next_reload):
+        with self._condition:
+            now = time.time()
+            due = set()
+            while self._heap and self._heap[0][0] <= now:
+                due.add(heapq.heappop(self._heap)[1])
+            if not due:
+                wake = min(next_reload, self._heap[0][0]) if self._heap else next_reload
+                self._condition.wait(max(wake - now, 0))
+            return now, due
+
+    def run(self):
+        db = connect(self.path)
+        next_reload = 0
+        while True:
+            try:
+                if time.time() >= next_reload:
+                    with self._condition:
+                        self._heap.clear()
+                    self._reload(db, time.time())
+                    next_reload = time.time() + self.reload_interval
+                now, due = self._due(next_reload)
+                # A cart whose holds were extended since keeps them
+                db.executemany('DELETE FROM stock_holds WHERE cart_id = ? AND expires_at <= ?',
+                               [(cart_id, now) for cart_id in sorted(due)])
+            except sqlite3.Error as e:
+                logger.error('Stock hold sweep failed: %s', e)
+                time.sleep(self.reload_interval)
+
+
+def connect(path):
+    # Autocommit, so each sweep releases its lock straight away
+    db = sqlite3.connect(path, timeout=30, isolation_level=None)
+    db.row_factory = sqlite3.Row
+    return db
+
+
+def start_sweeper_thread(app):
+    """Delete expired holds in a daemon thread, reloading them every STOCK_SWEEP_INTERVAL seconds."""
+    interval = app.config['STOCK_SWEEP_INTERVAL']
+    if interval <= 0 or app.extensions['database'].dialect != 'sqlite':
+        return None
+
+    sweeper = app.extensions['stock_sweeper'] = Sweeper(app.config['DATABASE'], interval)
+    thread = threading.Thread(target=sweeper.run, name='stock-hold-sweeper', daemon=True)
+    thread.start()
+    return thread
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Delete expired stock holds.')
+    parser.add_argument('--database', default=Config.DATABASE)
+    args = parser.parse_args()
+
+    db = connect(args.database)
+    try:
+        db.executescript(SCHEMA)
+        deleted = sweep(db)
+    finally:
+        db.close()
+    print(f'Deleted {deleted} expired holds.')
+
+
+if __name__ == '__main__':
+    main()
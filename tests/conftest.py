@@ -0,0 +1,145 @@
+"""Fixtures for running the app against a throwaway database.
+
+By default each test gets a SQLite file of its own in tmp_path, with the base
+tables of the shipped penta_book.db (and none of its rows) and everything
+init_db adds on top:
+
+    python -m pytest -q
+
+tests/test_postgres.py runs the same app against PostgreSQL. Set
+TEST_DATABASE_URL to a UTF8 PostgreSQL database the tests may create schemas
+in, e.g. postgresql://postgres@localhost/penta_test. Each test gets an empty
+schema of its own, dropped afterwards; without the variable those tests are
+skipped:
+
+    TEST_DATABASE_URL=postgresql://postgres@localhost/penta_test python -m pytest -q
+"""
+import os
+import sqlite3
+import sys
+import uuid
+from urllib.parse import quote
+
+import pytest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from config import Config  # noqa: E402
+
+BASE_DATABASE = os.path.join(ROOT, 'penta_book.db')
+TEST_DATABASE_URL = os.getenv('TEST_DATABASE_URL', '')
+
+
+def make_config(tmp_path, **settings):
+    """Config with every file in tmp_path and no background threads; the tests call the jobs themselves."""
+    values = {
+        'TESTING': True,
+        'SECRET_KEY': 'test',
+        'WTF_CSRF_ENABLED': False,
+        'DATABASE_URL': '',
+        'DATABASE': str(tmp_path / 'penta_book.db'),
+        'ANALYTICS_DATABASE': str(tmp_path / 'analytics.db'),
+        'HISTORY_DATABASE': str(tmp_path / 'history.db'),
+        'ADMISSION_DATABASE': str(tmp_path / 'admission.db'),
+        'UPLOAD_FOLDER': str(tmp_path / 'uploads'),
+        'JINJA_BYTECODE_CACHE_DIR': str(tmp_path / 'jinja'),
+        'BACKUP_DIR': str(tmp_path / 'backups'),
+        'ADMISSION_ENABLED': False,
+        'WARMUP_ENABLED': False,
+        'NOTIFY_INTERVAL': 0,
+        'ANALYTICS_SNAPSHOT_INTERVAL': 0,
+        'MAINTENANCE_INTERVAL': 0,
+        'LEADERBOARD_REFRESH_INTERVAL': 0,
+        'STOCK_SWEEP_INTERVAL': 0,
+        'EVENTS_POLL_INTERVAL': 0,
+        'WARMUP_RECORD_INTERVAL': 0,
+    }
+    values.update(settings)
+    return type('TestConfig', (Config,), values)
+
+
+def create_base_schema(path):
+    """Create the base tables of the shipped database, without its rows, in a new SQLite file."""
+    shipped = sqlite3.connect(f'file:{BASE_DATABASE}?mode=ro', uri=True)
+    try:
+        ddl = [row[0] for row in shipped.execute(
+            "SELECT sql FROM sqlite_master WHERE sql IS NOT NULL AND name NOT LIKE 'sqlite_%' ORDER BY rowid")]
+    finally:
+        shipped.close()
+    db = sqlite3.connect(path)
+    try:
+        db.executescript(';\n'.join(ddl) + ';')
+    finally:
+        db.close()
+
+
+@pytest.fixture
+def make_app(tmp_path):
+    """create_app() on a fresh SQLite database; keyword arguments override the test config."""
+    from app import create_app
+
+    def make(**settings):
+        config = make_config(tmp_path, **settings)
+        if not os.path.exists(config.DATABASE):
+            create_base_schema(config.DATABASE)
+        return create_app(config)
+
+    return make
+
+
+@pytest.fixture
+def app(make_app):
+    return make_app()
+
+
+@pytest.fixture
+def pg_url():
+    if not TEST_DATABASE_URL.startswith(('postgresql://', 'postgres://')):
+        pytest.skip('TEST_DATABASE_URL is not set to a PostgreSQL database')
+    psycopg = pytest.importorskip('psycopg')
+    schema = f'test_{uuid.uuid4().hex[:12]}'
+    with psycopg.connect(TEST_DATABASE_URL, autocommit=True) as admin:
+        admin.execute(f'CREATE SCHEMA {schema}')
+    separator = '&' if '?' in TEST_DATABASE_URL else '?'
+    yield f"{TEST_DATABASE_URL}{separator}options={quote(f'-csearch_path={schema}')}"
+    with psycopg.connect(TEST_DATABASE_URL, autocommit=True) as admin:
+        admin.execute(f'DROP SCHEMA {schema} CASCADE')
+
+
+@pytest.fixture
+def db(app):
+    db = app.extensions['database'].connect()
+    yield db
+    db.close()
+
+
+@pytest.fixture
+def shop_data(db):
+    """One shop, category, payment method and buyer, and two books of the shop."""
+    ids = {
+        'shop_id': db.execute('''
+            INSERT INTO shop (shop_name, owner_name, shop_phone, shop_address, shop_email, password, isverified)
+            VALUES ('Toko Buku', 'Ani', '0811', 'Jl. Merdeka 1', 'shop@example.com', 'x', 1)
+            RETURNING shop_id
+        ''').fetchone()[0],
+        'category_id': db.execute(
+            "INSERT INTO categories (category_name) VALUES ('Fiction') RETURNING category_id").fetchone()[0],
+        'method_id': db.execute(
+            "INSERT INTO paymentmethods (method_name) VALUES ('Transfer') RETURNING method_id").fetchone()[0],
+        'buyer_id': db.execute('''
+            INSERT INTO buyer (username, email, password, buyer_address)
+            VALUES ('budi', 'budi@example.com', 'x', 'Jl. Sudirman 2')
+            RETURNING buyer_id
+        ''').fetchone()[0],
+    }
+    ids['book_ids'] = [
+        db.execute('''
+            INSERT INTO books (category_id, shop_id, book_name, isbn, author, "desc", price, stock, img_url)
+            VALUES (?, ?, ?, 9786020000000, 'Penulis', 'Deskripsi', ?, ?, 'book.jpg')
+            RETURNING book_id
+        ''', (ids['category_id'], ids['shop_id'], name, price, stock)).fetchone()[0]
+        for name, price, stock in (('Laskar Pelangi', 75000, 5), ('Bumi Manusia', 120000, 2))
+    ]
+    db.commit()
+    return ids
@@ -0,0 +1,62 @@
+"""Requests over an endpoint's budget get a 429 with Retry-After before the view runs."""
+import pytest
+
+BUDGETS = {'api.list_books': {'rate': 0.5, 'burst': 2, 'methods': ('GET',)}}
+
+
+@pytest.fixture(params=['memory', 'sqlite'])
+def app(request, make_app):
+    return make_app(ADMISSION_ENABLED=True, ADMISSION_BACKEND=request.param, ADMISSION_BUDGETS=BUDGETS)
+
+
+def get_books(client, address='10.0.0.1'):
+    return client.get('/api/v1/books', headers={'Accept': 'application/json'},
+                      environ_base={'REMOTE_ADDR': address})
+
+
+def test_over_budget_gets_429_with_retry_after(app):
+    client = app.test_client()
+    assert [get_books(client).status_code for _ in range(2)] == [200, 200]
+
+    response = get_books(client)
+    assert response.status_code == 429
+    # Two seconds until the bucket refills by one token at 0.5 a second
+    assert response.headers['Retry-After'] == '2'
+    assert response.get_json() == {'status': 'error', 'message': 'Too many requests. Please try again shortly.'}
+
+    # Another client has a bucket of its own
+    assert get_books(client, '10.0.0.2').status_code == 200
+    # Endpoints without a budget are not limited
+    assert client.get('/api/v1/books/1', environ_base={'REMOTE_ADDR': '10.0.0.1'}).status_code == 404
+
+
+def test_rejected_request_spends_no_token_from_other_buckets(app):
+    client = app.test_client()
+    get_books(client)
+    with client.session_transaction() as session:
+        session['user_id'] = 1
+    # The IP bucket has one token left, the buyer's bucket two
+    assert get_books(client).status_code == 200
+    assert get_books(client).status_code == 429
+
+    # From another address the buyer's bucket still has its token, which the 429 above did not spend
+    assert get_books(client, '10.0.0.2').status_code == 200
+    assert get_books(client, '10.0.0.3').status_code == 429
+
+
+def test_concurrency_limit(make_app):
+    app = make_app(ADMISSION_ENABLED=True, ADMISSION_BUDGETS={
+        'api.list_books': {'rate': 100, 'burst': 100, 'concurrency': 1, 'methods': ('GET',)}})
+    slots = app.extensions['admission'].slots['api.list_books']
+    client = app.test_client()
+
+    # Another request holds the only slot
+    assert slots.acquire(blocking=False)
+    response = client.get('/api/v1/books')
+    assert response.status_code == 429
+    assert response.headers['Retry-After'] == '1'
+
+    slots.release()
+    assert client.get('/api/v1/books').status_code == 200
+    # The slot is given back when the request ends
+    assert client.get('/api/v1/books').status_code == 200
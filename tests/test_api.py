@@ -0,0 +1,57 @@
+"""/api/v1/books: keyset pages, field selection and lookups by id."""
+
+
+def add_books(db, shop_data, count):
+    book_ids = [db.execute('''
+        INSERT INTO books (category_id, shop_id, book_name, price, stock) VALUES (?, ?, ?, 10000, 1)
+        RETURNING book_id
+    ''', (shop_data['category_id'], shop_data['shop_id'], f'Buku {number}')).fetchone()[0] for number in range(count)]
+    db.commit()
+    return book_ids
+
+
+def test_cursor_pages_walk_every_book_once_newest_first(app, db, shop_data):
+    newest_first = sorted(shop_data['book_ids'] + add_books(db, shop_data, 3), reverse=True)
+    client = app.test_client()
+
+    pages, cursor = [], None
+    while True:
+        query = {'limit': 2, 'fields': 'book_name', 'cursor': cursor}
+        body = client.get('/api/v1/books', query_string=query).get_json()
+        pages.append([book['book_id'] for book in body['books']])
+        cursor = body['next_cursor']
+        if cursor is None:
+            break
+    assert pages == [newest_first[:2], newest_first[2:4], newest_first[4:]]
+
+    # A last page that is exactly full has no cursor after it
+    body = client.get('/api/v1/books?limit=5').get_json()
+    assert ([book['book_id'] for book in body['books']], body['next_cursor']) == (newest_first, None)
+    body = client.get(f'/api/v1/books?limit=2&cursor={newest_first[-1]}').get_json()
+    assert body == {'books': [], 'next_cursor': None}
+
+
+def test_bad_cursor_is_rejected(app, shop_data):
+    client = app.test_client()
+    response = client.get('/api/v1/books?cursor=abc')
+    assert response.status_code == 400
+    assert response.get_json()['status'] == 'error'
+
+
+def test_fields_ids_and_etag(app, shop_data):
+    first, second = shop_data['book_ids']
+    client = app.test_client()
+
+    body = client.get('/api/v1/books?fields=price,book_name,price').get_json()
+    assert body['books'][0] == {'book_id': second, 'book_name': 'Bumi Manusia', 'price': 120000}
+    assert client.get('/api/v1/books?fields=password').status_code == 400
+
+    body = client.get(f'/api/v1/books?ids={second},999,{first}&fields=book_name').get_json()
+    assert [book['book_id'] for book in body['books']] == [second, first]
+    assert body['missing'] == [999]
+    assert client.get('/api/v1/books?ids=1,x').status_code == 400
+
+    response = client.get(f'/api/v1/books/{first}')
+    assert response.get_json()['shop_name'] == 'Toko Buku'
+    assert client.get(f'/api/v1/books/{first}', headers={'If-None-Match': response.headers['ETag']}).status_code == 304
+    assert client.get('/api/v1/books/999').status_code == 404
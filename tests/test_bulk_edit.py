@@ -0,0 +1,101 @@
+"""Bulk price and stock edits: validation, version conflicts and the JSON endpoint."""
+import re
+
+import pytest
+
+import bulk_edit
+
+
+def log_in(client, **values):
+    with client.session_transaction() as session:
+        session.update(values)
+
+
+def books(db):
+    return [tuple(row) for row in db.execute('SELECT book_id, price, stock, version FROM books ORDER BY book_id')]
+
+
+@pytest.mark.parametrize('payload, message', [
+    (None, 'Send a list of changes.'),
+    ([], 'Send a list of changes.'),
+    ({'book_id': 1}, 'Send a list of changes.'),
+    ([{'book_id': 1}], 'Invalid change'),
+    ([{'book_id': 'x', 'version': 0, 'price': 1}], 'Invalid change'),
+    ([{'book_id': 1, 'version': 0, 'stock': 1e400}], 'Invalid change'),
+    ([{'book_id': 1, 'version': 0}], 'Nothing to change for book 1.'),
+    ([{'book_id': 1, 'version': 0, 'price': 'nan'}], 'Price of book 1 must be a number.'),
+    ([{'book_id': 1, 'version': 0, 'price': float('inf')}], 'Price of book 1 must be a number.'),
+    ([{'book_id': 1, 'version': 0, 'stock': -1}], 'Price and stock of book 1 cannot be negative.'),
+    ([{'book_id': 1, 'version': 0, 'price': 1}, {'book_id': '1', 'version': 1, 'stock': 2}],
+     'Book 1 is changed more than once; send one change per book.'),
+])
+def test_parse_changes_rejects(payload, message):
+    with pytest.raises(ValueError, match=re.escape(message)):
+        bulk_edit.parse_changes(payload)
+
+
+def test_parse_changes():
+    changes = [{'book_id': '3', 'version': 2, 'price': '1500.5'}, {'book_id': 4, 'version': 0, 'stock': 0}]
+    assert bulk_edit.parse_changes(changes) == [
+        {'book_id': 3, 'version': 2, 'price': 1500.5, 'stock': None},
+        {'book_id': 4, 'version': 0, 'price': None, 'stock': 0},
+    ]
+
+
+def test_apply_changes_skips_conflicts_and_other_shops_books(db, shop_data):
+    first, second = shop_data['book_ids']
+    other_shop_id = shop_data['shop_id'] + 1
+    foreign = db.execute("INSERT INTO books (shop_id, book_name, price, stock) VALUES (?, 'Lain', 1, 1) "
+                         'RETURNING book_id', (other_shop_id,)).fetchone()[0]
+    # Sold from since the page was loaded
+    db.execute('UPDATE books SET stock = stock - 1, version = version + 1 WHERE book_id = ?', (second,))
+    db.commit()
+
+    result = bulk_edit.apply_changes(db, shop_data['shop_id'], bulk_edit.parse_changes([
+        {'book_id': first, 'version': 0, 'price': 80000},
+        {'book_id': second, 'version': 0, 'stock': 10},
+        {'book_id': foreign, 'version': 0, 'stock': 10},
+        {'book_id': 999, 'version': 0, 'stock': 10},
+    ]))
+    db.commit()
+    assert result == {'updated': [{'book_id': first, 'version': 1}],
+                      'conflicts': [{'book_id': second, 'price': 120000, 'stock': 1, 'version': 1}],
+                      'missing': [foreign, 999]}
+    assert books(db) == [(first, 80000, 5, 1), (second, 120000, 1, 1), (foreign, 1, 1, 0)]
+
+    # Sending the same change again conflicts with the version it made
+    result = bulk_edit.apply_changes(db, shop_data['shop_id'], bulk_edit.parse_changes([
+        {'book_id': first, 'version': 0, 'price': 90000}]))
+    db.commit()
+    assert (result['updated'], [row['version'] for row in result['conflicts']]) == ([], [1])
+    assert books(db)[0] == (first, 80000, 5, 1)
+
+
+def test_bulk_edit_endpoint(app, db, shop_data):
+    first, second = shop_data['book_ids']
+    client = app.test_client()
+    url = '/shop/manage_books/bulk'
+    assert client.post(url, json={'changes': []}).status_code == 401
+
+    log_in(client, shop_id=shop_data['shop_id'], role='shop')
+    for body in (['changes'], 'changes', None):
+        response = client.post(url, json=body)
+        assert (response.status_code, response.get_json()['message']) == \
+            (400, 'Send a JSON object with a list of changes.')
+    response = client.post(url, data='{"changes": [{"book_id": 1, "version": 0, "price": NaN}]}',
+                           content_type='application/json')
+    assert (response.status_code, response.get_json()['message']) == (400, 'Price of book 1 must be a number.')
+    response = client.post(url, json={'changes': [{'book_id': first, 'version': 0, 'price': 1},
+                                                  {'book_id': first, 'version': 0, 'stock': 1}]})
+    assert response.status_code == 400
+    assert books(db)[0] == (first, 75000, 5, 0)
+
+    response = client.post(url, json={'changes': [{'book_id': first, 'version': 0, 'price': 80000},
+                                                  {'book_id': second, 'version': 1, 'stock': 1}]})
+    assert response.status_code == 200
+    assert response.get_json() == {
+        'status': 'success', 'updated': [{'book_id': first, 'version': 1}], 'missing': [],
+        'conflicts': [{'book_id': second, 'price': 120000, 'stock': 2, 'version': 0}]}
+    db.rollback()
+    assert db.execute('SELECT price FROM book_cards WHERE book_id = ?', (first,)).fetchone()[0] == 80000
+    assert [row[0] for row in db.execute("SELECT entity_id FROM change_log WHERE entity = 'book'")] == [str(first)]
@@ -0,0 +1,139 @@
+"""Triggers keeping the book_cards and book_facets read models in step with their source tables."""
+import catalog
+import reviews
+
+
+def cards(db):
+    return [tuple(row) for row in db.execute(f'SELECT {catalog.CARD_COLUMNS} FROM book_cards ORDER BY book_id')]
+
+
+def rebuilt_cards(db):
+    # What the triggers must match: the cards built from scratch
+    return [tuple(row) for row in db.execute(f'{catalog._SELECT_CARD} ORDER BY b.book_id')]
+
+
+def test_book_writes_update_the_cards(db, shop_data):
+    first, second = shop_data['book_ids']
+    card = db.execute('SELECT * FROM book_cards WHERE book_id = ?', (first,)).fetchone()
+    assert (card['book_name'], card['category_name'], card['shop_name'], card['rating_count']) == \
+        ('Laskar Pelangi', 'Fiction', 'Toko Buku', 0)
+
+    db.execute('UPDATE books SET price = 250000, stock = 0, book_name = ? WHERE book_id = ?',
+               ('Laskar Pelangi (Edisi Baru)', first))
+    db.execute('UPDATE books SET book_id = 100 WHERE book_id = ?', (second,))
+    db.commit()
+    assert cards(db) == rebuilt_cards(db)
+    assert [row[0] for row in cards(db)] == [first, 100]
+
+    db.execute('DELETE FROM books WHERE book_id = ?', (first,))
+    db.commit()
+    assert cards(db) == rebuilt_cards(db)
+    assert [row[0] for row in cards(db)] == [100]
+
+
+def test_category_and_shop_writes_update_the_cards(db, shop_data):
+    db.execute("UPDATE categories SET category_name = 'Novel' WHERE category_id = ?", (shop_data['category_id'],))
+    db.execute("UPDATE shop SET shop_name = 'Toko Baru' WHERE shop_id = ?", (shop_data['shop_id'],))
+    db.commit()
+    assert {(row['category_name'], row['shop_name']) for row in db.execute('SELECT * FROM book_cards')} == \
+        {('Novel', 'Toko Baru')}
+
+    # A book whose category or shop is gone keeps its card without the name
+    db.execute('DELETE FROM categories WHERE category_id = ?', (shop_data['category_id'],))
+    db.execute('DELETE FROM shop WHERE shop_id = ?', (shop_data['shop_id'],))
+    db.commit()
+    assert cards(db) == rebuilt_cards(db)
+    assert {(row['category_name'], row['shop_name']) for row in db.execute('SELECT * FROM book_cards')} == \
+        {(None, None)}
+
+    # A category created for books that already point at its id fills in their cards
+    db.execute("INSERT INTO categories (category_id, category_name) VALUES (?, 'Sejarah')",
+               (shop_data['category_id'],))
+    db.commit()
+    assert cards(db) == rebuilt_cards(db)
+
+
+def test_rating_stats_reach_the_cards(db, shop_data):
+    book_id = shop_data['book_ids'][0]
+    db.execute('INSERT INTO book_rating_stats (book_id, rating_count, rating_sum, rating_avg, stars_4) '
+               'VALUES (?, 1, 4, 4.0, 1)', (book_id,))
+    db.commit()
+    assert tuple(db.execute('SELECT rating_avg, rating_count FROM book_cards WHERE book_id = ?',
+                            (book_id,)).fetchone()) == (4.0, 1)
+
+    reviews._adjust_stats(db, book_id, 4, -1)
+    db.commit()
+    assert tuple(db.execute('SELECT rating_avg, rating_count FROM book_cards WHERE book_id = ?',
+                            (book_id,)).fetchone()) == (0, 0)
+
+    db.execute('UPDATE book_rating_stats SET rating_count = 2, rating_sum = 10, rating_avg = 5.0 WHERE book_id = ?',
+               (book_id,))
+    db.execute('DELETE FROM book_rating_stats WHERE book_id = ?', (book_id,))
+    db.commit()
+    assert cards(db) == rebuilt_cards(db)
+
+
+def test_init_db_backfills_cards_of_existing_books(make_app, app, db, shop_data):
+    # As if the books were added before the projection existed
+    db.execute('DELETE FROM book_cards')
+    db.commit()
+    make_app()
+    assert cards(db) == rebuilt_cards(db)
+    assert len(cards(db)) == 2
+
+
+def facets(db):
+    return {tuple(row[:3]): row[3] for row in db.execute(
+        'SELECT category_id, price_band, in_stock, book_count FROM book_facets WHERE book_count != 0')}
+
+
+def rebuilt_facets(db):
+    # What the triggers must match: the counts taken from books
+    return {tuple(row[:3]): row[3] for row in db.execute(
+        f"SELECT {catalog._facet_key_sql('books')}, COUNT(*) FROM books GROUP BY 1, 2, 3")}
+
+
+def test_book_writes_update_the_facets(db, shop_data):
+    first, second = shop_data['book_ids']
+    category_id = shop_data['category_id']
+    assert facets(db) == {(category_id, 1, 1): 1, (category_id, 2, 1): 1}
+
+    db.execute('UPDATE books SET price = 250000, stock = 0 WHERE book_id = ?', (first,))
+    db.execute('UPDATE books SET category_id = NULL WHERE book_id = ?', (second,))
+    # Neither price, stock nor category; the counts stay
+    db.execute("UPDATE books SET book_name = 'Anak Semua Bangsa' WHERE book_id = ?", (second,))
+    db.execute('''
+        INSERT INTO books (category_id, shop_id, book_name, price, stock)
+        VALUES (?, ?, 'Tanpa Harga', NULL, 3)
+    ''', (category_id, shop_data['shop_id']))
+    db.commit()
+    assert facets(db) == rebuilt_facets(db) == \
+        {(category_id, 3, 0): 1, (0, 2, 1): 1, (category_id, catalog.NO_BAND, 1): 1}
+
+    db.execute('DELETE FROM books WHERE book_id = ?', (first,))
+    db.commit()
+    assert facets(db) == rebuilt_facets(db)
+
+
+def test_facet_counts_within_the_other_filters(db, shop_data):
+    other_category_id = db.execute(
+        "INSERT INTO categories (category_name) VALUES ('Anak') RETURNING category_id").fetchone()[0]
+    db.executemany('''
+        INSERT INTO books (category_id, shop_id, book_name, price, stock) VALUES (?, ?, 'Buku', ?, ?)
+    ''', [(other_category_id, shop_data['shop_id'], 60000, 0), (other_category_id, shop_data['shop_id'], 30000, 1)])
+    db.commit()
+
+    counts = catalog.facet_counts(db)
+    assert [(row['category_name'], row['count']) for row in counts['categories']] == [('Anak', 2), ('Fiction', 2)]
+    assert [band['count'] for band in counts['price_bands']] == [1, 2, 1, 0, 0]
+    assert (counts['in_stock'], counts['total']) == (3, 4)
+
+    counts = catalog.facet_counts(db, category_id=other_category_id, band=1, in_stock=True)
+    # Each facet counts within the filters of the others
+    assert [(row['category_name'], row['count']) for row in counts['categories']] == [('Anak', 0), ('Fiction', 1)]
+    assert [band['count'] for band in counts['price_bands']] == [1, 0, 0, 0, 0]
+    assert (counts['in_stock'], counts['total']) == (0, 1)
+
+    assert catalog.price_band(1) == (50000, 100000)
+    assert catalog.price_band(4) == (500000, None)
+    assert catalog.price_band(9) is None
@@ -0,0 +1,101 @@
+"""{% cache %} fragments: invalidated by bump_version(), or evicted by entity through the change feed."""
+import fragment_cache
+import invalidation
+
+
+def render(app, template, **context):
+    # Each render is a request of its own, so the data version is read afresh
+    with app.app_context():
+        return app.jinja_env.from_string(template).render(**context)
+
+
+def test_bump_version_invalidates_fragments(make_app):
+    app = make_app(CHANGE_FEED_ENABLED=False)
+    db = app.extensions['database'].connect()
+    template = '{% cache "greeting" %}Hello {{ name }}{% endcache %}'
+
+    assert render(app, template, name='Ani') == 'Hello Ani'
+    assert render(app, template, name='Budi') == 'Hello Ani'
+
+    fragment_cache.bump_version(db)
+    # Not committed yet; other requests still see the old version
+    assert render(app, template, name='Budi') == 'Hello Ani'
+    db.commit()
+    assert render(app, template, name='Budi') == 'Hello Budi'
+    assert render(app, template, name='Citra') == 'Hello Budi'
+
+    # Other names have versions of their own
+    fragment_cache.bump_version(db, 'reports')
+    db.commit()
+    assert render(app, template, name='Citra') == 'Hello Budi'
+    db.close()
+
+
+def test_version_is_read_once_per_request(make_app):
+    app = make_app(CHANGE_FEED_ENABLED=False)
+    db = app.extensions['database'].connect()
+    with app.app_context():
+        before = fragment_cache.current_version(db)
+        fragment_cache.bump_version(db)
+        db.commit()
+        assert fragment_cache.current_version(db) == before
+    with app.app_context():
+        assert fragment_cache.current_version(db) == before + 1
+    db.close()
+
+
+def test_evict_drops_only_dependent_fragments():
+    cache = fragment_cache.FragmentCache()
+    renders = []
+
+    def fragment(key, *tags):
+        def render():
+            renders.append(key)
+            for tag in tags:
+                cache.depends(*tag)
+            return key
+        return cache.get_or_render(key, None, render)
+
+    def show_all():
+        fragment('book-1', ('book', 1))
+        fragment('book-2', ('book', 2))
+        fragment('every-category', ('category',))
+        # The outer grid shows whatever its inner fragments show
+        fragment('grid', ('listing', 7))
+        cache.get_or_render('page', None, lambda: fragment('inner', ('book', 3)))
+
+    show_all()
+    renders.clear()
+    show_all()
+    assert renders == []
+
+    cache.evict('book', 1)
+    cache.evict('category', 5)
+    cache.evict('book', 3)
+    show_all()
+    assert renders == ['book-1', 'every-category', 'inner']
+
+    renders.clear()
+    cache.evict('listing', fragment_cache.ANY)
+    cache.evict('shop', 1)
+    show_all()
+    assert renders == ['grid']
+
+
+def test_change_feed_evicts_fragments_of_changed_books(app, db, shop_data):
+    first, second = shop_data['book_ids']
+    template = '{% cache "card-" ~ book_id %}{{ cache_depends("book", book_id) }}{{ name }}{% endcache %}'
+
+    def card(book_id, name):
+        # A request, so the worker polls the change feed first
+        with app.test_request_context():
+            app.preprocess_request()
+            return app.jinja_env.from_string(template).render(book_id=book_id, name=name)
+
+    assert card(first, 'old') == 'old'
+    assert card(second, 'old') == 'old'
+
+    invalidation.record(db, 'book', first)
+    db.commit()
+    assert card(first, 'new') == 'new'
+    assert card(second, 'new') == 'old'
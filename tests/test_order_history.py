@@ -0,0 +1,70 @@
+"""Keyset pages of a buyer's order history."""
+from urllib.parse import parse_qs, urlsplit
+
+import order_history
+
+# Two orders share each date, so order_id has to break the ties
+DATES = ['2024-01-01 10:00:00', '2024-01-01 10:00:00', '2024-02-01 09:00:00', '2024-02-01 09:00:00',
+         '2024-03-01 08:00:00']
+
+
+def place_orders(db, buyer_id, dates=DATES):
+    orders = [(date, db.execute("INSERT INTO orders (buyer_id, order_date, total, status) VALUES (?, ?, 1000, 'paid') "
+                                'RETURNING order_id', (buyer_id, date)).fetchone()[0]) for date in dates]
+    db.execute("INSERT INTO shipment (order_id, status) VALUES (?, 'Delivered')", (max(orders)[1],))
+    db.commit()
+    return [order_id for _, order_id in sorted(orders, reverse=True)]
+
+
+def pages(db, buyer_id, limit):
+    before, result = None, []
+    while True:
+        rows, before = order_history.list_orders(db, buyer_id, before=before, limit=limit)
+        result.append([row['order_id'] for row in rows])
+        if before is None:
+            return result
+
+
+def test_pages_walk_every_order_once_newest_first(db, shop_data):
+    newest_first = place_orders(db, shop_data['buyer_id'])
+    # Another buyer's orders never show up
+    place_orders(db, shop_data['buyer_id'] + 1)
+
+    assert pages(db, shop_data['buyer_id'], 2) == [newest_first[:2], newest_first[2:4], newest_first[4:]]
+    # A last page that is exactly full has no cursor after it
+    assert pages(db, shop_data['buyer_id'], 5) == [newest_first]
+    assert pages(db, shop_data['buyer_id'], 10) == [newest_first]
+    assert pages(db, shop_data['buyer_id'] + 2, 2) == [[]]
+
+    rows, _ = order_history.list_orders(db, shop_data['buyer_id'], limit=1)
+    assert (rows[0]['shipment_status'], rows[0]['item_count']) == ('Delivered', 0)
+
+
+def log_in(client, **values):
+    with client.session_transaction() as session:
+        session.update(values)
+
+
+def test_order_list_links_to_the_next_page(app, db, shop_data):
+    # One page and a bit
+    newest_first = place_orders(db, shop_data['buyer_id'], DATES * 5)
+    client = app.test_client()
+    log_in(client, user_id=shop_data['buyer_id'], role='buyer')
+
+    seen, url, page_count = [], '/orders', 0
+    while url:
+        page_count += 1
+        response = client.get(url)
+        assert response.status_code == 200
+        html = response.get_data(as_text=True)
+        seen.extend(order_id for order_id in newest_first if f'/orders/{order_id}"' in html)
+        next_links = [part.split('"', 1)[0] for part in html.split('href="')[1:] if 'before_id=' in part]
+        url = next_links[0].replace('&amp;', '&') if next_links else None
+        if url:
+            assert set(parse_qs(urlsplit(url).query)) == {'before_date', 'before_id'}
+    assert seen == newest_first
+    assert page_count == 2
+
+    # A cursor that does not parse starts over from the newest order
+    html = client.get('/orders?before_date=2024-02-01&before_id=abc').get_data(as_text=True)
+    assert f'/orders/{newest_first[0]}"' in html
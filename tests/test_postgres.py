@@ -0,0 +1,185 @@
+"""The request path end to end on PostgreSQL: schema, catalog read models, checkout and payment."""
+import pytest
+
+import leaderboards
+import notifications
+import outbound
+import reviews
+from database import SCHEMA_MODULES, init_pg_schema
+
+
+@pytest.fixture
+def app(make_app, pg_url):
+    app = make_app(DATABASE_URL=pg_url)
+    yield app
+    app.extensions['database'].pool().close()
+
+
+def log_in(client, **values):
+    with client.session_transaction() as session:
+        session.update(values)
+
+
+def columns(db, table):
+    return {row[0] for row in db.execute(
+        'SELECT column_name FROM information_schema.columns WHERE table_schema = current_schema() AND table_name = ?',
+        (table,))}
+
+
+class FakeResponse:
+    status_code = 200
+
+    def __init__(self, order_id):
+        self.order_id = order_id
+
+    def json(self):
+        return {'status': 'success',
+                'data': {'transaction_id': f'TX-{self.order_id}', 'payment_status': 'completed'}}
+
+
+def test_init_db_creates_every_table_and_is_idempotent(app, db):
+    tables = {row[0] for row in db.execute(
+        "SELECT table_name FROM information_schema.tables WHERE table_schema = current_schema()")}
+    assert {'book_cards', 'book_facets', 'book_rating_stats', 'stock_holds', 'outbox', 'book_sales_daily',
+            'leaderboard_dirty', 'order_events', 'change_log', 'data_versions', 'book_recommendations'} <= tables
+    assert 'version' in columns(db, 'books')
+    assert 'updated_at' in columns(db, 'cart')
+    assert all(hasattr(module, 'PG_SCHEMA') for module in SCHEMA_MODULES)
+
+    # A second worker starting up runs the same DDL over the existing schema
+    init_pg_schema(app.extensions['database'])
+    assert db.execute("SELECT version FROM data_versions WHERE name = 'catalog'").fetchone()[0] == 0
+
+
+def test_triggers_keep_book_cards_and_facets_in_step(db, shop_data):
+    book_id = shop_data['book_ids'][0]
+    card = db.execute('SELECT * FROM book_cards WHERE book_id = ?', (book_id,)).fetchone()
+    assert (card['book_name'], card['category_name'], card['shop_name']) == ('Laskar Pelangi', 'Fiction', 'Toko Buku')
+
+    db.execute('UPDATE books SET price = 250000, stock = 0 WHERE book_id = ?', (book_id,))
+    db.execute("UPDATE categories SET category_name = 'Novel' WHERE category_id = ?", (shop_data['category_id'],))
+    db.commit()
+    card = db.execute('SELECT price, stock, category_name FROM book_cards WHERE book_id = ?', (book_id,)).fetchone()
+    assert tuple(card) == (250000, 0, 'Novel')
+    facets = {(row['price_band'], row['in_stock']): row['book_count'] for row in db.execute(
+        'SELECT price_band, in_stock, book_count FROM book_facets WHERE category_id = ?',
+        (shop_data['category_id'],))}
+    assert facets == {(1, 1): 0, (2, 1): 1, (3, 0): 1}
+
+    db.execute('DELETE FROM books WHERE book_id = ?', (book_id,))
+    db.commit()
+    assert db.execute('SELECT 1 FROM book_cards WHERE book_id = ?', (book_id,)).fetchone() is None
+
+
+def test_browse_pages(app, shop_data):
+    client = app.test_client()
+    log_in(client, user_id=shop_data['buyer_id'], role='buyer')
+    assert client.get('/buyer_index').status_code == 200
+    assert client.get(f"/buyer_index?category={shop_data['category_id']}&band=1&in_stock=1").status_code == 200
+
+    facets = client.get('/books/facets?band=1').get_json()
+    assert facets['categories'] == [{'category_id': shop_data['category_id'], 'category_name': 'Fiction', 'count': 1}]
+    assert facets['total'] == 1
+
+    books = client.get('/api/v1/books?fields=book_name,price').get_json()['books']
+    assert [book['book_name'] for book in books] == ['Bumi Manusia', 'Laskar Pelangi']
+
+
+def test_checkout_and_payment(app, db, shop_data, monkeypatch):
+    monkeypatch.setattr(outbound, 'post', lambda url, json: FakeResponse(json['order_id']))
+    client = app.test_client()
+    log_in(client, user_id=shop_data['buyer_id'], role='buyer')
+    book_id = shop_data['book_ids'][0]
+
+    client.post(f'/add_to_cart/{book_id}')
+    client.post(f'/add_to_cart/{book_id}')
+    assert db.execute('SELECT quantity FROM stock_holds WHERE book_id = ?', (book_id,)).fetchone()[0] == 2
+    assert db.execute('SELECT updated_at FROM cart').fetchone()[0] is not None
+    assert client.get('/cart').status_code == 200
+
+    response = client.post('/checkout', data={'address': 'Jl. Sudirman 2'})
+    assert response.status_code == 302
+    order_id = int(response.headers['Location'].rsplit('/', 1)[1])
+    db.rollback()
+    assert db.execute('SELECT stock, version FROM books WHERE book_id = ?', (book_id,)).fetchone() == (3, 1)
+    assert db.execute('SELECT stock FROM book_cards WHERE book_id = ?', (book_id,)).fetchone()[0] == 3
+    assert db.execute("SELECT status FROM cart").fetchone()[0] == 'completed'
+    assert db.execute("SELECT version FROM data_versions WHERE name = 'catalog'").fetchone()[0] == 1
+    assert db.execute("SELECT entity_id FROM change_log WHERE entity = 'book'").fetchone()[0] == str(book_id)
+
+    response = client.post(f'/payment/{order_id}', data={'method': shop_data['method_id']})
+    assert response.status_code == 302
+    db.rollback()
+    assert db.execute('SELECT status FROM orders WHERE order_id = ?', (order_id,)).fetchone()[0] == 'paid'
+    assert db.execute('SELECT transaction_id FROM payments WHERE order_id = ?',
+                      (order_id,)).fetchone()[0] == f'TX-{order_id}'
+    assert db.execute('SELECT book_id, units FROM book_sales_daily').fetchall() == [(book_id, 2)]
+    assert db.execute('SELECT shop_id, status FROM outbox').fetchall() == [(shop_data['shop_id'], 'pending')]
+
+    assert leaderboards.refresh(db) == 3
+    assert [(row['book_id'], row['units']) for row in leaderboards.top_sellers(db, 'shop', shop_data['shop_id'])] \
+        == [(book_id, 2)]
+
+    sent = []
+    config = dict(app.config, NOTIFY_BATCH_SIZE=10)
+    assert notifications.dispatch_once(db, type('Transport', (), {'send': lambda self, m: sent.append(m)})(),
+                                       config) == (1, 0)
+    assert sent[0]['To'] == 'shop@example.com'
+    assert db.execute('SELECT status FROM outbox').fetchone()[0] == 'sent'
+
+    assert client.get('/orders').status_code == 200
+    log_in(client, shop_id=shop_data['shop_id'], role='shop')
+    assert client.get('/shop/dashboard').status_code == 200
+    assert client.get(f'/shop/detail_order/{order_id}').status_code == 200
+
+
+def test_bulk_edit(app, db, shop_data):
+    client = app.test_client()
+    log_in(client, shop_id=shop_data['shop_id'], role='shop')
+    first, second = shop_data['book_ids']
+    db.execute('UPDATE books SET stock = 9, version = version + 1 WHERE book_id = ?', (second,))
+    db.commit()
+
+    response = client.post('/shop/manage_books/bulk', json={'changes': [
+        {'book_id': first, 'version': 0, 'price': 80000},
+        {'book_id': second, 'version': 0, 'stock': 1},
+    ]})
+    assert response.status_code == 200
+    body = response.get_json()
+    assert body['updated'] == [{'book_id': first, 'version': 1}]
+    assert [conflict['book_id'] for conflict in body['conflicts']] == [second]
+    db.rollback()
+    assert db.execute('SELECT price FROM book_cards WHERE book_id = ?', (first,)).fetchone()[0] == 80000
+
+
+def test_reviews_update_the_rating_on_the_card(db, shop_data):
+    book_id = shop_data['book_ids'][0]
+    order_id = db.execute("INSERT INTO orders (buyer_id, status) VALUES (?, 'Shipped') RETURNING order_id",
+                          (shop_data['buyer_id'],)).fetchone()[0]
+    db.execute('INSERT INTO orderitems (order_id, book_id, shop_id, quantity) VALUES (?, ?, ?, 1)',
+               (order_id, book_id, shop_data['shop_id']))
+    db.execute("INSERT INTO shipment (order_id, status) VALUES (?, 'Delivered')", (order_id,))
+    db.commit()
+
+    review_id = reviews.add_review(db, shop_data['buyer_id'], book_id, 4, 'Bagus')
+    assert review_id is not None
+    card = db.execute('SELECT rating_avg, rating_count FROM book_cards WHERE book_id = ?', (book_id,)).fetchone()
+    assert tuple(card) == (4, 1)
+
+
+def test_add_and_edit_book(app, db, shop_data):
+    client = app.test_client()
+    log_in(client, shop_id=shop_data['shop_id'], role='shop')
+    form = {'book_name': 'Cantik Itu Luka', 'isbn': '9786020000001', 'author': 'Eka', 'desc': 'Novel',
+            'price': '95000', 'stock': '4', 'category_id': shop_data['category_id']}
+
+    assert client.post('/shop/add_book', data=form).status_code == 302
+    book_id = db.execute("SELECT book_id FROM books WHERE book_name = 'Cantik Itu Luka'").fetchone()[0]
+    assert db.execute("SELECT entity_id FROM change_log WHERE entity = 'listing'").fetchone()[0] == \
+        str(shop_data['category_id'])
+
+    assert client.post(f'/shop/edit_book/{book_id}', data=dict(form, desc='Roman', stock='6')).status_code == 302
+    db.rollback()
+    assert tuple(db.execute('SELECT "desc", stock, version FROM books WHERE book_id = ?',
+                            (book_id,)).fetchone()) == ('Roman', 6, 1)
+    assert db.execute('SELECT stock FROM book_cards WHERE book_id = ?', (book_id,)).fetchone()[0] == 6
@@ -0,0 +1,92 @@
+"""book_rating_stats kept in step with reviews by add, update and delete."""
+import pytest
+
+import reviews
+
+
+def deliver(db, shop_data, book_id):
+    order_id = db.execute("INSERT INTO orders (buyer_id, status) VALUES (?, 'Shipped') RETURNING order_id",
+                          (shop_data['buyer_id'],)).fetchone()[0]
+    db.execute('INSERT INTO orderitems (order_id, book_id, shop_id, quantity) VALUES (?, ?, ?, 1)',
+               (order_id, book_id, shop_data['shop_id']))
+    db.execute("INSERT INTO shipment (order_id, status) VALUES (?, 'Delivered')", (order_id,))
+    db.commit()
+
+
+def stats(db, book_id):
+    row = reviews.get_rating_stats(db, book_id)
+    return (row['rating_count'], row['rating_sum'], row['rating_avg'],
+            [row[f'stars_{stars}'] for stars in range(1, 6)])
+
+
+def recount(db, book_id):
+    # What the incremental stats must match: a full aggregate over reviews
+    row = db.execute('SELECT COUNT(*), COALESCE(SUM(rating), 0), AVG(rating) FROM reviews WHERE book_id = ?',
+                     (book_id,)).fetchone()
+    stars = [db.execute('SELECT COUNT(*) FROM reviews WHERE book_id = ? AND rating = ?',
+                        (book_id, rating)).fetchone()[0] for rating in range(1, 6)]
+    return (row[0], row[1], row[2], stars)
+
+
+def test_add_update_and_delete_keep_the_stats_in_step(db, shop_data):
+    book_id = shop_data['book_ids'][0]
+    buyer_id = shop_data['buyer_id']
+    deliver(db, shop_data, book_id)
+    deliver(db, shop_data, book_id)
+
+    first = reviews.add_review(db, buyer_id, book_id, 5, 'Bagus sekali')
+    second = reviews.add_review(db, buyer_id, book_id, 2, 'Kurang')
+    assert stats(db, book_id) == (2, 7, 3.5, [0, 1, 0, 0, 1]) == recount(db, book_id)
+    assert tuple(db.execute('SELECT rating_avg, rating_count FROM book_cards WHERE book_id = ?',
+                            (book_id,)).fetchone()) == (3.5, 2)
+
+    reviews.update_review(db, second, buyer_id, 4, 'Lumayan')
+    assert stats(db, book_id) == (2, 9, 4.5, [0, 0, 0, 1, 1]) == recount(db, book_id)
+
+    # Only the comment changes; the stats stay as they are
+    reviews.update_review(db, second, buyer_id, 4, 'Lumayan bagus')
+    assert stats(db, book_id) == (2, 9, 4.5, [0, 0, 0, 1, 1])
+
+    reviews.delete_review(db, first, buyer_id)
+    assert stats(db, book_id) == (1, 4, 4.0, [0, 0, 0, 1, 0]) == recount(db, book_id)
+
+    reviews.delete_review(db, second, buyer_id)
+    assert stats(db, book_id) == (0, 0, None, [0, 0, 0, 0, 0])
+    assert db.execute("SELECT version FROM data_versions WHERE name = 'catalog'").fetchone()[0] == 5
+
+
+def test_rejected_reviews_leave_the_stats_alone(db, shop_data):
+    book_id, other_book_id = shop_data['book_ids']
+    buyer_id = shop_data['buyer_id']
+    deliver(db, shop_data, book_id)
+
+    with pytest.raises(reviews.ReviewError):
+        reviews.add_review(db, buyer_id, other_book_id, 5, 'Not delivered')
+    with pytest.raises(reviews.ReviewError):
+        reviews.add_review(db, buyer_id, book_id, 6, 'Out of range')
+
+    review_id = reviews.add_review(db, buyer_id, book_id, 3, 'Biasa')
+    # The one delivered item is reviewed already
+    with pytest.raises(reviews.ReviewError):
+        reviews.add_review(db, buyer_id, book_id, 5, 'Again')
+    # Someone else's review
+    with pytest.raises(reviews.ReviewError):
+        reviews.update_review(db, review_id, buyer_id + 1, 1, 'Not mine')
+    with pytest.raises(reviews.ReviewError):
+        reviews.delete_review(db, review_id, buyer_id + 1)
+
+    assert stats(db, book_id) == (1, 3, 3.0, [0, 0, 1, 0, 0])
+    assert reviews.get_rating_stats(db, other_book_id) is None
+
+
+def test_review_pages(db, shop_data):
+    book_id = shop_data['book_ids'][0]
+    for _ in range(3):
+        deliver(db, shop_data, book_id)
+    review_ids = [reviews.add_review(db, shop_data['buyer_id'], book_id, rating, '') for rating in (1, 2, 3)]
+
+    page, cursor = reviews.list_reviews(db, book_id, limit=2)
+    assert [row['review_id'] for row in page] == review_ids[:0:-1]
+    page, cursor = reviews.list_reviews(db, book_id, before=cursor, limit=2)
+    assert [row['review_id'] for row in page] == review_ids[:1]
+    assert cursor is None
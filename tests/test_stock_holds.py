@@ -0,0 +1,98 @@
+"""Stock holds: reservations for open carts, their expiry, and turning them into a sale."""
+import time
+
+import pytest
+
+import stock_holds
+
+TTL = 600
+
+
+@pytest.fixture
+def context(app):
+    with app.app_context():
+        yield
+
+
+def expire(db, cart_id):
+    db.execute('UPDATE stock_holds SET expires_at = ? WHERE cart_id = ?', (time.time() - 1, cart_id))
+    db.commit()
+
+
+def rows(db, sql, params=()):
+    return [tuple(row) for row in db.execute(sql, params)]
+
+
+def holds(db):
+    return rows(db, 'SELECT cart_id, book_id, quantity FROM stock_holds ORDER BY cart_id, book_id')
+
+
+def test_holds_never_oversell(db, shop_data):
+    book_id = shop_data['book_ids'][1]  # two in stock
+
+    assert stock_holds.hold(db, 1, book_id, 3, TTL) is None
+    assert stock_holds.hold(db, 1, book_id, 2, TTL) is not None
+    assert stock_holds.hold(db, 2, book_id, 1, TTL) is None
+    assert (stock_holds.available(db, book_id), stock_holds.available(db, book_id, cart_id=1)) == (0, 2)
+
+    # A cart's hold is replaced, not added to
+    assert stock_holds.hold(db, 1, book_id, 1, TTL) is not None
+    assert stock_holds.hold(db, 2, book_id, 1, TTL) is not None
+    db.commit()
+    assert holds(db) == [(1, book_id, 1), (2, book_id, 1)]
+    # books.stock is left alone until checkout
+    assert db.execute('SELECT stock FROM books WHERE book_id = ?', (book_id,)).fetchone()[0] == 2
+
+
+def test_expired_holds_free_the_stock(db, shop_data):
+    book_id = shop_data['book_ids'][1]
+    stock_holds.hold(db, 1, book_id, 2, TTL)
+    db.commit()
+
+    expire(db, 1)
+    assert stock_holds.available(db, book_id) == 2
+    assert stock_holds.hold(db, 2, book_id, 2, TTL) is not None
+    db.commit()
+
+    assert stock_holds.sweep(db) == 1
+    assert stock_holds.sweep(db, now=time.time() + TTL + 1) == 1
+    assert holds(db) == []
+
+
+def test_hold_moves_the_carts_other_holds_forward(db, shop_data):
+    first, second = shop_data['book_ids']
+    stock_holds.hold(db, 1, first, 1, 10)
+    expires_at = stock_holds.hold(db, 1, second, 1, TTL)
+    assert rows(db, 'SELECT expires_at FROM stock_holds WHERE cart_id = 1') == [(expires_at,), (expires_at,)]
+
+
+def test_convert_takes_the_stock_and_releases_the_holds(context, db, shop_data):
+    first, second = shop_data['book_ids']
+    stock_holds.hold(db, 1, first, 2, TTL)
+    stock_holds.hold(db, 1, second, 1, TTL)
+    db.commit()
+    # An expired hold is taken again while the stock is still there
+    expire(db, 1)
+
+    assert stock_holds.convert(db, 1, [(first, 2), (second, 1)]) == []
+    db.commit()
+    assert rows(db, 'SELECT book_id, stock, version FROM books ORDER BY book_id') == \
+        [(first, 3, 1), (second, 1, 1)]
+    assert db.execute('SELECT stock FROM book_cards WHERE book_id = ?', (first,)).fetchone()[0] == 3
+    assert holds(db) == []
+
+
+def test_convert_reports_a_shortfall_without_taking_stock(context, db, shop_data):
+    first, second = shop_data['book_ids']
+    stock_holds.hold(db, 1, first, 1, TTL)
+    stock_holds.hold(db, 1, second, 2, TTL)
+    db.commit()
+    # Another cart takes the second book once the hold has run out
+    expire(db, 1)
+    stock_holds.hold(db, 2, second, 1, TTL)
+    db.commit()
+
+    assert stock_holds.convert(db, 1, [(first, 1), (second, 2)]) == [second]
+    db.rollback()
+    assert rows(db, 'SELECT stock, version FROM books ORDER BY book_id') == [(5, 0), (2, 0)]
+    assert holds(db) == [(1, first, 1), (1, second, 2), (2, second, 1)]
@@ -0,0 +1,114 @@
+"""Cache of shipment tracking lookups from the shipment service.
+
+Entries live for a status-dependent TTL: a delivered shipment never changes
+again, one in transit may change at any time. Concurrent lookups of the
+same tracking number wait for the one upstream call already in flight
+instead of making their own.
+"""
+import threading
+import time
+from collections import OrderedDict
+
+from flask import current_app
+
+SCHEMA = '''
+CREATE INDEX IF NOT EXISTS idx_shipment_tracking_no ON shipment (tracking_no);
+'''
+
+PG_SCHEMA = SCHEMA
+
+MAX_ENTRIES = 10000
+
+
+class _Call:
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+        self.stale = False
+
+
+class TrackingCache:
+    def __init__(self, config):
+        self.enabled = config['TRACKING_CACHE_ENABLED']
+        self.ttls = {'Delivered': config['TRACKING_TTL_DELIVERED']}
+        self.default_ttl = config['TRACKING_TTL_IN_TRANSIT']
+        self.max_entries = MAX_ENTRIES
+        self.stats = {'hits': 0, 'coalesced': 0, 'upstream': 0}
+        self._entries = OrderedDict()
+        self._calls = {}
+        self._lock = threading.Lock()
+
+    def _ttl(self, response):
+        status = response.get('shipment_data', {}).get('status')
+        return self.ttls.get(status, self.default_ttl)
+
+    def get(self, tracking_no, fetch):
+        """Return fetch()'s tracking response for tracking_no, cached or shared."""
+        if not self.enabled:
+            with self._lock:
+                self.stats['upstream'] += 1
+            return fetch()
+
+        with self._lock:
+            entry = self._entries.get(tracking_no)
+            if entry and entry[0] > time.monotonic():
+                self._entries.move_to_end(tracking_no)
+                self.stats['hits'] += 1
+                return entry[1]
+            call = self._calls.get(tracking_no)
+            leader = call is None
+            if leader:
+                call = self._calls[tracking_no] = _Call()
+                self.stats['upstream'] += 1
+            else:
+                self.stats['coalesced'] += 1
+
+        if not leader:
+            call.done.wait()
+            if call.error:
+                raise call.error
+            return call.result
+
+        try:
+            call.result = fetch()
+        except Exception as e:
+            call.error = e
+            raise
+        finally:
+            with self._lock:
+                del self._calls[tracking_no]
+                # Only successful lookups are cached; errors are retried by the next request
+                if not call.stale and isinstance(call.result, dict) and call.result.get('status') == 'success':
+                    self._entries[tracking_no] = (time.monotonic() + self._ttl(call.result), call.result)
+                    self._entries.move_to_end(tracking_no)
+                    while len(self._entries) > self.max_entries:
+                        self._entries.popitem(last=False)
+            call.done.set()
+        return call.result
+
+    def on_change(self, tracking_no):
+        # Change-feed handler; None means every entry may be stale
+        if tracking_no is None:
+            with self._lock:
+                self._entries.clear()
+                for call in self._calls.values():
+                    call.stale = True
+        else:
+            self.invalidate(tracking_no)
+
+    def invalidate(self, tracking_no):
+        with self._lock:
+            self._entries.pop(tracking_no, None)
+            call = self._calls.get(tracking_no)
+            if call:
+                # The lookup in flight may have read the old state; do not cache it
+                call.stale = True
+
+
+def init_app(app):
+    app.extensions['tracking_cache'] = TrackingCache(app.config)
+
+
+def get_tracking_cache():
+    return current_app.extensions['tracking_cache']
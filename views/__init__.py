@@ -0,0 +1,12 @@
+from database import get_db
+
+
+def format_currency(value):
+    if value is None:
+        return "Rp0"  # Atau format default lainnya
+    return f'Rp{value:,.0f}'.replace(',', '.')
+
+
+def load_categories():
+    # Template global, so cached fragments only query categories on a miss
+    return get_db().execute('SELECT category_id, category_name FROM categories ORDER BY category_name').fetchall()
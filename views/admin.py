@@ -0,0 +1,118 @@
+import os
+
+from flask import (Blueprint, render_template, redirect, url_for, flash, session, current_app, jsonify,
+                   send_from_directory)
+
+import credentials
+import invalidation
+import profiling
+import reporting
+from database import get_db, get_report_db
+
+bp = Blueprint('admin', __name__)
+
+
+@bp.route('/admin/login', methods=['GET', 'POST'])
+def admin_login():
+    from forms import LoginForm
+
+    form = LoginForm()
+    if form.validate_on_submit():
+        admin_name = form.username.data
+        password = form.password.data
+
+        db = get_db()
+        cur = db.execute('SELECT * FROM admin WHERE admin_name = ?', (admin_name,))
+        admin = cur.fetchone()
+
+        try:
+            if credentials.check_login(f'admin:{admin_name}', admin['password'] if admin else None, password):
+                credentials.rehash_if_needed(db, 'admin', 'admin_id', admin['admin_id'], admin['password'], password)
+                session['admin_id'] = admin['admin_id']
+                session['admin_name'] = admin['admin_name']
+                session['role'] = 'admin'
+                flash('Admin login successful!', 'success')
+                return redirect(url_for('admin.admin_dashboard'))
+            else:
+                flash('Invalid admin name or password.', 'danger')
+        except credentials.CredentialError as e:
+            flash(str(e), 'danger')
+
+    return render_template('admin/admin_login.html', form=form)
+
+
+@bp.route('/admin/dashboard')
+def admin_dashboard():
+    if 'admin_id' not in session:
+        flash('You must be logged in as an admin to access this page.', 'danger')
+        return redirect(url_for('admin.admin_login'))
+
+    db = get_db()
+    buyers = db.execute('SELECT * FROM buyer').fetchall()
+    shops = db.execute('SELECT * FROM shop').fetchall()
+    return render_template('admin/admin_dashboard.html', buyers=buyers, shops=shops)
+
+
+@bp.route('/admin/reporting/status')
+def reporting_status():
+    if 'admin_id' not in session:
+        flash('You must be logged in as an admin to access this page.', 'danger')
+        return redirect(url_for('admin.admin_login'))
+
+    taken_at, age_seconds = reporting.snapshot_status(get_report_db())
+    return jsonify({'snapshot_taken_at': taken_at, 'staleness_seconds': age_seconds,
+                    'refresh_interval_seconds': current_app.config['ANALYTICS_SNAPSHOT_INTERVAL']})
+
+
+@bp.route('/admin/profiles')
+def profiles():
+    if 'admin_id' not in session:
+        flash('You must be logged in as an admin to access this page.', 'danger')
+        return redirect(url_for('admin.admin_login'))
+
+    return render_template('admin/profiles.html', enabled=current_app.config['PROFILING_ENABLED'],
+                           profiles=profiling.recent_profiles(current_app.config['PROFILE_DIR']))
+
+
+@bp.route('/admin/profiles/<name>.folded')
+def profile_stacks(name):
+    if 'admin_id' not in session:
+        flash('You must be logged in as an admin to access this page.', 'danger')
+        return redirect(url_for('admin.admin_login'))
+
+    return send_from_directory(os.path.abspath(current_app.config['PROFILE_DIR']), f'{name}.folded',
+                               mimetype='text/plain', as_attachment=True)
+
+
+@bp.route('/admin/delete/<user_type>/<int:user_id>', methods=['POST'])
+def admin_delete(user_type, user_id):
+    if 'admin_id' not in session:
+        flash('You must be logged in as an admin to perform this action.', 'danger')
+        return redirect(url_for('admin.admin_login'))
+
+    db = get_db()
+    if user_type == 'buyer':
+        db.execute('DELETE FROM buyer WHERE buyer_id = ?', (user_id,))
+    elif user_type == 'shop':
+        db.execute('DELETE FROM shop WHERE shop_id = ?', (user_id,))
+    else:
+        flash('Invalid user type.', 'danger')
+        return redirect(url_for('admin.admin_dashboard'))
+
+    db.commit()
+    flash(f'{user_type.capitalize()} deleted successfully.', 'success')
+    return redirect(url_for('admin.admin_dashboard'))
+
+
+@bp.route('/admin/verify_shop/<int:shop_id>', methods=['POST'])
+def verify_shop(shop_id):
+    if 'admin_id' not in session:
+        flash('You must be logged in as an admin to perform this action.', 'danger')
+        return redirect(url_for('admin.admin_login'))
+
+    db = get_db()
+    db.execute('UPDATE shop SET isverified = 1 WHERE shop_id = ?', (shop_id,))
+    invalidation.record(db, 'shop', shop_id)
+    db.commit()
+    flash('Shop verified successfully.', 'success')
+    return redirect(url_for('admin.admin_dashboard'))
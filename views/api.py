@@ -0,0 +1,119 @@
+import json
+
+from flask import Blueprint, Response, request
+
+from database import get_db
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+bp = Blueprint('api', __name__, url_prefix='/api/v1')
+
+# Columns of book_cards a client may ask for with fields=; book_id is always included
+BOOK_FIELDS = ('book_id', 'book_name', 'author', 'isbn', 'price', 'stock', 'img_url', 'category_id',
+               'category_name', 'shop_id', 'shop_name', 'rating_avg', 'rating_count')
+DEFAULT_LIMIT = 50
+MAX_LIMIT = 200
+MAX_IDS = 100
+
+
+def dumps(payload):
+    if orjson is not None:
+        return orjson.dumps(payload)
+    return json.dumps(payload, separators=(',', ':'), ensure_ascii=False).encode()
+
+
+def json_response(payload, status=200):
+    # The ETag is the body's hash, so an unchanged page is answered with an empty 304
+    response = Response(dumps(payload), status=status, mimetype='application/json')
+    if status == 200:
+        response.add_etag()
+        response.headers['Cache-Control'] = 'no-cache'
+        return response.make_conditional(request)
+    return response
+
+
+def error(message, status):
+    return json_response({'status': 'error', 'message': message}, status)
+
+
+def _columns():
+    fields = request.args.get('fields')
+    if not fields:
+        return list(BOOK_FIELDS)
+    requested = [field.strip() for field in fields.split(',') if field.strip()]
+    unknown = sorted(set(requested) - set(BOOK_FIELDS))
+    if unknown:
+        raise ValueError(f"Unknown fields: {', '.join(unknown)}")
+    return ['book_id'] + [field for field in dict.fromkeys(requested) if field != 'book_id']
+
+
+def _ids(value):
+    try:
+        ids = [int(part) for part in value.split(',') if part.strip()]
+    except ValueError:
+        raise ValueError('ids must be comma-separated book ids') from None
+    if not ids or len(ids) > MAX_IDS:
+        raise ValueError(f'ids takes 1 to {MAX_IDS} book ids')
+    return list(dict.fromkeys(ids))
+
+
+def _cursor(value):
+    # A cursor that does not parse must not quietly restart the client at the first page
+    if value is None:
+        return None
+    try:
+        return int(value)
+    except ValueError:
+        raise ValueError('cursor must be the next_cursor of a previous page') from None
+
+
+@bp.route('/books')
+def list_books():
+    """Books newest first, a page at a time, or the books named in ids= in that order."""
+    try:
+        columns = _columns()
+        select = ', '.join(columns)
+        ids = request.args.get('ids')
+        if ids is not None:
+            ids = _ids(ids)
+            rows = get_db().execute(f"SELECT {select} FROM book_cards WHERE book_id IN ({', '.join('?' * len(ids))})",
+                                    ids).fetchall()
+            by_id = {row['book_id']: dict(row) for row in rows}
+            return json_response({'books': [by_id[book_id] for book_id in ids if book_id in by_id],
+                                  'missing': [book_id for book_id in ids if book_id not in by_id]})
+
+        limit = min(max(request.args.get('limit', DEFAULT_LIMIT, type=int), 1), MAX_LIMIT)
+        cursor = _cursor(request.args.get('cursor'))
+        category_id = request.args.get('category', type=int)
+    except ValueError as e:
+        return error(str(e), 400)
+
+    # Keyset on book_id, so every page is one range scan of the table
+    where, params = [], []
+    if cursor is not None:
+        where.append('book_id < ?')
+        params.append(cursor)
+    if category_id is not None:
+        where.append('category_id = ?')
+        params.append(category_id)
+    where_sql = 'WHERE ' + ' AND '.join(where) if where else ''
+    rows = get_db().execute(f'SELECT {select} FROM book_cards {where_sql} ORDER BY book_id DESC LIMIT ?',
+                            params + [limit + 1]).fetchall()
+    books = [dict(row) for row in rows[:limit]]
+    next_cursor = books[-1]['book_id'] if len(rows) > limit else None
+    return json_response({'books': books, 'next_cursor': next_cursor})
+
+
+@bp.route('/books/<int:book_id>')
+def get_book(book_id):
+    try:
+        columns = _columns()
+    except ValueError as e:
+        return error(str(e), 400)
+    row = get_db().execute(f"SELECT {', '.join(columns)} FROM book_cards WHERE book_id = ?", (book_id,)).fetchone()
+    if row is None:
+        return error('Book not found.', 404)
+    return json_response(dict(row))
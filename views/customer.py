@@ -0,0 +1,553 @@
+import time
+
+from flask import Blueprint, render_template, request, redirect, url_for, flash, session, current_app, jsonify
+
+import catalog
+import credentials
+import events
+import fragment_cache
+import invalidation
+import leaderboards
+import notifications
+import order_history
+import outbound
+import queries
+import recommendations
+import reviews
+import stock_holds
+from backends import DB_ERRORS, INTEGRITY_ERRORS
+from database import get_db
+from views import format_currency
+
+bp = Blueprint('customer', __name__)
+
+
+@bp.route('/')
+def index():
+    template = 'customer/index.html'
+    facets = None
+    if session.get('role') == 'buyer':
+        template = 'customer/buyer_index.html'
+        facets = catalog.facet_counts(get_db())
+    elif session.get('role') == 'shop':
+        template = 'shop/shop_index.html'
+    return render_template(template, books=[], load_books=list, facets=facets, format_currency=format_currency)
+
+
+# Sort orders offered by the book listings; each one has a covering index on book_cards
+BOOK_SORTS = {
+    'date_desc': 'book_id DESC',
+    'price_asc': 'price ASC',
+    'price_desc': 'price DESC',
+    'rating_desc': 'rating_avg DESC, rating_count DESC',
+}
+
+
+@bp.route('/buyer_index', methods=['GET'])
+def buyer_index():
+    if 'user_id' not in session:
+        flash('You need to be logged in to access the buyer index.', 'warning')
+        return redirect(url_for('customer.login'))
+
+    order_by = BOOK_SORTS.get(request.args.get('sort'), BOOK_SORTS['date_desc'])
+    category_id = request.args.get('category', type=int)
+    band = request.args.get('band', type=int)
+    in_stock = request.args.get('in_stock') == '1'
+
+    # Filters match the leading columns of the book_cards indexes
+    where, params = [], []
+    if category_id is not None:
+        where.append('category_id = ?')
+        params.append(category_id)
+    price_range = catalog.price_band(band)
+    if price_range:
+        where.append('price >= ?')
+        params.append(price_range[0])
+        if price_range[1] is not None:
+            where.append('price < ?')
+            params.append(price_range[1])
+    if in_stock:
+        where.append('stock > 0')
+    where_sql = 'WHERE ' + ' AND '.join(where) if where else ''
+
+    def load_books():
+        # Only runs when the cached book grid fragment has to be re-rendered
+        return get_db().execute(f'''
+            SELECT book_id, book_name, author, img_url, category_name, price, rating_avg, rating_count
+            FROM book_cards
+            {where_sql}
+            ORDER BY {order_by}
+        ''', params).fetchall()
+
+    facets = catalog.facet_counts(get_db(), category_id, band, in_stock)
+    if category_id is None:
+        top_sellers = leaderboards.top_sellers(get_db(), 'all', 0, window_days=7, limit=5)
+    else:
+        top_sellers = leaderboards.top_sellers(get_db(), 'category', category_id, window_days=7, limit=5)
+    return render_template('customer/buyer_index.html', load_books=load_books, facets=facets,
+                           top_sellers=top_sellers, format_currency=format_currency)
+
+
+@bp.route('/books/facets')
+def book_facets():
+    return jsonify(catalog.facet_counts(get_db(), request.args.get('category', type=int),
+                                        request.args.get('band', type=int), request.args.get('in_stock') == '1'))
+
+
+@bp.route('/register', methods=['GET', 'POST'])
+def register():
+    from forms import RegisterForm
+
+    form = RegisterForm()
+    if form.validate_on_submit():
+        username = form.username.data
+        dob = form.dob.data
+        email = form.email.data
+        phone_number = form.phone_number.data
+        password = form.password.data
+        buyer_address = form.buyer_address.data
+
+        try:
+            hashed_password = credentials.hash_password(password)
+            db = get_db()
+            db.execute('''INSERT INTO buyer (username, dob, email, phone_number, password, buyer_address) 
+                          VALUES (?, ?, ?, ?, ?, ?)''',
+                       (username, dob, email, phone_number, hashed_password, buyer_address))
+            db.commit()
+            flash('You have successfully registered! Please log in.', 'success')
+            return redirect(url_for('customer.login'))
+        except INTEGRITY_ERRORS:
+            flash('Username or email already exists.', 'danger')
+        except credentials.CredentialError as e:
+            flash(str(e), 'danger')
+        except Exception as e:
+            flash(f'An error occurred: {e}', 'danger')
+
+    return render_template('customer/register.html', form=form)
+
+
+@bp.route('/login', methods=['GET', 'POST'])
+def login():
+    from forms import LoginForm
+
+    form = LoginForm()
+    if form.validate_on_submit():
+        username = form.username.data
+        password = form.password.data
+
+        db = get_db()
+        cur = db.execute('SELECT * FROM buyer WHERE username = ?', (username,))
+        user = cur.fetchone()
+
+        try:
+            if credentials.check_login(f'buyer:{username}', user['password'] if user else None, password):
+                credentials.rehash_if_needed(db, 'buyer', 'buyer_id', user['buyer_id'], user['password'], password)
+                session['user_id'] = user['buyer_id']
+                session['username'] = user['username']
+                session['role'] = 'buyer'
+                flash('Login successful!', 'success')
+                return redirect(url_for('customer.buyer_index'))
+            else:
+                flash('Invalid username or password.', 'danger')
+        except credentials.CredentialError as e:
+            flash(str(e), 'danger')
+
+    return render_template('customer/login.html', form=form)
+
+
+@bp.route('/logout')
+def logout():
+    verification_message = session.pop('verification_message', None)
+    session.clear()
+    if verification_message:
+        flash('verification_message', 'danger')
+    else:
+        flash('You have been logged out.', 'success')
+    return redirect(url_for('customer.index'))
+
+
+@bp.route('/book/<int:book_id>')
+def book(book_id):
+    from forms import ReviewForm
+
+    try:
+        db = get_db()
+        cur = db.execute('''
+            SELECT books.*, book_cards.category_name
+            FROM books
+            LEFT JOIN book_cards ON book_cards.book_id = books.book_id
+            WHERE books.book_id = ?
+        ''', (book_id,))
+        book = cur.fetchone()
+        category_name = None
+        if book and book['category_id']:
+            category_name = book['category_name'] or "No category"
+
+        rating_stats = reviews.get_rating_stats(db, book_id)
+        book_reviews, next_cursor = reviews.list_reviews(db, book_id, before=request.args.get('before', type=int))
+        review_form = None
+        can_review = False
+        if session.get('role') == 'buyer':
+            review_form = ReviewForm()
+            can_review = reviews.reviewable_order_item(db, session['user_id'], book_id) is not None
+        also_bought = recommendations.get_recommendations(db, book_id)
+        return render_template('customer/book.html', book=book, category_name=category_name,
+                               rating_stats=rating_stats, reviews=book_reviews, next_cursor=next_cursor,
+                               review_form=review_form, can_review=can_review, also_bought=also_bought,
+                               format_currency=format_currency)
+    except Exception as e:
+        flash(f'An error occurred: {e}', 'danger')
+        return redirect(url_for('customer.index'))
+
+
+@bp.route('/book/<int:book_id>/review', methods=['POST'])
+def add_review(book_id):
+    from forms import ReviewForm
+
+    if session.get('role') != 'buyer':
+        flash('You need to be logged in as a buyer to review a book.', 'warning')
+        return redirect(url_for('customer.login'))
+
+    form = ReviewForm()
+    if form.validate_on_submit():
+        try:
+            reviews.add_review(get_db(), session['user_id'], book_id, form.rating.data, form.comment.data)
+            flash('Thank you for your review!', 'success')
+        except reviews.ReviewError as e:
+            flash(str(e), 'danger')
+    else:
+        flash('Please choose a rating between 1 and 5.', 'danger')
+
+    return redirect(url_for('customer.book', book_id=book_id))
+
+
+@bp.route('/review/<int:review_id>/edit', methods=['POST'])
+def edit_review(review_id):
+    from forms import ReviewForm
+
+    if session.get('role') != 'buyer':
+        flash('You need to be logged in as a buyer to edit a review.', 'warning')
+        return redirect(url_for('customer.login'))
+
+    form = ReviewForm()
+    if not form.validate_on_submit():
+        flash('Please choose a rating between 1 and 5.', 'danger')
+        return redirect(request.referrer or url_for('customer.buyer_index'))
+
+    try:
+        book_id = reviews.update_review(get_db(), review_id, session['user_id'], form.rating.data, form.comment.data)
+        flash('Your review has been updated.', 'success')
+        return redirect(url_for('customer.book', book_id=book_id))
+    except reviews.ReviewError as e:
+        flash(str(e), 'danger')
+    return redirect(url_for('customer.buyer_index'))
+
+
+@bp.route('/review/<int:review_id>/delete', methods=['POST'])
+def delete_review(review_id):
+    if session.get('role') != 'buyer':
+        flash('You need to be logged in as a buyer to delete a review.', 'warning')
+        return redirect(url_for('customer.login'))
+
+    try:
+        book_id = reviews.delete_review(get_db(), review_id, session['user_id'])
+        flash('Your review has been deleted.', 'success')
+        return redirect(url_for('customer.book', book_id=book_id))
+    except reviews.ReviewError as e:
+        flash(str(e), 'danger')
+    return redirect(url_for('customer.buyer_index'))
+
+
+@bp.route('/add_to_cart/<int:book_id>', methods=['POST'])
+def add_to_cart(book_id):
+    if 'user_id' not in session:
+        flash('You need to be logged in to add items to the cart.', 'warning')
+        return redirect(url_for('customer.login'))
+
+    try:
+        db = get_db()
+        cur = db.execute('SELECT * FROM books WHERE book_id = ?', (book_id,))
+        book = cur.fetchone()
+
+        if book:
+            # Check if there is an existing open cart for the user
+            cart_cur = db.execute('SELECT cart_id FROM cart WHERE buyer_id = ? AND status = ?',
+                                  (session['user_id'], 'open'))
+            cart_id = cart_cur.fetchone()
+
+            # If no open cart exists, create a new one
+            if not cart_id:
+                cart_id = queries.run(db, 'create_cart', buyer_id=session['user_id']).fetchone()
+            else:
+                queries.run(db, 'touch_cart', cart_id=cart_id['cart_id'])
+
+            # Check if the book is already in the cart
+            cur = db.execute(
+                'SELECT * FROM cartitems WHERE cart_id = ? AND book_id = ?',
+                (cart_id['cart_id'], book_id)
+            )
+            item = cur.fetchone()
+
+            quantity = item['quantity'] + 1 if item else 1
+            if stock_holds.hold_for_cart(db, cart_id['cart_id'], book_id, quantity) is None:
+                db.rollback()
+                left = stock_holds.available(db, book_id, cart_id['cart_id'])
+                flash(f"Only {left} copies of {book['book_name']} are available." if left
+                      else f"{book['book_name']} is sold out.", 'warning')
+                return redirect(url_for('customer.buyer_index'))
+
+            if item:
+                db.execute('UPDATE cartitems SET quantity = quantity + 1 WHERE cart_item_id = ?',
+                           (item['cart_item_id'],))
+            else:
+                db.execute('INSERT INTO cartitems (cart_id, book_id, quantity) VALUES (?, ?, ?)',
+                           (cart_id['cart_id'], book_id, 1))
+
+            db.commit()
+            flash('Book added to cart!', 'success')
+        else:
+            flash('Book not found.', 'danger')
+
+        return redirect(url_for('customer.buyer_index'))
+    except Exception as e:
+        flash(f'An error occurred: {e}', 'danger')
+        return redirect(url_for('customer.buyer_index'))
+
+
+@bp.route('/orders')
+def order_list():
+    if session.get('role') != 'buyer':
+        flash('You need to be logged in as a buyer to view your orders.', 'warning')
+        return redirect(url_for('customer.login'))
+
+    before_date = request.args.get('before_date')
+    before_id = request.args.get('before_id', type=int)
+    before = (before_date, before_id) if before_date and before_id is not None else None
+    orders, next_cursor = order_history.list_orders(get_db(), session['user_id'], before=before)
+    return render_template('customer/orders.html', orders=orders, next_cursor=next_cursor,
+                           format_currency=format_currency)
+
+
+@bp.route('/orders/<int:order_id>')
+def order_detail(order_id):
+    if session.get('role') != 'buyer':
+        flash('You need to be logged in as a buyer to view your orders.', 'warning')
+        return redirect(url_for('customer.login'))
+
+    order, items, shipments = order_history.get_order(get_db(), session['user_id'], order_id)
+    if not order:
+        flash('Order not found.', 'danger')
+        return redirect(url_for('customer.order_list'))
+    return render_template('customer/order_detail.html', order=order, items=items, shipments=shipments,
+                           format_currency=format_currency)
+
+
+@bp.route('/cart')
+def cart():
+    if 'user_id' not in session:
+        flash('You need to be logged in to view your cart.', 'warning')
+        return redirect(url_for('customer.login'))
+
+    try:
+        db = get_db()
+        cur = db.execute('''
+            SELECT b.book_id, b.book_name, b.author, COALESCE(b.price, 0) as price, ci.quantity,
+                   h.expires_at > ? AS held
+            FROM cartitems ci
+            JOIN books b ON ci.book_id = b.book_id
+            JOIN cart c ON ci.cart_id = c.cart_id
+            LEFT JOIN stock_holds h ON h.cart_id = ci.cart_id AND h.book_id = ci.book_id
+            WHERE c.buyer_id = ? AND c.status = 'open'
+        ''', (time.time(), session['user_id']))
+        cart_items = cur.fetchall()
+        return render_template('customer/cart.html', cart_items=cart_items, format_currency=format_currency)
+    except Exception as e:
+        flash(f'An error occurred: {e}', 'danger')
+        return redirect(url_for('customer.index'))
+
+
+@bp.route('/clear_cart', methods=['POST'])
+def clear_cart():
+    if 'user_id' not in session:
+        flash('You need to be logged in to clear your cart.', 'warning')
+        return redirect(url_for('customer.login'))
+
+    try:
+        db = get_db()
+        cart_id = db.execute("SELECT cart_id FROM cart WHERE buyer_id = ? AND status = 'open'",
+                             (session['user_id'],)).fetchone()
+        if cart_id:
+            stock_holds.release(db, cart_id['cart_id'])
+            db.execute('DELETE FROM cartitems WHERE cart_id = ?', (cart_id['cart_id'],))
+        db.commit()
+        flash('Your cart has been cleared.', 'success')
+    except Exception as e:
+        flash(f'An error occurred while clearing your cart: {e}', 'danger')
+
+    return redirect(url_for('customer.cart'))
+
+
+@bp.route('/checkout', methods=['GET', 'POST'])
+def checkout():
+    if 'user_id' not in session:
+        flash('You need to be logged in to checkout.', 'warning')
+        return redirect(url_for('customer.login'))
+
+    try:
+        db = get_db()
+        user_id = session['user_id']
+
+        # Get the cart items
+        cur = db.execute('''
+            SELECT b.book_name, b.desc, b.price, c.quantity, b.book_id, sh.shop_id, b.price as individual_price, 
+                            (c.quantity * b.price) as total_price, sh.shop_email, sh.shop_name, sh.owner_name,
+                            c.cart_id
+            FROM cartitems c
+            JOIN books b ON c.book_id = b.book_id
+            JOIN shop sh ON sh.shop_id = b.shop_id
+            WHERE c.cart_id = (SELECT cart_id FROM cart WHERE buyer_id = ? AND status = ?)
+        ''', (user_id, 'open'))
+        cart_items = cur.fetchall()
+
+        if not cart_items:
+            flash('Your cart is empty.', 'warning')
+            return redirect(url_for('customer.index'))
+
+        # Get the payment methods
+        cur = db.execute('SELECT method_id, method_name FROM paymentmethods')
+        payment_methods = cur.fetchall()
+
+        if request.method == 'POST':
+            # Create a new order
+            total_price = sum(item['price'] * item['quantity'] for item in cart_items)
+            address = request.form.get('address')  # Collect delivery address
+
+            cur = db.cursor()  # Use a cursor object to execute the insert command
+
+            # Retrieve the cart_id from the cart_items
+            cart_id = cart_items[0]['cart_id'] if cart_items else 0
+
+            # Calculate the platform fee
+            platform_fee = total_price * 0.05
+            total_price_with_fee = total_price + platform_fee
+
+            # Take the held stock; a hold that expired is only renewed if the copies are still there
+            short = stock_holds.convert(db, cart_id, [(item['book_id'], item['quantity']) for item in cart_items])
+            if short:
+                db.rollback()
+                names = ', '.join(item['book_name'] for item in cart_items if item['book_id'] in short)
+                flash(f'Not enough stock left for: {names}. Please update your cart.', 'warning')
+                return redirect(url_for('customer.cart'))
+            # Stock shows in the cached book grids, whose in_stock variant drops sold-out books
+            fragment_cache.bump_version(db)
+            invalidation.record(db, 'book', *(item['book_id'] for item in cart_items))
+
+            order_id = queries.run(db, 'create_order', cart_id=cart_id, buyer_id=user_id, subtotal=total_price,
+                                   total=total_price_with_fee, delivery_address=address).fetchone()[0]
+
+            for item in cart_items:
+                cur.execute(
+                    'INSERT INTO orderitems (order_id, book_id, shop_id, quantity, price, total_price) VALUES (?, ?, ?, ?, ?, ?)',
+                    (order_id, item['book_id'], item['shop_id'], item['quantity'], item['individual_price'],
+                     item['total_price']))
+
+            # Update cart status, in the same transaction as the stock and the order
+            cur.execute('UPDATE cart SET status = ? WHERE cart_id = ?', ('completed', cart_id))
+            db.commit()
+            cur.close()  # Close the cursor
+
+            flash('Your order has been placed successfully. Please proceed with the payment.', 'success')
+            return redirect(url_for('customer.payment', order_id=order_id))
+
+        total = sum(item['price'] * item['quantity'] for item in cart_items)
+        platform_fee = total * 0.05
+        total_with_fee = total + platform_fee
+
+        return render_template('customer/checkout.html', cart=cart_items, total=total, platform_fee=platform_fee,
+                               total_with_fee=total_with_fee, payment_methods=payment_methods,
+                               format_currency=format_currency)
+
+    except DB_ERRORS as e:
+        current_app.logger.error('Database error occurred: %s', e)
+        flash('An error occurred while processing your request. Please try again.', 'danger')
+    except Exception as e:
+        current_app.logger.error('Error occurred: %s', e)
+        flash('An unexpected error occurred. Please try again.', 'danger')
+    return redirect(url_for('customer.index'))
+
+
+@bp.route('/payment/<int:order_id>', methods=['GET', 'POST'])
+def payment(order_id):
+    import requests
+
+    if 'user_id' not in session:
+        flash('You need to be logged in to make a payment.', 'warning')
+        return redirect(url_for('customer.login'))
+
+    db = get_db()
+
+    # Fetch order details
+    order = db.execute('SELECT * FROM orders WHERE order_id = ?', (order_id,)).fetchone()
+
+    if request.method == 'POST':
+        if order is None:
+            flash('Order not found.', 'danger')
+            return redirect(url_for('customer.buyer_index'))
+        if order['status'] != 'initiated':
+            flash('This order has already been paid.', 'warning')
+            return redirect(url_for('customer.buyer_index'))
+
+        method_id = request.form.get('method')
+
+        # Retrieve method_name for method_id
+        method_name = db.execute('SELECT method_name FROM paymentmethods WHERE method_id = ?', (method_id,)).fetchone()[
+            'method_name']
+
+        # Define payment gateway API URL
+        payment_url = 'http://localhost:5001/process_payment'
+        data = {
+            "amount": order['total'],
+            "method_id": method_id,
+            "method_name": method_name,
+            "order_id": order_id
+        }
+
+        try:
+            response = outbound.post(payment_url, json=data)
+            try:
+                response_data = response.json()
+                if response.status_code == 200 and response_data['status'] == 'success':
+                    transaction_id = response_data['data']['transaction_id']
+                    payment_status = response_data['data']['payment_status']
+                    payment_total = order['total']  # Retrieve payment total from order
+
+                    # Insert payment details
+                    queries.run(db, 'record_payment', method_id=method_id, order_id=order_id,
+                                transaction_id=transaction_id, payment_status=payment_status,
+                                payment_total=payment_total)
+                    # Only the request that moves the order out of 'initiated' notifies and counts the sale
+                    paid = db.execute("UPDATE orders SET status = 'paid' WHERE order_id = ? AND status = 'initiated'",
+                                      (order_id,)).rowcount == 1
+                    if paid:
+                        notifications.enqueue_order_paid(db, order_id)
+                        leaderboards.record_order_paid(db, order_id)
+                    db.commit()
+                    if paid:
+                        events.publish_order_event(db, order_id, 'order', status='paid')
+                        flash('Payment successful!', 'success')
+                    else:
+                        flash('This order has already been paid.', 'warning')
+                else:
+                    flash('Payment declined by the gateway.', 'danger')
+            except requests.exceptions.JSONDecodeError:
+                flash('Payment gateway returned an invalid response.', 'danger')
+        except requests.ConnectionError:
+            flash('Failed to connect to the payment gateway.', 'danger')
+        except requests.Timeout:
+            flash('The payment gateway did not respond in time.', 'danger')
+
+        return redirect(url_for('customer.buyer_index'))
+
+    # Fetch available payment methods
+    methods = db.execute('SELECT * FROM paymentmethods').fetchall()
+    return render_template('customer/payment.html', order=order, methods=methods, format_currency=format_currency)
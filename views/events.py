@@ -0,0 +1,37 @@
+import time
+
+from flask import Blueprint, Response, current_app, request, session
+
+import events
+
+bp = Blueprint('events', __name__)
+
+
+@bp.route('/events/orders')
+def order_events():
+    if session.get('role') == 'buyer':
+        channels = [events.buyer_channel(session['user_id'])]
+    elif session.get('role') == 'shop':
+        channels = [events.shop_channel(session['shop_id'])]
+    else:
+        return 'Log in to follow your orders.', 401
+
+    last_event_id = request.headers.get('Last-Event-ID', type=int)
+    heartbeat = current_app.config['EVENTS_HEARTBEAT']
+    stream_timeout = current_app.config['EVENTS_STREAM_TIMEOUT']
+    retry = current_app.config['EVENTS_RETRY_MS']
+
+    def stream():
+        subscription = events.broker.subscribe(channels, last_event_id)
+        try:
+            yield f'retry: {retry}\n\n'
+            # Streams end after a while; the browser reconnects and resumes from Last-Event-ID
+            deadline = time.monotonic() + stream_timeout
+            while time.monotonic() < deadline and not subscription.closed:
+                event = subscription.get(heartbeat)
+                yield events.format_sse(event) if event else ': keepalive\n\n'
+        finally:
+            subscription.close()
+
+    return Response(stream(), mimetype='text/event-stream',
+                    headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'})
@@ -0,0 +1,156 @@
+import datetime
+
+from flask import Blueprint, render_template, redirect, url_for, flash, session
+
+import events
+import invalidation
+import outbound
+from database import get_db
+from tracking import get_tracking_cache
+
+bp = Blueprint('shipment', __name__)
+
+
+@bp.route('/shop/create_shipment/<int:order_id>', methods=['POST'])
+def create_shipment_route(order_id):
+    import requests
+
+    if session.get('role') != 'shop':
+        flash('You need to be logged in as a shop to perform this action.', 'warning')
+        return redirect(url_for('shop.shop_login'))
+
+    try:
+        db = get_db()
+        # Check if order exists
+        order = db.execute('SELECT * FROM orders WHERE order_id = ?', (order_id,)).fetchone()
+        if not order:
+            flash('Order not found!', 'danger')
+            return redirect(url_for('shop.shop_order'))
+
+        # Call external shipment service
+        shipment_service_url = 'http://localhost:5002/initiate_shipment'
+        shipment_service_payload = {
+            'order_id': order_id,
+            'shipment_service': 'default_service'  # or any other parameter as needed
+        }
+
+        response = outbound.post(shipment_service_url, json=shipment_service_payload)
+        shipment_response = response.json()
+
+        if shipment_response.get('status') == 'success':
+            events.publish_order_event(db, order_id, 'order', status='Shipped',
+                                       tracking_no=shipment_response['tracking_no'])
+            flash('Shipment created successfully!', 'success')
+        else:
+            flash(f"Failed to create shipment: {shipment_response.get('message', 'Unknown error.')}", 'danger')
+
+    except requests.exceptions.RequestException as e:
+        flash(f'An error occurred while contacting the shipment service: {e}', 'danger')
+    except Exception as e:
+        flash(f'An error occurred: {e}', 'danger')
+
+    return redirect(url_for('shipment.view_shipments'))
+
+
+@bp.route('/shop/view_shipments')
+def view_shipments():
+    if session.get('role') != 'shop':
+        flash('You need to be logged in as a shop to access this page.', 'warning')
+        return redirect(url_for('shop.shop_login'))
+
+    try:
+        db = get_db()
+        shipments = db.execute('''
+            SELECT s.*, o.order_date, o.delivery_address
+            FROM shipment s
+            JOIN orders o ON s.order_id = o.order_id
+            JOIN orderitems oi ON oi.order_id = o.order_id
+            WHERE oi.shop_id = ?
+        ''', (session.get('shop_id'),)).fetchall()
+
+        return render_template('shop/view_shipments.html', shipments=shipments)
+
+    except Exception as e:
+        flash(f'An error occurred: {e}', 'danger')
+
+    return redirect(url_for('shop.shop_dashboard'))
+
+
+@bp.route('/buyer/view_shipments')
+def buyer_view_shipments():
+    if session.get('role') != 'buyer':
+        flash('You need to be logged in as a buyer to access this page.', 'warning')
+        return redirect(url_for('customer.login'))
+
+    try:
+        db = get_db()
+        shipments = db.execute('''
+                 SELECT s.shipment_id, s.order_id, s.tracking_no, s.shipment_date, s.received_date, s.status, s.shipment_service,
+                        o.order_date, o.delivery_address
+                 FROM shipment s
+                 INNER JOIN orders o ON s.order_id = o.order_id
+                 WHERE o.buyer_id = ?
+             ''', (session.get('user_id'),)).fetchall()
+
+        return render_template('customer/view_shipments.html', shipments=shipments)
+
+    except Exception as e:
+        flash(f'An error occurred: {e}', 'danger')
+
+    return redirect(url_for('customer.buyer_index'))
+
+
+@bp.route('/buyer/track_shipment/<tracking_no>')
+def track_shipment_route(tracking_no):
+    import requests
+
+    if session.get('role') != 'buyer':
+        flash('You need to be logged in as a buyer to perform this action.', 'warning')
+        return redirect(url_for('customer.login'))
+
+    try:
+        # Call external shipment tracking service
+        tracking_service_url = f'http://localhost:5002/track_shipment/{tracking_no}'
+
+        tracking_response = get_tracking_cache().get(
+            tracking_no, lambda: outbound.get(tracking_service_url).json())
+
+        if tracking_response.get('status') == 'success':
+            tracking_info = tracking_response['shipment_data']
+            return render_template('customer/track_shipment.html', tracking_info=tracking_info)
+        else:
+            flash(tracking_response.get('message', 'An error occurred during shipment tracking.'), 'danger')
+
+    except requests.exceptions.RequestException as e:
+        flash(f'An error occurred while contacting the shipment service: {e}', 'danger')
+    except Exception as e:
+        flash(f'An error occurred: {e}', 'danger')
+
+    return redirect(url_for('customer.buyer_index'))
+
+
+@bp.route('/buyer/resolve_shipment/<tracking_no>', methods=['POST'])
+def resolve_shipment(tracking_no):
+    if session.get('role') != 'buyer':
+        flash('You need to be logged in as a buyer to perform this action.', 'warning')
+        return redirect(url_for('customer.login'))
+
+    try:
+        # Perform actions needed to resolve the shipment
+        # For example, update shipment status in database
+        db = get_db()
+        received_date = datetime.datetime.now().isoformat()
+        db.execute('UPDATE shipment SET status = ?, received_date = ? WHERE tracking_no = ?', ('Delivered', received_date,  tracking_no))
+        invalidation.record(db, 'shipment', tracking_no)
+        db.commit()
+        get_tracking_cache().invalidate(tracking_no)
+        shipment = db.execute('SELECT order_id FROM shipment WHERE tracking_no = ?', (tracking_no,)).fetchone()
+        if shipment:
+            events.publish_order_event(db, shipment['order_id'], 'order', status='Delivered',
+                                       tracking_no=tracking_no, received_date=received_date)
+        flash('Shipment has been resolved.', 'success')
+
+    except Exception as e:
+        flash(f'An error occurred while resolving the shipment: {e}', 'danger')
+
+    return redirect(url_for('shipment.track_shipment_route', tracking_no=tracking_no))
@@ -0,0 +1,518 @@
+import os
+
+from flask import Blueprint, render_template, request, redirect, url_for, flash, session, current_app, jsonify
+from werkzeug.utils import secure_filename
+
+import archive
+import bulk_edit
+import credentials
+import fragment_cache
+import invalidation
+import leaderboards
+import reporting
+from backends import DB_ERRORS, INTEGRITY_ERRORS
+from database import get_db, get_report_db
+from views import format_currency
+
+bp = Blueprint('shop', __name__)
+
+
+@bp.route('/shop/dashboard')
+def shop_dashboard():
+    if session.get('role') != 'shop':
+        flash('You need to be logged in as a shop to access this page.', 'warning')
+        return redirect(url_for('shop.shop_login'))
+    
+    db = get_report_db()
+    shop_id = session.get('shop_id')
+
+    query_total_books = '''
+    SELECT 
+        SUM(orderitems.quantity) AS total_books_sold
+    FROM 
+        orders
+    JOIN orderitems
+    ON 
+        orders.order_id = orderitems.order_id
+    WHERE 
+        orders.status IN ('paid', 'Shipped') AND
+        orderitems.shop_id = ?
+    '''
+    cur = db.execute(query_total_books, (shop_id,))
+    total_books_sold = cur.fetchone()['total_books_sold']
+
+    query_total_sales = '''
+    SELECT 
+        SUM(orderitems.total_price) AS total_sales
+    FROM 
+        orders
+    JOIN orderitems
+    ON 
+        orders.order_id = orderitems.order_id
+    WHERE 
+        orders.status IN ('paid', 'Shipped') AND
+        orderitems.shop_id = ?
+    '''
+    cur = db.execute(query_total_sales, (shop_id,))
+    total_sales = cur.fetchone()['total_sales']
+
+    query_orders = '''
+    SELECT 
+    orders.order_id, orders.buyer_id, 
+    orders.order_date, orders.subtotal, orders.total, 
+    orders.status, orders.delivery_address, shipment.status
+
+    FROM 
+        orders
+    JOIN orderitems
+    ON 
+        orders.order_id = orderitems.order_id
+    LEFT JOIN shipment
+    ON
+        orders.order_id = shipment.order_id
+    WHERE 
+        orders.status IN ('paid', 'Shipped') AND
+        orderitems.shop_id = ?
+    
+    '''
+
+    cur = db.execute(query_orders, (shop_id,))
+    orders = cur.fetchall()
+    snapshot_taken_at, _ = reporting.snapshot_status(db)
+    # Leaderboards are tiny indexed reads, so they come from the live database rather than the snapshot
+    top_sellers = {days: leaderboards.top_sellers(get_db(), 'shop', shop_id, window_days=days, limit=5)
+                   for days in leaderboards.WINDOWS}
+    
+    return render_template('shop/dashboard.html', orders=orders, total_books_sold=total_books_sold, total_sales=total_sales,
+                           snapshot_taken_at=snapshot_taken_at, top_sellers=top_sellers)
+
+
+@bp.route('/shop/detail_order/<int:order_id>', methods=['GET', 'POST'])
+def detail_order(order_id):
+    if session.get('role') != 'shop':
+        flash('You need to be logged in as a shop to access this page.', 'warning')
+        return redirect(url_for('shop.shop_login'))
+
+    db = get_db()
+    shop_id = session.get('shop_id')
+    query_orders = '''
+    SELECT 
+        orders.order_id, buyer.buyer_id, buyer.username AS buyer_name, 
+        books.book_name, orderitems.quantity, orderitems.price, 
+        orderitems.total_price, orders.total, orders.order_date, 
+        orders.delivery_address, orders.status
+
+    FROM 
+        {orders} AS orders
+    JOIN {orderitems} AS orderitems ON orders.order_id = orderitems.order_id
+    JOIN buyer ON orders.buyer_id = buyer.buyer_id
+    JOIN books ON books.book_id = orderitems.book_id
+    WHERE 
+        orders.status IN ('paid', 'Shipped') AND
+        orderitems.shop_id = ? AND
+        orders.order_id = ?
+    '''
+
+    cur = db.execute(query_orders.format(orders='orders', orderitems='orderitems'), (shop_id, order_id))
+    orders = cur.fetchall()
+
+    if not orders:
+        # Orders past the archive cutoff are only in the history database, which a read never creates
+        if archive.attach_history(db, current_app.config['HISTORY_DATABASE'], read_only=True):
+            cur = db.execute(query_orders.format(orders='all_orders', orderitems='all_orderitems'),
+                             (shop_id, order_id))
+            orders = cur.fetchall()
+
+    return render_template('shop/detail_order.html', orders=orders)
+
+
+@bp.route('/shop/order', methods=['Get'])
+def shop_order():
+    if session.get('role') != 'shop':
+        flash('You need to be logged in as a shop to access this page.', 'warning')
+        return redirect(url_for('shop.shop_login'))
+    
+    db = get_db()
+    shop_id = session.get('shop_id')
+
+    query = '''
+    SELECT 
+        orders.order_id, orders.buyer_id, 
+        orders.order_date, orders.subtotal, orders.total, 
+        orders.status, orders.delivery_address, shipment.status AS shipment_status
+    FROM 
+        orders
+     LEFT JOIN 
+        shipment 
+    ON 
+        orders.order_id = shipment.order_id
+    JOIN orderitems
+    ON 
+        orders.order_id = orderitems.order_id
+    WHERE 
+        orderitems.shop_id = ?
+    '''
+
+    cur = db.execute(query, (shop_id,))
+    orders = cur.fetchall()
+
+    return render_template('shop/orders.html', orders=orders)
+
+
+@bp.route('/shop/register', methods=['GET', 'POST'])
+def shop_register():
+    from forms import ShopRegisterForm
+
+    form = ShopRegisterForm()
+    if form.validate_on_submit():
+        shop_name = form.shop_name.data
+        owner_name = form.owner_name.data
+        shop_phone = form.shop_phone.data
+        password = form.password.data
+        shop_address = form.shop_address.data
+        shop_email = form.shop_email.data
+        shop_description = form.shop_description.data
+
+        try:
+            hashed_password = credentials.hash_password(password)
+            db = get_db()
+            db.execute('''INSERT INTO shop (shop_name, owner_name, shop_phone, shop_address, shop_email, shop_description, password)
+                          VALUES (?, ?, ?, ?, ?, ?, ?)''',
+                       (shop_name, owner_name, shop_phone, shop_address, shop_email, shop_description, hashed_password))
+            db.commit()
+            flash('Your shop has been successfully registered! Please log in.', 'success')
+            return redirect(url_for('shop.shop_login'))
+        except INTEGRITY_ERRORS:
+            flash('Shop name, email or phone number already exists.', 'danger')
+        except credentials.CredentialError as e:
+            flash(str(e), 'danger')
+        except Exception as e:
+            flash(f'An error occurred: {e}', 'danger')
+
+    return render_template('shop/shop_register.html', form=form)
+
+
+@bp.route('/shop/login', methods=['GET', 'POST'])
+def shop_login():
+    from forms import LoginForm
+
+    form = LoginForm()
+    if form.validate_on_submit():
+        shop_name = form.username.data
+        password = form.password.data
+
+        db = get_db()
+        cur = db.execute('SELECT * FROM shop WHERE shop_name = ?', (shop_name,))
+        shop = cur.fetchone()
+
+        try:
+            if credentials.check_login(f'shop:{shop_name}', shop['password'] if shop else None, password):
+                credentials.rehash_if_needed(db, 'shop', 'shop_id', shop['shop_id'], shop['password'], password)
+                session['shop_id'] = shop['shop_id']
+                session['shop_name'] = shop['shop_name']
+                session['role'] = 'shop'
+                if not is_shop_verified(shop['shop_id']):
+                    session['verification_message'] = 'Your shop is not verified. Please contact admin.'
+                    return redirect(url_for('customer.logout'))
+                flash('Login successful!', 'success')
+                return redirect(url_for('shop.manage_books'))
+            else:
+                flash('Invalid shop name or password.', 'danger')
+        except credentials.CredentialError as e:
+            flash(str(e), 'danger')
+
+    return render_template('shop/shop_login.html', form=form)
+
+
+def is_shop_verified(shop_id):
+    db = get_db()
+    cur = db.execute('SELECT isverified FROM shop WHERE shop_id = ?', (shop_id,))
+    shop = cur.fetchone()
+    return shop and shop['isverified'] == 1
+
+
+@bp.route('/shop/profile', methods=['GET'])
+def profile():
+    if session.get('role') != 'shop':
+        flash('You need to be logged in as a shop to access this page.', 'warning')
+        return redirect(url_for('shop.shop_login'))
+    
+    report_db = get_report_db()
+    shop_id = session.get('shop_id')
+
+    query_total_books = '''
+    SELECT 
+        SUM(books.stock) AS total_books
+    FROM 
+        books
+    WHERE 
+        books.shop_id = ?
+    '''
+    cur = report_db.execute(query_total_books, (shop_id,))
+    total_books = cur.fetchone()['total_books']
+
+    query_total_sales = '''
+    SELECT 
+        SUM(orderitems.total_price) AS total_sales
+    FROM 
+        orders
+    JOIN orderitems
+    ON 
+        orders.order_id = orderitems.order_id
+    WHERE 
+        orders.status IN ('paid', 'Shipped') AND
+        orderitems.shop_id = ?
+    '''
+    cur = report_db.execute(query_total_sales, (shop_id,))
+    total_sales = cur.fetchone()['total_sales']
+    snapshot_taken_at, _ = reporting.snapshot_status(report_db)
+
+    # The profile itself comes from the live database so edits show up immediately
+    db = get_db()
+    cur = db.execute('SELECT * FROM shop WHERE shop_id = ?', (shop_id,))
+    shop_data = cur.fetchone()
+
+    return render_template('shop/profile.html', shop_data=shop_data, total_books=total_books, total_sales=total_sales,
+                           snapshot_taken_at=snapshot_taken_at)
+
+
+@bp.route('/shop/edit_profile/<int:shop_id>', methods=['GET', 'POST'])
+def edit_profile(shop_id):
+    from forms import ShopUpdateForm
+
+    if session.get('role') != 'shop':
+        flash('You need to be logged in as a shop to access this page.', 'warning')
+        return redirect(url_for('shop.shop_login'))
+
+    db = get_db()
+    form = ShopUpdateForm()
+
+    # Fetch current shop data
+    shop_data = db.execute('SELECT * FROM shop WHERE shop_id = ?', (shop_id,)).fetchone()
+
+    if not shop_data or shop_data['shop_id'] != session.get('shop_id'):
+        flash('Shop data not found or you do not have permission to edit this profile.', 'danger')
+        return redirect(url_for('shop.profile'))
+
+    if request.method == 'GET':
+        # Populate form with current shop data
+        form.shop_name.data = shop_data['shop_name']
+        form.owner_name.data = shop_data['owner_name']
+        form.shop_phone.data = shop_data['shop_phone']
+        form.shop_address.data = shop_data['shop_address']
+        form.shop_email.data = shop_data['shop_email']
+        form.shop_description.data = shop_data['shop_description']
+
+    if form.validate_on_submit():
+        shop_name = form.shop_name.data
+        owner_name = form.owner_name.data
+        shop_phone = form.shop_phone.data
+        shop_address = form.shop_address.data
+        shop_email = form.shop_email.data
+        shop_description = form.shop_description.data
+
+        try:
+            db.execute('''
+                UPDATE shop
+                SET shop_name = ?, owner_name = ?, shop_phone = ?, shop_address = ?, shop_email = ?, shop_description = ?
+                WHERE shop_id = ?
+            ''', (
+                shop_name, owner_name, shop_phone, shop_address, shop_email, shop_description, shop_id
+            ))
+            db.commit()
+            flash('Shop profile updated successfully!', 'success')
+            return redirect(url_for('shop.profile'))
+        except Exception as e:
+            flash(f'An error occurred: {e}', 'danger')
+
+    return render_template('shop/edit_profile.html', form=form, shop_id=shop_id)
+
+
+@bp.route('/shop/manage_books', methods=['GET', 'POST'])
+def manage_books():
+    if session.get('role') != 'shop':
+        flash('You need to be logged in as a shop to access this page.', 'warning')
+        return redirect(url_for('shop.shop_login'))
+
+    db = get_db()
+    shop_id = session.get('shop_id')
+
+    query = '''
+    SELECT 
+        c.book_id, c.book_name, c.isbn, c.author, c.price, c.stock, c.img_url, c.category_name, b.version
+    FROM 
+        book_cards c
+        JOIN books b ON b.book_id = c.book_id
+    WHERE 
+        c.shop_id = ?
+    '''
+
+    cur = db.execute(query, (shop_id,))
+    books = cur.fetchall()
+
+    return render_template('shop/manage_books.html', books=books, format_currency=format_currency)
+
+
+@bp.route('/shop/manage_books/bulk', methods=['POST'])
+def bulk_edit_books():
+    if session.get('role') != 'shop':
+        return jsonify({'status': 'error', 'message': 'Log in as a shop to edit books.'}), 401
+
+    body = request.get_json(silent=True)
+    if not isinstance(body, dict):
+        return jsonify({'status': 'error', 'message': 'Send a JSON object with a list of changes.'}), 400
+    try:
+        changes = bulk_edit.parse_changes(body.get('changes'))
+    except ValueError as e:
+        return jsonify({'status': 'error', 'message': str(e)}), 400
+
+    db = get_db()
+    try:
+        result = bulk_edit.apply_changes(db, session['shop_id'], changes)
+        if result['updated']:
+            fragment_cache.bump_version(db)
+            invalidation.record(db, 'book', *(book['book_id'] for book in result['updated']))
+            # A new price or stock can move a book into a price band or in-stock listing of its category
+            invalidation.record(db, 'listing', *(row[0] for row in db.execute(
+                'SELECT DISTINCT category_id FROM books WHERE shop_id = ?', (session['shop_id'],))))
+        db.commit()
+    except DB_ERRORS as e:
+        db.rollback()
+        current_app.logger.error('Bulk edit failed: %s', e)
+        return jsonify({'status': 'error', 'message': 'Database error occurred.'}), 500
+    return jsonify({'status': 'success', **result})
+
+
+@bp.route('/shop/add_book', methods=['GET', 'POST'])
+def add_book():
+    from forms import BookForm
+
+    if session.get('role') != 'shop':
+        flash('You need to be logged in as a shop to access this page.', 'warning')
+        return redirect(url_for('shop.shop_login'))
+
+    form = BookForm()
+    db = get_db()
+
+    # Fetch categories for the category dropdown
+    categories = db.execute('SELECT * FROM categories').fetchall()
+    form.category_id.choices = [(c['category_id'], c['category_name']) for c in categories]
+
+    if form.validate_on_submit():
+        book_name = form.book_name.data
+        isbn = form.isbn.data
+        author = form.author.data
+        desc = form.desc.data
+        price = form.price.data
+        stock = form.stock.data
+        category_id = form.category_id.data
+        shop_id = session.get('shop_id')
+        image_file = save_image(form.image.data)
+
+        try:
+            cur = db.execute('''
+                INSERT INTO books (category_id, shop_id, book_name, isbn, author, "desc", price, stock, img_url) 
+                VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)
+                RETURNING book_id
+            ''', (category_id, shop_id, book_name, isbn, author, desc, price, stock, image_file))
+            book_id = cur.fetchone()[0]
+            fragment_cache.bump_version(db)
+            invalidation.record(db, 'listing', category_id)
+            db.commit()
+            flash('Book added successfully!', 'success')
+            return redirect(url_for('shop.manage_books'))
+        except Exception as e:
+            flash(f'An error occurred: {e}', 'danger')
+
+    return render_template('shop/add_book.html', form=form)
+
+
+def save_image(file):
+    if not file:
+        return None
+    filename = secure_filename(file.filename)
+    filepath = os.path.join(current_app.config['UPLOAD_FOLDER'], filename)
+    file.save(filepath)
+    return filename
+
+
+@bp.route('/shop/edit_book/<int:book_id>', methods=['GET', 'POST'])
+def edit_book(book_id):
+    from forms import BookForm
+
+    if session.get('role') != 'shop':
+        flash('You need to be logged in as a shop to access this page.', 'warning')
+        return redirect(url_for('shop.shop_login'))
+
+    db = get_db()
+    form = BookForm()
+
+    # Fetch categories for the category dropdown
+    categories = db.execute('SELECT * FROM categories').fetchall()
+    form.category_id.choices = [(c['category_id'], c['category_name']) for c in categories]
+
+    book = db.execute('SELECT * FROM books WHERE book_id = ? AND shop_id = ?', (book_id, session['shop_id'])).fetchone()
+    if not book:
+        flash('Book not found or you do not have permission to edit this book.', 'warning')
+        return redirect(url_for('shop.manage_books'))
+
+    if form.validate_on_submit():
+        book_name = form.book_name.data
+        isbn = form.isbn.data
+        author = form.author.data
+        desc = form.desc.data
+        price = form.price.data
+        stock = form.stock.data
+        category_id = form.category_id.data
+
+        # Check if a new image file is uploaded
+        if form.image.data:
+            image_file = save_image(form.image.data)
+        else:
+            image_file = book['img_url']
+
+        try:
+            db.execute('''
+                UPDATE books 
+                SET category_id = ?, book_name = ?, isbn = ?, author = ?, "desc" = ?, price = ?, stock = ?, img_url = ?,
+                    version = version + 1
+                WHERE book_id = ? AND shop_id = ?
+            ''', (category_id, book_name, isbn, author, desc, price, stock, image_file, book_id, session['shop_id']))
+            fragment_cache.bump_version(db)
+            invalidation.record(db, 'book', book_id)
+            # The book may now match listings it was not in: its new category, price band or in-stock
+            invalidation.record(db, 'listing', category_id)
+            db.commit()
+            flash('Book updated successfully!', 'success')
+            return redirect(url_for('shop.manage_books'))
+        except Exception as e:
+            flash(f'An error occurred: {e}', 'danger')
+
+    form.book_name.data = book['book_name']
+    form.isbn.data = book['isbn']
+    form.author.data = book['author']
+    form.desc.data = book['desc']
+    form.price.data = book['price']
+    form.stock.data = book['stock']
+    form.category_id.data = book['category_id']
+
+    return render_template('shop/edit_book.html', form=form, book_id=book_id)
+
+
+@bp.route('/shop/delete_book/<int:book_id>', methods=['POST'])
+def delete_book(book_id):
+    if session.get('role') != 'shop':
+        flash('You need to be logged in as a shop to access this page.', 'warning')
+        return redirect(url_for('shop.shop_login'))
+
+    db = get_db()
+    try:
+        db.execute('DELETE FROM books WHERE book_id = ? AND shop_id = ?', (book_id, session['shop_id']))
+        fragment_cache.bump_version(db)
+        invalidation.record(db, 'book', book_id)
+        db.commit()
+        flash('Book deleted successfully!', 'success')
+    except Exception as e:
+        flash(f'An error occurred: {e}', 'danger')
+
+    return redirect(url_for('shop.manage_books'))
@@ -0,0 +1,237 @@
+"""Warm a new worker from the pages that were hot before it started.
+
+Every worker counts its successful GETs of the pages in WARM_ENDPOINTS
+(book pages, the storefront listings, shop dashboards) and the templates
+it renders. Every WARMUP_RECORD_INTERVAL seconds it merges its counts into
+WARMUP_FILE and keeps the WARMUP_TOP_N hottest of each. Workers merge one
+at a time under a lock file, and the counts already there are halved for
+every WARMUP_RECORD_INTERVAL since the file was saved, so the file follows
+current traffic however many workers write to it.
+
+A starting worker compiles the recorded templates and replays the recorded
+pages through the test client, hottest first, until WARMUP_BUDGET seconds
+are spent. That fills the fragment cache and reads the hot rows and index
+pages into the OS page cache (request connections are short-lived, so
+SQLite's own page cache does not outlive a request). /ready answers 503
+until the worker is warm, so a load balancer that checks it only sends
+traffic to warm workers. With ``gunicorn --preload`` the master warms up
+before forking and the workers start warm.
+
+Warm a fresh app by hand and print what it did with ``python warmup.py``.
+"""
+import argparse
+import fcntl
+import json
+import logging
+import os
+import threading
+import time
+from collections import Counter
+
+from flask import current_app, has_request_context, jsonify, request, session, template_rendered
+
+logger = logging.getLogger(__name__)
+
+# Endpoint: the session a replay needs (None, or the role it is rendered for)
+WARM_ENDPOINTS = {
+    'customer.book': None,
+    'customer.buyer_index': 'buyer',
+    'shop.shop_dashboard': 'shop',
+    'shop.manage_books': 'shop',
+}
+# Set in the WSGI environ of replayed requests; a server only puts HTTP_* keys there for clients
+WARMUP_ENVIRON = 'penta_book.warmup'
+
+# Replays are rendered for this buyer id, which no account has
+WARMUP_BUYER_ID = -1
+
+
+class Recorder:
+    def __init__(self):
+        self.pages = Counter()
+        self.templates = Counter()
+        self._lock = threading.Lock()
+
+    def count_page(self, key):
+        with self._lock:
+            self.pages[key] += 1
+
+    def count_template(self, name):
+        with self._lock:
+            self.templates[name] += 1
+
+    def take(self):
+        with self._lock:
+            pages, templates = self.pages, self.templates
+            self.pages, self.templates = Counter(), Counter()
+        return pages, templates
+
+
+def load(path):
+    try:
+        with open(path) as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {'pages': [], 'templates': []}
+
+
+def save(path, pages, templates, top_n, half_life):
+    """Merge new counts into the file at path; the counts already there halve every half_life seconds."""
+    # Held across read, merge and replace, so one worker's save never drops another's
+    with open(f'{path}.lock', 'a') as lock:
+        fcntl.flock(lock, fcntl.LOCK_EX)
+        return _merge(path, pages, templates, top_n, half_life)
+
+
+def _merge(path, pages, templates, top_n, half_life):
+    recorded = load(path)
+    now = time.time()
+    decay = 0.5 ** (max(now - recorded.get('saved_at', now), 0) / half_life)
+    page_hits = Counter({(page['path'], page['role'], page['shop_id']): page['hits'] * decay
+                         for page in recorded['pages']})
+    page_hits.update(pages)
+    template_hits = Counter({template['name']: template['hits'] * decay for template in recorded['templates']})
+    template_hits.update(templates)
+
+    data = {
+        'saved_at': now,
+        'pages': [{'path': path_, 'role': role, 'shop_id': shop_id, 'hits': round(hits, 2)}
+                  for (path_, role, shop_id), hits in page_hits.most_common(top_n) if hits >= 0.5],
+        'templates': [{'name': name, 'hits': round(hits, 2)}
+                      for name, hits in template_hits.most_common(top_n) if hits >= 0.5],
+    }
+    # Written whole and moved into place, so a starting worker never reads half a file
+    tmp_path = f'{path}.{os.getpid()}.tmp'
+    with open(tmp_path, 'w') as f:
+        json.dump(data, f, indent=1)
+    os.replace(tmp_path, path)
+    return data
+
+
+def warm(app, budget=None):
+    """Compile the recorded templates and replay the recorded pages within budget seconds."""
+    state = app.extensions['warmup']
+    budget = app.config['WARMUP_BUDGET'] if budget is None else budget
+    deadline = time.monotonic() + budget
+    recorded = load(app.config['WARMUP_FILE'])
+    templates = pages = failed = 0
+    started = time.monotonic()
+    try:
+        for template in recorded['templates']:
+            if time.monotonic() >= deadline:
+                break
+            try:
+                app.jinja_env.get_template(template['name'])
+                templates += 1
+            except Exception as e:
+                logger.info('Warm-up skipped template %s: %s', template['name'], e)
+
+        client = app.test_client()
+        for page in recorded['pages']:
+            if time.monotonic() >= deadline:
+                break
+            with client.session_transaction() as replay_session:
+                replay_session.clear()
+                if page['role'] == 'buyer':
+                    replay_session.update(user_id=WARMUP_BUYER_ID, role='buyer')
+                elif page['role'] == 'shop':
+                    replay_session.update(shop_id=page['shop_id'], role='shop')
+            response = client.get(page['path'], environ_base={WARMUP_ENVIRON: True})
+            if response.status_code == 200:
+                pages += 1
+            else:
+                failed += 1
+    finally:
+        state['result'] = {'templates': templates, 'pages': pages, 'failed': failed,
+                           'seconds': round(time.monotonic() - started, 3)}
+        state['ready'] = True
+    logger.info('Warm-up done: %s', state['result'])
+    return state['result']
+
+
+def start_warmup_thread(app):
+    """Warm this worker in a daemon thread, unless it was already warmed before fork."""
+    state = app.extensions.get('warmup')
+    if state is None or state['ready']:
+        return None
+    thread = threading.Thread(target=warm, args=(app,), name='warmup', daemon=True)
+    thread.start()
+    return thread
+
+
+def start_recorder_thread(app):
+    """Merge this worker's counts into WARMUP_FILE every WARMUP_RECORD_INTERVAL seconds."""
+    interval = app.config['WARMUP_RECORD_INTERVAL']
+    if 'warmup' not in app.extensions or interval <= 0:
+        return None
+    recorder = app.extensions['warmup']['recorder'] = Recorder()
+
+    def run():
+        while True:
+            time.sleep(interval)
+            pages, templates = recorder.take()
+            if not pages and not templates:
+                continue
+            try:
+                save(app.config['WARMUP_FILE'], pages, templates, app.config['WARMUP_TOP_N'], interval)
+            except OSError as e:
+                logger.error('Saving warm-up keys failed: %s', e)
+
+    thread = threading.Thread(target=run, name='warmup-recorder', daemon=True)
+    thread.start()
+    return thread
+
+
+def _record_page(response):
+    recorder = current_app.extensions['warmup'].get('recorder')
+    if (recorder is None or request.method != 'GET' or response.status_code != 200
+            or request.endpoint not in WARM_ENDPOINTS or is_replay()):
+        return response
+    role = WARM_ENDPOINTS[request.endpoint]
+    shop_id = session.get('shop_id') if role == 'shop' else None
+    recorder.count_page((request.full_path.rstrip('?'), role, shop_id))
+    return response
+
+
+def _record_template(app, template, context, **extra):
+    recorder = app.extensions['warmup'].get('recorder')
+    if recorder is not None and template.name and not (has_request_context() and is_replay()):
+        recorder.count_template(template.name)
+
+
+def is_replay():
+    return bool(request.environ.get(WARMUP_ENVIRON))
+
+
+def ready():
+    state = current_app.extensions.get('warmup')
+    if state is None or state['ready']:
+        return jsonify({'status': 'ready', 'warmup': state and state['result']})
+    return jsonify({'status': 'warming'}), 503, {'Retry-After': '1'}
+
+
+def init_app(app):
+    app.add_url_rule('/ready', 'ready', ready)
+    if not app.config['WARMUP_ENABLED']:
+        return
+    app.extensions['warmup'] = {'ready': False, 'result': None, 'recorder': None}
+    app.after_request(_record_page)
+    template_rendered.connect(_record_template, app)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Warm a fresh app from the recorded hot pages.')
+    parser.add_argument('--budget', type=float, default=None, help='seconds to spend (default WARMUP_BUDGET)')
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO)
+    from app import create_app
+    app = create_app()
+    if 'warmup' not in app.extensions:
+        print('WARMUP_ENABLED is off.')
+        return
+    print(warm(app, args.budget))
+
+
+if __name__ == '__main__':
+    main()
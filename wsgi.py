@@ -0,0 +1,22 @@
+"""WSGI entry point for preforking servers.
+
+    gunicorn --preload -w 4 wsgi:app
+
+With --preload the app, its imports and compiled templates are built once in
+the master and shared copy-on-write by the forked workers. The master also
+replays the recorded hot pages (see warmup.py), so workers fork warm; point
+the load balancer's health check at /ready.
+
+/events/orders keeps a connection open per watching browser. Order events
+go through the order_events table and every worker relays them to its own
+streams (see events.py), so they reach a browser whichever worker it is
+connected to. Greenlet workers hold thousands of idle streams cheaply and
+let payment and shipment requests wait on the gateways without holding a
+thread each (see outbound.py):
+
+    gunicorn --preload -k gevent --worker-connections 5000 -w 4 wsgi:app
+"""
+from app import create_app, preload
+
+app = create_app()
+preload(app)